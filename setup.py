@@ -3,4 +3,5 @@
 
 from setuptools import setup, find_packages
 
-setup(name='tetra', packages=find_packages())
+setup(name='tetra', packages=find_packages(),
+      entry_points={'console_scripts': ['tetra = tetra.cli:main']})
@@ -0,0 +1,4 @@
+import sys
+from tetra.cli import main
+
+sys.exit(main())
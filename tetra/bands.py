@@ -0,0 +1,92 @@
+import numpy as np
+
+class BandArray:
+    '''Contiguous band-major storage for per-(band, k-point) values such as
+    band energies E_n(k) or matrix elements X_n(k).
+
+    The values are held in the numpy array data with shape
+    (num_bands, num_ks), so that data[band_index] is contiguous over the
+    k-points and per-band sweeps over tetrahedra gather from a single row.
+
+    For compatibility with code written for lists of per-k lists, a
+    BandArray may also be indexed by k-point first: Eks[kN][band_index] is
+    data[band_index, kN], len(Eks) is num_ks, iteration is over k-points, and
+    np.asarray(Eks) has shape (num_ks, num_bands).
+
+    data = array-like with shape (num_bands, num_ks).
+
+    dtype = storage type; numpy.float64 by default. numpy.float32 halves the
+    memory use, at the cost of single-precision band energies, which is
+    usually acceptable for e.g. plotting the density of states.
+    Calculations always accumulate in double precision. If data is complex
+    (e.g. complex matrix elements X_n(k)) and dtype is real, the complex
+    type of the same precision is used instead, so that the imaginary parts
+    are kept.
+    '''
+    def __init__(self, data, dtype=np.float64):
+        data = np.asarray(data)
+        self.data = np.ascontiguousarray(data, dtype=_storage_dtype(dtype, data))
+        if self.data.ndim != 2:
+            raise ValueError("BandArray data must have shape (num_bands, num_ks).")
+
+    @classmethod
+    def FromKMajor(cls, values, dtype=np.float64):
+        '''Return a BandArray holding values, given in the layout
+        values[kN][band_index] (e.g. a list of per-k lists, or an array with
+        shape (num_ks, num_bands)).
+        '''
+        values = np.asarray(values)
+        return cls(values.astype(_storage_dtype(dtype, values), copy=False).T, dtype)
+
+    @property
+    def num_bands(self):
+        return self.data.shape[0]
+
+    @property
+    def num_ks(self):
+        return self.data.shape[1]
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def __getitem__(self, kN):
+        return self.data[:, kN]
+
+    def __iter__(self):
+        for kN in range(self.data.shape[1]):
+            yield self.data[:, kN]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.data.T
+        if dtype is not None:
+            values = values.astype(dtype)
+        elif copy:
+            values = values.copy()
+        return values
+
+    def __repr__(self):
+        return "BandArray(num_bands={}, num_ks={}, dtype={})".format(self.num_bands,
+                self.num_ks, self.dtype)
+
+def _band_major(values):
+    '''Return values (a BandArray, or values given in the layout
+    values[kN][band_index]) as a C-contiguous numpy array with shape
+    (num_bands, num_ks). A BandArray's data is returned without copying.
+    '''
+    if isinstance(values, BandArray):
+        return values.data
+    values = np.asarray(values)
+    return np.ascontiguousarray(values.astype(_storage_dtype(np.float64, values), copy=False).T)
+
+def _storage_dtype(dtype, values):
+    '''Return dtype, or its complex counterpart (e.g. complex128 for
+    float64) if values is complex and dtype is real.
+    '''
+    dtype = np.dtype(dtype)
+    if np.iscomplexobj(values) and dtype.kind != 'c':
+        return np.result_type(dtype, np.complex64)
+    return dtype
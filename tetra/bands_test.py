@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+from tetra.bands import BandArray
+from tetra.benchmark import HexagonalMultiBand, _Reference
+from tetra.plan import GetMeshPlan
+from tetra.ksample import MakeEks, MakeXks
+from tetra.sum import _SumByWeights
+from tetra.fused import FusedSweep
+
+class TestBandArray(unittest.TestCase):
+    def test_layout(self):
+        values = [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]]
+        Eks = BandArray.FromKMajor(values)
+        self.assertEqual((Eks.num_bands, Eks.num_ks, len(Eks)), (3, 2, 2))
+        self.assertTrue(Eks.data.flags['C_CONTIGUOUS'])
+        self.assertEqual(Eks[1][2], 5.0)
+        self.assertEqual([list(Es) for Es in Eks], values)
+        self.assertTrue((np.asarray(Eks) == np.array(values)).all())
+
+    def test_complex_matrix_elements(self):
+        submesh = [(0.0, 0.0, 0.0), (0.5, 0.0, 0.0), (0.5, 0.5, 0.0)]
+        # The first value is real; later complex values must not be truncated.
+        Xks = MakeXks(lambda k: [k[0] + 1j*k[1], 2.0], submesh)
+        self.assertEqual(Xks.dtype, np.complex128)
+        self.assertEqual(Xks[2][0], 0.5 + 0.5j)
+        self.assertEqual(MakeXks(lambda k: [1j], submesh, dtype=np.float32).dtype, np.complex64)
+        ws = np.full((2, 3), 0.25)
+        self.assertEqual(_SumByWeights(ws, Xks), 0.25*(1.0 + 0.5j) + 1.5)
+        self.assertEqual(_SumByWeights(ws, np.asarray(Xks)), 0.25*(1.0 + 0.5j) + 1.5)
+
+    def test_make_eks(self):
+        model = HexagonalMultiBand()
+        plan = GetMeshPlan(3, model.R)
+        Eks = MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg)
+        self.assertEqual(Eks.data.shape, (3, len(plan.submesh)))
+        ref = _Reference(model, plan)
+        self.assertTrue((np.asarray(Eks) == np.array(ref.Eks)).all())
+
+    def test_float32(self):
+        model = HexagonalMultiBand()
+        plan = GetMeshPlan(4, model.R)
+        Eks = MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg)
+        Eks32 = MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg, np.float32)
+        self.assertEqual(Eks32.dtype, np.float32)
+        self.assertEqual(2*Eks32.data.nbytes, Eks.data.nbytes)
+        result = FusedSweep(0.317, plan.tetras, Eks)
+        result32 = FusedSweep(0.317, plan.tetras, Eks32)
+        self.assertEqual(result32.weights.dtype, np.float64)
+        self.assertAlmostEqual(result.num_states, result32.num_states, places=5)
+        self.assertAlmostEqual(result.dos, result32.dos, places=4)
+
+if __name__ == "__main__":
+    unittest.main()
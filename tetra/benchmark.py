@@ -0,0 +1,329 @@
+'''Benchmarks of the tetrahedron method implementation on reference
+tight-binding models. Run as:
+
+    python3 -m tetra.benchmark --ns 8 16 32 64 --output bench.json
+
+Each benchmark record gives the wall time and peak memory of one operation
+on one model at one submesh density, the value produced, and the difference
+between that value and a scalar reference implementation (built directly on
+NumStatesContrib, DosContrib and WeightContrib) or an exact result. Passing
+--compare with the output of an earlier run reports timing regressions and
+accuracy drift relative to that run.
+'''
+import argparse
+from collections import OrderedDict, namedtuple
+import json
+from math import fsum
+import sys
+import time
+import tracemalloc
+import numpy as np
+from tetra.ksample import Get_k_Orig, MakeEks
+from tetra.submesh import MakeSubmesh, MakeTetra
+from tetra.plan import GetMeshPlan, GetDefaultMeshOrder, SetDefaultMeshOrder
+from tetra.numstates import NumStates, NumStatesContrib
+from tetra.fermi import FindFermi
+from tetra.weights import Weights, WeightContrib
+from tetra.dos import Dos, DosContrib, DosValues
+from tetra.sum import SumEnergy
+from tetra.fused import SetBackend
+
+Model = namedtuple("Model", ["name", "Efn", "R", "num_electrons", "exact"])
+Model.__doc__ = '''A reference model for benchmarks.
+
+Efn = band energy function E(k), with k in the reciprocal lattice basis.
+
+R = a numpy matrix with rows given by the reciprocal lattice vectors.
+
+num_electrons = number of electrons (in the convention of FindFermi).
+
+exact = dict of exactly known results, with keys drawn from "E_Fermi" and
+"SumEnergy".
+'''
+
+_OPS = ("MakeSubmesh", "MakeTetra", "MakeEks", "NumStates", "FindFermi", "Weights",
+        "Dos", "DosValues", "SumEnergy")
+
+_NUM_DOS_ES = 16
+
+BenchRecord = namedtuple("BenchRecord", ["model", "op", "n", "wall_time", "peak_bytes",
+        "value", "error"])
+
+def CubicSBand(t=1.0):
+    '''Single s band on the simple cubic lattice, at half filling. By
+    particle-hole symmetry, E_F = 0 and the band energy is independent of
+    the submesh in the limit of fine submesh.
+    '''
+    R = 2*np.pi*np.eye(3)
+    def Efn(k):
+        return [-2*t*(np.cos(2*np.pi*k[0]) + np.cos(2*np.pi*k[1]) + np.cos(2*np.pi*k[2]))]
+    return Model("cubic", Efn, R, 0.5, {"E_Fermi": 0.0})
+
+def HexagonalMultiBand(t=1.0, tz=0.2, Ed=0.5, td=0.1):
+    '''Three bands on the hexagonal lattice: the two bands of a honeycomb
+    layer with nearest-neighbor hopping t and interlayer hopping tz, and a
+    narrow band centered at Ed with in-plane hopping td. The bands cross, so
+    the sorted band energies are not smooth functions of k.
+    '''
+    a1 = np.array([1.0, 0.0, 0.0])
+    a2 = np.array([-0.5, np.sqrt(3)/2, 0.0])
+    a3 = np.array([0.0, 0.0, 2.0])
+    D = np.array((a1, a2, a3)).T
+    R = 2*np.pi*np.linalg.inv(D)
+    def Efn(k):
+        phase1, phase2, phase3 = 2*np.pi*k[0], 2*np.pi*k[1], 2*np.pi*k[2]
+        f = abs(1 + np.exp(-1j*phase1) + np.exp(-1j*phase2))
+        Ez = -2*tz*np.cos(phase3)
+        Edk = Ed - 2*td*(np.cos(phase1) + np.cos(phase2) + np.cos(phase1 + phase2))
+        return sorted([Ez - t*f, Ez + t*f, Edk])
+    return Model("hex", Efn, R, 1.3, {})
+
+def GappedInsulator(t=1.0, E0=6.0, deltaE=14.0):
+    '''Two copies of the simple cubic s band separated by deltaE > 12t, with
+    the lower band filled. The band energy is exactly E0 for any submesh.
+    '''
+    if deltaE <= 12*t:
+        raise ValueError("Must have deltaE > 12t for insulator.")
+    R = 2*np.pi*np.eye(3)
+    def Efn(k):
+        tk = -2*t*(np.cos(2*np.pi*k[0]) + np.cos(2*np.pi*k[1]) + np.cos(2*np.pi*k[2]))
+        return [E0 + tk, E0 + deltaE + tk]
+    return Model("insulator", Efn, R, 1.0, {"SumEnergy": E0})
+
+_MODELS = OrderedDict((("cubic", CubicSBand), ("hex", HexagonalMultiBand),
+        ("insulator", GappedInsulator)))
+
+def RunBenchmarks(models=None, ns=(8, 16, 32, 64), reference_max_n=16, memory=True,
+        callback=None, order=None):
+    '''Run each benchmarked operation for each model and submesh density.
+    Returns a list of BenchRecords.
+
+    models = list of model names (keys of _MODELS); all models if None.
+
+    ns = submesh densities to benchmark.
+
+    reference_max_n = largest submesh density at which results are compared
+    against the scalar reference implementation. Exact results are always
+    compared.
+
+    memory = if True, run each operation a second time under tracemalloc to
+    record its peak memory use.
+
+    callback = if given, a function called with each BenchRecord as it is
+    produced.
+
+    order = submesh layout ("canonical" or "morton") to benchmark; if None,
+    the default layout (see plan.SetDefaultMeshOrder) is used.
+    '''
+    if models is None:
+        models = list(_MODELS.keys())
+    old_order = GetDefaultMeshOrder()
+    if order is not None:
+        SetDefaultMeshOrder(order)
+    try:
+        return _run_benchmarks(models, ns, reference_max_n, memory, callback)
+    finally:
+        SetDefaultMeshOrder(old_order)
+
+def _run_benchmarks(models, ns, reference_max_n, memory, callback):
+    records = []
+    for name in models:
+        model = _MODELS[name]()
+        for n in ns:
+            check_reference = reference_max_n is not None and n <= reference_max_n
+            for rec in _bench_model(model, n, check_reference, memory):
+                records.append(rec)
+                if callback is not None:
+                    callback(rec)
+    return records
+
+def _bench_model(model, n, check_reference, memory):
+    plan = GetMeshPlan(n, model.R)
+    ref = None
+    if check_reference:
+        ref = _Reference(model, plan)
+    Eks = MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg)
+    E_Fermi = FindFermi(model.num_electrons, plan.tetras, Eks)
+    Emin, Emax = np.min(Eks), np.max(Eks)
+    E_vals = np.linspace(Emin, Emax, _NUM_DOS_ES)
+
+    ops = OrderedDict()
+    ops["MakeSubmesh"] = lambda: MakeSubmesh(plan.n_opt)
+    ops["MakeTetra"] = lambda: MakeTetra(plan.n_opt)
+    ops["MakeEks"] = lambda: MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg)
+    ops["NumStates"] = lambda: NumStates(E_Fermi, plan.tetras, Eks)
+    ops["FindFermi"] = lambda: FindFermi(model.num_electrons, plan.tetras, Eks)
+    ops["Weights"] = lambda: Weights(E_Fermi, plan.tetras, Eks)
+    ops["Dos"] = lambda: Dos(E_Fermi, plan.tetras, Eks)
+    ops["DosValues"] = lambda: DosValues(Emin, Emax, _NUM_DOS_ES, n, model.Efn, model.R)[0]
+    ops["SumEnergy"] = lambda: SumEnergy(n, model.Efn, model.R, model.num_electrons)[0]
+
+    for op, fn in ops.items():
+        wall_time, value = _time_call(fn)
+        peak = _peak_memory(fn) if memory else None
+        error = None
+        if op in model.exact:
+            error = abs(value - model.exact[op])
+        elif op == "FindFermi" and "E_Fermi" in model.exact:
+            error = abs(value - model.exact["E_Fermi"])
+        elif ref is not None:
+            error = ref.Error(op, value, E_Fermi, E_vals)
+        yield BenchRecord(model.name, op, n, wall_time, peak, _summary_value(value), error)
+
+class _Reference:
+    '''Scalar reference implementation: plain Python lists and direct sums of
+    the per-tetrahedron contributions, independent of the data layout and
+    kernels used by the package-level functions.
+    '''
+    def __init__(self, model, plan):
+        self.tetras = [tuple(int(kN) for kN in tet) for tet in plan.tetras]
+        self.Eks = []
+        for k in plan.submesh:
+            k_orig = Get_k_Orig(k, plan.G_order, plan.G_neg)
+            self.Eks.append([float(E) for E in model.Efn(k_orig)])
+        self.num_bands = len(self.Eks[0])
+        self.num_tetra = len(self.tetras)
+
+    def NumStates(self, E):
+        return fsum(NumStatesContrib(E, tet, self.num_tetra, self.Eks, b)
+                for tet in self.tetras for b in range(self.num_bands))
+
+    def Dos(self, E):
+        return fsum(DosContrib(E, tet, self.num_tetra, self.Eks, b)
+                for tet in self.tetras for b in range(self.num_bands))
+
+    def Weights(self, E_Fermi):
+        ws = [[[] for k in range(len(self.Eks))] for b in range(self.num_bands)]
+        for tet in self.tetras:
+            for b in range(self.num_bands):
+                tb_ws = WeightContrib(E_Fermi, tet, self.num_tetra, self.Eks, b)
+                for i, kN in enumerate(tet):
+                    ws[b][kN].append(tb_ws[i])
+        return np.array([[fsum(w) for w in ws_b] for ws_b in ws])
+
+    def Error(self, op, value, E_Fermi, E_vals):
+        if op == "MakeEks":
+            return float(np.max(np.abs(np.asarray(value) - np.asarray(self.Eks))))
+        elif op == "NumStates":
+            return abs(value - self.NumStates(E_Fermi))
+        elif op == "FindFermi":
+            # Compare the state count at the value found, which is robust
+            # against flat regions of n(E) in band gaps.
+            return abs(self.NumStates(value) - self.NumStates(E_Fermi))
+        elif op == "Weights":
+            return float(np.max(np.abs(np.asarray(value) - self.Weights(E_Fermi))))
+        elif op == "Dos":
+            return abs(value - self.Dos(E_Fermi))
+        elif op == "DosValues":
+            ref_vals = [self.Dos(E) for E in E_vals]
+            return float(np.max(np.abs(np.asarray(value) - np.asarray(ref_vals))))
+        elif op == "SumEnergy":
+            ws = self.Weights(E_Fermi)
+            ref_val = fsum(ws[b][kN]*self.Eks[kN][b] for kN in range(len(self.Eks))
+                    for b in range(self.num_bands))
+            return abs(value - ref_val)
+        return None
+
+def _time_call(fn):
+    start = time.perf_counter()
+    value = fn()
+    return time.perf_counter() - start, value
+
+def _peak_memory(fn):
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+def _summary_value(value):
+    '''Return a JSON-serializable summary of the value returned by an
+    operation: scalars are kept, arrays are reduced to their sum.
+    '''
+    if np.isscalar(value):
+        return float(value)
+    return float(np.sum(np.asarray(value, dtype=np.float64)))
+
+def CompareRecords(records, baseline, time_factor=1.5, error_tol=1e-10):
+    '''Compare records against baseline records (both lists of dicts with the
+    BenchRecord fields) and return a list of human-readable descriptions of
+    timing regressions (wall time larger than time_factor times the
+    baseline) and accuracy drift (error larger than the baseline error by
+    more than error_tol).
+    '''
+    base = {}
+    for rec in baseline:
+        base[(rec["model"], rec["op"], _n_key(rec["n"]))] = rec
+    problems = []
+    for rec in records:
+        key = (rec["model"], rec["op"], _n_key(rec["n"]))
+        if key not in base:
+            continue
+        old = base[key]
+        if old["wall_time"] > 0.0 and rec["wall_time"] > time_factor*old["wall_time"]:
+            problems.append("{} {} n={}: time {:.3g} s vs baseline {:.3g} s".format(
+                key[0], key[1], rec["n"], rec["wall_time"], old["wall_time"]))
+        if rec["error"] is not None and old["error"] is not None \
+                and rec["error"] > old["error"] + error_tol:
+            problems.append("{} {} n={}: error {:.3g} vs baseline {:.3g}".format(
+                key[0], key[1], rec["n"], rec["error"], old["error"]))
+    return problems
+
+def _n_key(n):
+    if isinstance(n, (list, tuple)):
+        return tuple(n)
+    return n
+
+def _format_record(rec):
+    peak = "-" if rec.peak_bytes is None else "{:.1f} MiB".format(rec.peak_bytes / 2**20)
+    error = "-" if rec.error is None else "{:.2e}".format(rec.error)
+    return "{:10s} {:12s} n={:<4} {:10.4f} s  peak {:>10s}  error {}".format(rec.model,
+            rec.op, str(rec.n), rec.wall_time, peak, error)
+
+def _main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m tetra.benchmark",
+            description="Benchmark the tetrahedron method on reference models.")
+    parser.add_argument("--models", nargs="+", choices=list(_MODELS.keys()),
+            default=list(_MODELS.keys()))
+    parser.add_argument("--ns", nargs="+", type=int, default=[8, 16, 32, 64])
+    parser.add_argument("--reference-max-n", type=int, default=16,
+            help="largest n at which to compare against the scalar reference")
+    parser.add_argument("--no-memory", action="store_true",
+            help="skip the peak memory measurement")
+    parser.add_argument("--order", choices=("canonical", "morton"),
+            help="submesh layout to benchmark")
+    parser.add_argument("--backend", choices=("numpy", "numba"), default="numpy",
+            help="tetrahedron sweep kernel to benchmark (see fused.SetBackend)")
+    parser.add_argument("--output", help="write records to this JSON file")
+    parser.add_argument("--compare", help="compare against records in this JSON file")
+    parser.add_argument("--time-factor", type=float, default=1.5)
+    args = parser.parse_args(argv)
+    SetBackend(args.backend)
+
+    def show(rec):
+        print(_format_record(rec))
+        sys.stdout.flush()
+    records = RunBenchmarks(args.models, args.ns, args.reference_max_n,
+            not args.no_memory, show, args.order)
+    dicts = [rec._asdict() for rec in records]
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump(dicts, fp, indent=1)
+    if args.compare is not None:
+        with open(args.compare, 'r') as fp:
+            baseline = json.load(fp)
+        problems = CompareRecords(dicts, baseline, args.time_factor)
+        for problem in problems:
+            print(problem)
+        if len(problems) > 0:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,22 @@
+import unittest
+from tetra.benchmark import RunBenchmarks, CompareRecords, _OPS
+
+class TestBenchmarks(unittest.TestCase):
+    def test_small_run(self):
+        records = RunBenchmarks(ns=(2,), reference_max_n=2, memory=False)
+        self.assertEqual(len(records), 3*len(_OPS))
+        for rec in records:
+            self.assertTrue(rec.wall_time >= 0.0)
+            if rec.error is not None:
+                self.assertTrue(rec.error < 1e-10)
+        dicts = [rec._asdict() for rec in records]
+        self.assertEqual(CompareRecords(dicts, dicts), [])
+
+    def test_compare_regression(self):
+        base = [{"model": "cubic", "op": "Dos", "n": 8, "wall_time": 1.0, "peak_bytes": None,
+                "value": 0.0, "error": 0.0}]
+        new = [dict(base[0], wall_time=2.0, error=1e-6)]
+        self.assertEqual(len(CompareRecords(new, base)), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+'''Checkpointing of sampled band energies and of convergence history, so that
+long-running calculations can be resumed after being interrupted.
+
+A Checkpoint stores its files in a local directory. The files are
+identified by the driver (job), the submesh and the orientation of the
+reciprocal lattice; Efn, Xfn and the other parameters of the calculation
+cannot be inspected, so give a key describing them (e.g. the model and its
+parameters) to have a directory written for a different model rejected.
+Pass the same directory and key to the interrupted call to resume it, e.g.:
+
+    SumEnergy(n, Efn, R, num_electrons, tolerance,
+            checkpoint=Checkpoint("run1", key="graphene t=2.7"))
+
+The key, the block size and the number of k-points of each sampled array
+are recorded in a manifest, and a Checkpoint which does not match them is
+rejected before any saved values are used.
+'''
+import json
+import os
+import numpy as np
+from tetra.submesh import _mesh_dims
+from tetra.ksample import MakeEks, MakeXks
+from tetra.bands import BandArray
+
+_MANIFEST = "manifest.json"
+
+_DEFAULT_BLOCK_SIZE = 4096
+
+class Checkpoint:
+    '''A directory holding completed blocks of sampled values (see MakeEks
+    and MakeXks) and completed refinement levels (see LoadLevel and
+    SaveLevel).
+
+    directory = path of the checkpoint directory; created if it does not
+    exist.
+
+    block_size = number of k-points sampled between saves. If None, the
+    block size recorded in an existing directory is used (4096 for a new
+    directory); otherwise it must match the recorded one.
+
+    key = a string identifying the model and parameters of the calculation.
+    If given, it must match the key recorded in an existing directory; if
+    None, the recorded key (if any) is accepted.
+    '''
+    def __init__(self, directory, block_size=None, key=None):
+        if block_size is not None and block_size < 1:
+            raise ValueError("block_size must be at least 1.")
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        manifest = self._load_manifest()
+        if manifest is None:
+            manifest = {"key": key, "block_size": block_size or _DEFAULT_BLOCK_SIZE,
+                    "arrays": {}}
+            self._save_manifest(manifest)
+        if key is not None and manifest["key"] != key:
+            raise ValueError("Checkpoint {} was written with key {!r}, not {!r}.".format(
+                    directory, manifest["key"], key))
+        if block_size is not None and manifest["block_size"] != block_size:
+            raise ValueError("Checkpoint {} was written with block_size {}, not {}.".format(
+                    directory, manifest["block_size"], block_size))
+        self.key = manifest["key"]
+        self.block_size = manifest["block_size"]
+
+    def MakeEks(self, Efn, plan, dtype=np.float64, job=None):
+        '''As ksample.MakeEks(Efn, plan.submesh, plan.G_order, plan.G_neg,
+        dtype), but sampling in blocks of block_size k-points and saving each
+        block when it is complete. Blocks saved by an earlier call with the
+        same job and plan are loaded instead of sampled.
+
+        job = name of the calculation using the energies (e.g. "SumEnergy");
+        calculations with different job names never share sampled values.
+        '''
+        return self._sample(_job_name(job, "Eks"), MakeEks, Efn, plan, dtype)
+
+    def MakeXks(self, Xfn, plan, dtype=np.float64, name="Xks", job=None):
+        '''As ksample.MakeXks, with checkpointing as for MakeEks. Use a
+        distinct name for each operator sampled on the same plan.
+        '''
+        return self._sample(_job_name(job, name), MakeXks, Xfn, plan, dtype)
+
+    def LoadLevel(self, job, n):
+        '''Return (result, ws) saved by SaveLevel for the given job at
+        submesh density n, or None if that level has not been completed.
+        '''
+        path = self._path("{}_level_{}.npz".format(job, _dims_key(n)))
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return data["result"].item(), np.array(data["ws"])
+
+    def SaveLevel(self, job, n, result, ws):
+        '''Save the result and integration weights ws of the given job at
+        submesh density n, and append them to the job's History.
+        '''
+        path = self._path("{}_level_{}.npz".format(job, _dims_key(n)))
+        _atomic_save(path, lambda fp: np.savez(fp, result=result, ws=ws))
+        dims = list(_mesh_dims(n, "SaveLevel", allow_2d=True))
+        history = [h for h in self.History(job) if h["n"] != dims]
+        history.append({"n": dims, "result": _history_value(result)})
+        text = json.dumps(history, indent=1)
+        history_path = self._path("{}_history.json".format(job))
+        _atomic_save(history_path, lambda fp: fp.write(text.encode()))
+
+    def History(self, job):
+        '''Return the list of completed levels of the given job, in the order
+        completed, as dicts with keys "n" (the submesh dimensions) and
+        "result" (a float, or [real, imag] for a complex result).
+        '''
+        path = self._path("{}_history.json".format(job))
+        if not os.path.exists(path):
+            return []
+        with open(path) as fp:
+            return json.load(fp)
+
+    def _sample(self, name, make, fn, plan, dtype):
+        prefix = "{}_{}".format(name, _plan_key(plan))
+        num_ks = len(plan.submesh)
+        manifest = self._load_manifest()
+        recorded = manifest["arrays"].get(prefix)
+        if recorded is None:
+            manifest["arrays"][prefix] = num_ks
+            self._save_manifest(manifest)
+        elif recorded != num_ks:
+            raise ValueError("Checkpoint {} holds {} with {} k-points, not {}.".format(
+                    self.directory, prefix, recorded, num_ks))
+        blocks = []
+        for block_index, start in enumerate(range(0, num_ks, self.block_size)):
+            path = self._path("{}_block{}.npy".format(prefix, block_index))
+            stop = min(start + self.block_size, num_ks)
+            if os.path.exists(path):
+                block = np.load(path)
+            else:
+                block = make(fn, plan.submesh[start:stop], plan.G_order, plan.G_neg).data
+                _atomic_save(path, lambda fp: np.save(fp, block))
+            blocks.append(block)
+        return BandArray(np.concatenate(blocks, axis=1), dtype)
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _load_manifest(self):
+        path = self._path(_MANIFEST)
+        if not os.path.exists(path):
+            return None
+        with open(path) as fp:
+            return json.load(fp)
+
+    def _save_manifest(self, manifest):
+        text = json.dumps(manifest, indent=1)
+        _atomic_save(self._path(_MANIFEST), lambda fp: fp.write(text.encode()))
+
+def _history_value(result):
+    # JSON has no complex numbers; record complex results as [real, imag].
+    if isinstance(result, complex) or np.iscomplexobj(result):
+        result = complex(result)
+        return [result.real, result.imag]
+    return float(result)
+
+def _job_name(job, name):
+    if job is None:
+        return name
+    return "{}_{}".format(job, name)
+
+def _dims_key(n):
+    return "x".join(str(d) for d in _mesh_dims(n, "Checkpoint", allow_2d=True))
+
+def _plan_key(plan):
+    key = "{}_{}".format(_dims_key(plan.n_opt), plan.order)
+    if plan.G_order is not None:
+        key += "_o{}{}{}".format(*plan.G_order)
+        key += "_s" + "".join("p" if s > 0 else "m" for s in plan.G_neg)
+    return key
+
+def _atomic_save(path, write):
+    '''Write a file through write(fp) such that an interruption leaves
+    either the previous file or the complete new one at path.
+    '''
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as fp:
+        write(fp)
+    os.replace(tmp_path, path)
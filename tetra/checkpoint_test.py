@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from tetra.checkpoint import Checkpoint
+from tetra.sum import SumEnergy, SumFn
+from tetra.plan import GetMeshPlan
+from tetra.submesh import NumKs
+from tetra.benchmark import HexagonalMultiBand
+
+class _Interrupted(Exception):
+    pass
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.model = HexagonalMultiBand()
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _Efn(self, max_calls=None):
+        def Efn(k):
+            if max_calls is not None and self.calls >= max_calls:
+                raise _Interrupted()
+            self.calls += 1
+            return self.model.Efn(k)
+        return Efn
+
+    def test_resume(self):
+        model = self.model
+        expected = SumEnergy(2, self._Efn(), model.R, model.num_electrons, tolerance=1e-2)
+        total_calls, self.calls = self.calls, 0
+        # Interrupt partway through sampling the second level.
+        with self.assertRaises(_Interrupted):
+            SumEnergy(2, self._Efn(NumKs(2) + 100), model.R, model.num_electrons,
+                    tolerance=1e-2, checkpoint=Checkpoint(self.directory, block_size=32))
+        self.assertEqual(len(Checkpoint(self.directory).History("SumEnergy")), 1)
+        # Resume: the first level and the completed blocks of the second are
+        # not sampled again.
+        self.calls = 0
+        result = SumEnergy(2, self._Efn(), model.R, model.num_electrons, tolerance=1e-2,
+                checkpoint=Checkpoint(self.directory, block_size=32))
+        self.assertEqual(self.calls, total_calls - NumKs(2) - 96)
+        self.assertEqual(result[:2], expected[:2])
+        self.assertTrue((result[2] == expected[2]).all())
+        # A finished run is not repeated.
+        self.calls = 0
+        again = SumEnergy(2, self._Efn(), model.R, model.num_electrons, tolerance=1e-2,
+                checkpoint=Checkpoint(self.directory, block_size=32))
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(again[:2], expected[:2])
+        history = Checkpoint(self.directory).History("SumEnergy")
+        self.assertEqual([h["n"] for h in history][:2], [[2, 2, 2], [4, 4, 4]])
+
+    def test_manifest_mismatch(self):
+        Checkpoint(self.directory, block_size=32, key="hexagonal")
+        with self.assertRaises(ValueError):
+            Checkpoint(self.directory, key="cubic")
+        with self.assertRaises(ValueError):
+            Checkpoint(self.directory, block_size=64)
+        checkpoint = Checkpoint(self.directory)
+        self.assertEqual((checkpoint.key, checkpoint.block_size), ("hexagonal", 32))
+        plan = GetMeshPlan(2, self.model.R)
+        checkpoint.MakeEks(self._Efn(), plan, job="SumEnergy")
+        # A recorded array with a different number of k-points is rejected
+        # before its blocks are used.
+        path = os.path.join(self.directory, "manifest.json")
+        with open(path) as fp:
+            manifest = json.load(fp)
+        for prefix in manifest["arrays"]:
+            manifest["arrays"][prefix] += 1
+        with open(path, "w") as fp:
+            json.dump(manifest, fp)
+        with self.assertRaises(ValueError):
+            checkpoint.MakeEks(self._Efn(), plan, job="SumEnergy")
+
+    def test_jobs_separate(self):
+        model = self.model
+        checkpoint = Checkpoint(self.directory, block_size=32)
+        SumEnergy(2, self._Efn(), model.R, model.num_electrons, checkpoint=checkpoint)
+        self.calls = 0
+        # The energies sampled for SumEnergy are not reused by another job.
+        SumFn(2, self._Efn(), lambda k: [1.0]*3, model.R, model.num_electrons,
+                checkpoint=checkpoint)
+        self.assertEqual(self.calls, NumKs(2))
+
+    def test_resume_complex(self):
+        model = self.model
+        def Xfn(k):
+            return [complex(E, 1.0) for E in model.Efn(k)]
+        expected = SumFn(2, self._Efn(), Xfn, model.R, model.num_electrons, tolerance=1e-2)
+        self.assertIsInstance(expected[0], complex)
+        self.calls = 0
+        # Interrupt while sampling the energies of the second level.
+        with self.assertRaises(_Interrupted):
+            SumFn(2, self._Efn(NumKs(2) + 100), Xfn, model.R, model.num_electrons,
+                    tolerance=1e-2, checkpoint=Checkpoint(self.directory, block_size=32))
+        result = SumFn(2, self._Efn(), Xfn, model.R, model.num_electrons, tolerance=1e-2,
+                checkpoint=Checkpoint(self.directory, block_size=32))
+        self.assertEqual(result[:2], expected[:2])
+        self.assertTrue((result[2] == expected[2]).all())
+        history = Checkpoint(self.directory).History("SumFn")
+        self.assertEqual(history[-1]["result"], [expected[0].real, expected[0].imag])
+
+if __name__ == "__main__":
+    unittest.main()
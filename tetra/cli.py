@@ -0,0 +1,309 @@
+'''Command-line driver for the tetrahedron method operating on band energies
+precomputed by an external band solver.
+
+Generate the k-points at which the band solver must be evaluated:
+
+    python3 -m tetra kpoints --n 16 --R R.npy kpoints.npy
+
+Each row of kpoints.npy is a k-point in the reciprocal lattice basis. The
+band solver writes the sorted band energies at these k-points, in the same
+order, as an array with shape (num_ks, num_bands) to a .npy file (or under
+some key of a .npz file). Then, for example:
+
+    python3 -m tetra run Eks.npy --kpoints kpoints.npy --R R.npy --electrons 8 \\
+        --dos-range -10 10 --dos-num 400 --x velocity=Vks.npy out.npz
+
+computes E_F, the density of states, and the expectation value of the
+operator sampled in Vks.npy, all using the same submesh and tetrahedra.
+'''
+import argparse
+import sys
+import numpy as np
+from tetra.ksample import Get_k_Orig
+from tetra.submesh import NumKs
+from tetra.plan import GetMeshPlan
+from tetra.bands import BandArray
+
+def main(argv=None):
+    parser = _make_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    try:
+        return args.func(args)
+    except (ValueError, OSError) as err:
+        print("error: {}".format(err), file=sys.stderr)
+        return 1
+
+def _make_parser():
+    parser = argparse.ArgumentParser(prog="python3 -m tetra",
+            description="Brillouin zone integration by the tetrahedron method (BJA94).")
+    sub = parser.add_subparsers(dest="command")
+
+    kp = sub.add_parser("kpoints", help="write the submesh k-points to sample")
+    _add_mesh_args(kp, required=True)
+    kp.add_argument("output", help="output .npy file (or .csv)")
+    kp.set_defaults(func=_cmd_kpoints)
+
+    run = sub.add_parser("run", help="compute E_F, DOS, weights and expectation values")
+    run.add_argument("eks", help="band energies, shape (num_ks, num_bands): FILE.npy or FILE.npz[:KEY]")
+    _add_mesh_args(run, required=False)
+    run.add_argument("--kpoints", metavar="FILE",
+            help="k-points file written by 'kpoints', from which the submesh density "
+            "is determined if --n is not given")
+    run.add_argument("--electrons", type=float,
+            help="number of electrons; required for E_F, weights and expectation values")
+    run.add_argument("--dos-range", nargs=2, type=float, metavar=("EMIN", "EMAX"),
+            help="energy range of the DOS curve (default: full band range)")
+    run.add_argument("--dos-num", type=int, default=0,
+            help="number of energies in the DOS curve (default: no DOS)")
+    run.add_argument("--per-band", action="store_true", help="also output the DOS per band")
+    run.add_argument("--weights", action="store_true",
+            help="output the integration weights w[band][k] (.npz output only)")
+    run.add_argument("--x", action="append", default=[], metavar="NAME=FILE[:KEY]",
+            help="operator matrix elements X_n(k), real or complex, shape (num_ks, num_bands); "
+            "outputs <X>")
+    run.add_argument("--proj", action="append", default=[], metavar="NAME=FILE[:KEY]",
+            help="projection weights P_n(k), shape (num_ks, num_bands); outputs the occupied weight")
+    run.add_argument("--float32", action="store_true",
+            help="store band energies in single precision to halve their memory use")
+    run.add_argument("output", help="output file, .npz or .csv; for .csv, the DOS table "
+            "is written to FILE.csv and the scalar results to FILE_scalars.csv")
+    run.set_defaults(func=_cmd_run)
+    return parser
+
+def _add_mesh_args(parser, required):
+    parser.add_argument("--n", nargs="+", type=int, required=required, metavar="N",
+            help="submesh density: N or N1 N2 N3, or N1 N2 for a two-dimensional "
+            "submesh (triangle method)" + ("" if required else
+            " (default: read from the k-points file given by --kpoints)"))
+    parser.add_argument("--R", metavar="FILE",
+            help="reciprocal lattice vectors (rows of a 3x3 array) in .npy format; "
+            "if given, the submesh is oriented as by OptimizeGs. Must be the same "
+            "for 'kpoints' and 'run'.")
+    parser.add_argument("--order", choices=("canonical", "morton"), default="canonical",
+            help="k-point order of the submesh; 'morton' is faster for large submeshes. "
+            "Must be the same for 'kpoints' and 'run'.")
+
+def _cmd_kpoints(args):
+    n = _parse_n(args.n)
+    R = _load_R(args.R)
+    plan = GetMeshPlan(n, R, args.order)
+    ks = _orig_kpoints(plan)
+    if args.output.endswith(".csv"):
+        np.savetxt(args.output, ks, delimiter=",", header="k1,k2,k3")
+    else:
+        np.save(args.output, ks)
+    return 0
+
+def _cmd_run(args):
+    Eks = _load_array(args.eks, "Eks")
+    if np.iscomplexobj(Eks):
+        raise ValueError("Energies in {} must be real.".format(args.eks))
+    if Eks.ndim != 2:
+        raise ValueError("Eks must have shape (num_ks, num_bands); got {}".format(Eks.shape))
+    if np.any(np.diff(Eks, axis=1) < 0.0):
+        raise ValueError("Energies in {} are not sorted along each row.".format(args.eks))
+    num_ks = Eks.shape[0]
+    if args.n is not None:
+        n = _parse_n(args.n)
+    elif args.kpoints is not None:
+        n = _n_from_kpoints(_load_kpoints(args.kpoints))
+    else:
+        raise ValueError("Give the submesh density with --n or --kpoints.")
+    if NumKs(n) != num_ks:
+        raise ValueError("Submesh with n = {} has {} k-points but Eks has {}.".format(n,
+                NumKs(n), num_ks))
+    needs_fermi = args.weights or len(args.x) > 0 or len(args.proj) > 0
+    if needs_fermi and args.electrons is None:
+        raise ValueError("--electrons is required for --weights, --x and --proj.")
+    csv = args.output.endswith(".csv")
+    if csv and args.weights:
+        raise ValueError("--weights requires .npz output.")
+    Xs = []
+    for spec in args.x:
+        Xs.append(("x_",) + _load_named(spec, Eks.shape))
+    for spec in args.proj:
+        Xs.append(("proj_",) + _load_named(spec, Eks.shape))
+
+    # The same submesh and tetrahedra are used for all calculations.
+    plan = GetMeshPlan(n, _load_R(args.R), args.order)
+    tetras = plan.tetras
+    Eks_bands = BandArray.FromKMajor(Eks, np.float32 if args.float32 else np.float64)
+
+    with _Output(args.output) as out:
+        out.Scalar("num_ks", num_ks)
+        out.Scalar("num_bands", Eks.shape[1])
+        if args.electrons is not None:
+            # Import here to avoid loading scipy for DOS-only jobs.
+            from tetra.fermi import FindFermi
+            E_Fermi = FindFermi(args.electrons, tetras, Eks_bands)
+            out.Scalar("E_Fermi", E_Fermi)
+        if args.dos_num > 0:
+            from tetra.dos import Dos, DosPerBand
+            if args.dos_range is not None:
+                Emin, Emax = args.dos_range
+            else:
+                Emin, Emax = float(np.min(Eks)), float(np.max(Eks))
+            E_vals = np.linspace(Emin, Emax, args.dos_num)
+            columns = ["E", "dos"]
+            if args.per_band:
+                columns += ["dos_{}".format(b) for b in range(Eks.shape[1])]
+            out.BeginTable("dos", columns)
+            for E in E_vals:
+                row = [E, Dos(E, tetras, Eks_bands)]
+                if args.per_band:
+                    row += DosPerBand(E, tetras, Eks_bands)
+                out.Row(row)
+            out.EndTable()
+        if needs_fermi:
+            from tetra.fused import FusedSweep
+            from tetra.sum import _SumByWeights
+            ws = FusedSweep(E_Fermi, tetras, Eks_bands).weights
+            out.Scalar("energy", _SumByWeights(ws, Eks_bands))
+            for prefix, name, X in Xs:
+                out.Scalar(prefix + name, _SumByWeights(ws, X))
+            if args.weights:
+                out.Array("weights", ws)
+    return 0
+
+class _Output:
+    '''Context manager which writes results either to .csv files as they are
+    produced, or, for any other file name, collects them and writes a .npz
+    file on successful exit. In .csv output, the table is written to path
+    as comma-separated rows below a header line, and the scalars to
+    path with "_scalars" appended to its stem, as rows "name,value". Files
+    are closed on exit whether or not an exception was raised.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.csv = path.endswith(".csv")
+        self.arrays = {}
+        self.table = None
+        self.rows = None
+        self.fp, self.scalar_fp = None, None
+
+    def __enter__(self):
+        if self.csv:
+            self.scalar_fp = open(self.path[:-len(".csv")] + "_scalars.csv", 'w')
+            self.scalar_fp.write("name,value\n")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.csv:
+            for fp in (self.fp, self.scalar_fp):
+                if fp is not None:
+                    fp.close()
+        elif exc_type is None:
+            np.savez(self.path, **self.arrays)
+        return False
+
+    def Scalar(self, name, value):
+        if self.csv:
+            if isinstance(value, np.generic):
+                value = value.item()
+            self.scalar_fp.write("{},{!r}\n".format(name, value))
+            self.scalar_fp.flush()
+        else:
+            self.arrays[name] = np.array(value)
+
+    def Array(self, name, value):
+        self.arrays[name] = value
+
+    def BeginTable(self, name, columns):
+        self.table = name
+        self.rows = []
+        if self.csv:
+            if self.fp is not None:
+                raise ValueError(".csv output holds a single table.")
+            self.fp = open(self.path, 'w')
+            self.fp.write(",".join(columns) + "\n")
+
+    def Row(self, values):
+        if self.csv:
+            self.fp.write(",".join(repr(float(v)) for v in values) + "\n")
+            self.fp.flush()
+        else:
+            self.rows.append(values)
+
+    def EndTable(self):
+        if not self.csv:
+            table = np.array(self.rows)
+            self.arrays[self.table + "_E"] = table[:, 0]
+            self.arrays[self.table] = table[:, 1]
+            if table.shape[1] > 2:
+                self.arrays[self.table + "_per_band"] = table[:, 2:]
+        self.table, self.rows = None, None
+
+def _orig_kpoints(plan):
+    if plan.G_order is None:
+        return np.array(plan.submesh)
+    return np.array([Get_k_Orig(k, plan.G_order, plan.G_neg) for k in plan.submesh])
+
+def _parse_n(ns):
+    if len(ns) == 1:
+        return ns[0]
+    elif len(ns) in (2, 3):
+        return tuple(ns)
+    raise ValueError("--n takes 1, 2 or 3 values.")
+
+def _load_kpoints(path):
+    if path.endswith(".csv"):
+        return np.loadtxt(path, delimiter=",", ndmin=2)
+    return np.load(path)
+
+def _n_from_kpoints(ks):
+    '''Return the submesh density of the k-points ks written by 'kpoints':
+    the k-points along original reciprocal lattice vector i take ni+1
+    distinct values, and k3 is constant for a two-dimensional submesh. The
+    number of k-points alone does not determine the submesh, since
+    anisotropic and two-dimensional submeshes may have as many k-points as a
+    cubic one.
+    '''
+    if ks.ndim != 2 or ks.shape[1] != 3:
+        raise ValueError("k-points must have shape (num_ks, 3); got {}".format(ks.shape))
+    dims = [len(np.unique(np.round(ks[:, i], 10))) - 1 for i in range(3)]
+    if dims[2] == 0:
+        dims = dims[:2]
+    if min(dims) <= 0 or NumKs(tuple(dims)) != ks.shape[0]:
+        raise ValueError("k-points do not form a submesh written by 'kpoints'.")
+    if len(dims) == 3 and dims[0] == dims[1] == dims[2]:
+        return dims[0]
+    return tuple(dims)
+
+def _load_R(path):
+    if path is None:
+        return None
+    R = np.load(path)
+    if R.shape != (3, 3):
+        raise ValueError("R must have shape (3, 3); got {}".format(R.shape))
+    return R
+
+def _load_array(spec, default_key):
+    '''Return the array in FILE.npy or FILE.npz[:KEY] as float64, or as
+    complex128 if it is complex.
+    '''
+    path, key = spec, None
+    if ".npz:" in spec:
+        path, key = spec.rsplit(":", 1)
+    data = np.load(path)
+    if isinstance(data, np.lib.npyio.NpzFile):
+        with data:
+            if key is None:
+                key = default_key if default_key in data.files else data.files[0]
+            return _as_float_array(data[key])
+    return _as_float_array(data)
+
+def _as_float_array(data):
+    dtype = np.complex128 if np.iscomplexobj(data) else np.float64
+    return np.array(data, dtype=dtype)
+
+def _load_named(spec, shape):
+    if "=" not in spec:
+        raise ValueError("Expected NAME=FILE[:KEY]; got {}".format(spec))
+    name, path = spec.split("=", 1)
+    X = _load_array(path, name)
+    if X.shape != shape:
+        raise ValueError("{} has shape {} but Eks has shape {}.".format(path, X.shape, shape))
+    return name, X
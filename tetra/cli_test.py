@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from tetra.cli import main, _Output, _n_from_kpoints
+
+class TestCli(unittest.TestCase):
+    def test_insulator(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            R_path = os.path.join(tmp, "R.npy")
+            k_path = os.path.join(tmp, "k.npy")
+            E_path = os.path.join(tmp, "E.npz")
+            out_path = os.path.join(tmp, "out.npz")
+            np.save(R_path, 2*np.pi*np.eye(3))
+            self.assertEqual(main(["kpoints", "--n", "4", "--R", R_path, k_path]), 0)
+            ks = np.load(k_path)
+            self.assertEqual(ks.shape, (125, 3))
+            tk = -2*np.sum(np.cos(2*np.pi*ks), axis=1)
+            Eks = np.stack((6.0 + tk, 20.0 + tk), axis=1)
+            np.savez(E_path, Eks=Eks, ones=np.ones_like(Eks))
+            argv = ["run", E_path, "--R", R_path, "--kpoints", k_path, "--electrons", "1",
+                    "--dos-num", "3",
+                    "--weights", "--x", "one=" + E_path + ":ones", out_path]
+            self.assertEqual(main(argv), 0)
+            with np.load(out_path) as out:
+                self.assertAlmostEqual(float(out["energy"]), 6.0)
+                self.assertAlmostEqual(float(out["x_one"]), 1.0)
+                self.assertEqual(out["weights"].shape, (2, 125))
+                self.assertEqual(out["dos"].shape, (3,))
+
+    def test_bad_num_ks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            E_path = os.path.join(tmp, "E.npy")
+            np.save(E_path, np.zeros((10, 2)))
+            self.assertEqual(main(["run", E_path, "--dos-num", "2",
+                    os.path.join(tmp, "out.npz")]), 1)
+
+    def test_missing_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(main(["run", os.path.join(tmp, "missing.npy"), "--n", "1",
+                    "--dos-num", "2", os.path.join(tmp, "out.npz")]), 1)
+
+    def test_complex_x(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            E_path = os.path.join(tmp, "E.npy")
+            X_path = os.path.join(tmp, "X.npy")
+            out_path = os.path.join(tmp, "out.npz")
+            R_path = os.path.join(tmp, "R.npy")
+            k_path = os.path.join(tmp, "k.npy")
+            np.save(R_path, 2*np.pi*np.eye(3))
+            self.assertEqual(main(["kpoints", "--n", "2", "--R", R_path, k_path]), 0)
+            ks = np.load(k_path)
+            Eks = (-2*np.sum(np.cos(2*np.pi*ks), axis=1))[:, np.newaxis]
+            np.save(E_path, Eks)
+            np.save(X_path, np.full(Eks.shape, 2.0 + 1.0j))
+            self.assertEqual(main(["run", E_path, "--n", "2", "--R", R_path, "--electrons", "0.5",
+                    "--x", "z=" + X_path, out_path]), 0)
+            with np.load(out_path) as out:
+                self.assertAlmostEqual(complex(out["x_z"]), 1.0 + 0.5j)
+            # Complex band energies are rejected.
+            np.save(E_path, Eks*(1.0 + 1.0j))
+            self.assertEqual(main(["run", E_path, "--n", "2", "--R", R_path, "--dos-num", "2",
+                    out_path]), 1)
+
+    def test_csv_output(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            k_path = os.path.join(tmp, "k.csv")
+            E_path = os.path.join(tmp, "E.npy")
+            out_path = os.path.join(tmp, "out.csv")
+            # A two-dimensional submesh with as many k-points as n = 3.
+            self.assertEqual(main(["kpoints", k_path, "--n", "7", "7"]), 0)
+            ks = np.loadtxt(k_path, delimiter=",", ndmin=2)
+            self.assertEqual(ks.shape, (64, 3))
+            tk = -2*np.sum(np.cos(2*np.pi*ks[:, :2]), axis=1)
+            np.save(E_path, np.stack((tk, 10.0 + tk), axis=1))
+            self.assertEqual(main(["run", E_path, "--kpoints", k_path, "--electrons", "1",
+                    "--dos-num", "4", out_path]), 0)
+            table = np.loadtxt(out_path, delimiter=",", skiprows=1, ndmin=2)
+            self.assertEqual(table.shape, (4, 2))
+            with open(os.path.join(tmp, "out_scalars.csv")) as fp:
+                lines = fp.read().splitlines()
+            self.assertEqual(lines[0], "name,value")
+            scalars = dict(line.split(",") for line in lines[1:])
+            self.assertEqual(int(scalars["num_ks"]), 64)
+            self.assertTrue(4.0 - 1e-6 <= float(scalars["E_Fermi"]) <= 6.0 + 1e-6)
+
+    def test_output_closed_on_error(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            out = _Output(os.path.join(tmp, "out.csv"))
+            with self.assertRaises(RuntimeError):
+                with out:
+                    out.Scalar("a", 1.0)
+                    out.BeginTable("dos", ["E", "dos"])
+                    raise RuntimeError()
+            self.assertTrue(out.fp.closed and out.scalar_fp.closed)
+            npz_path = os.path.join(tmp, "out.npz")
+            with self.assertRaises(RuntimeError):
+                with _Output(npz_path) as out:
+                    out.Scalar("a", 1.0)
+                    raise RuntimeError()
+            self.assertFalse(os.path.exists(npz_path))
+
+    def test_n_from_kpoints(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            k_path = os.path.join(tmp, "k.npy")
+            R_path = os.path.join(tmp, "R.npy")
+            np.save(R_path, np.array([[1.0, 0.0, 0.0], [0.3, 1.0, 0.0], [0.0, 0.2, 2.0]]))
+            # Submeshes with equal numbers of k-points, e.g. (2, 8, 2) and
+            # (8, 2, 2), are told apart by the k-point coordinates.
+            for n, expected in ((["4"], 4), (["2", "8", "2"], (2, 8, 2)), (["8", "2", "2"], (8, 2, 2)),
+                    (["3", "15"], (3, 15))):
+                self.assertEqual(main(["kpoints", "--n"] + n + ["--R", R_path, k_path]), 0)
+                self.assertEqual(_n_from_kpoints(np.load(k_path)), expected)
+
+if __name__ == "__main__":
+    unittest.main()
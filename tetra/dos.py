@@ -1,11 +1,15 @@
 from multiprocessing import Pool
 import numpy as np
-from tetra.ksample import OptimizeGs, MakeEks
-from tetra.submesh import MakeSubmesh, MakeTetra
+from tetra.ksample import MakeEks, MakeEksAsync
+from tetra.plan import GetMeshPlan, ToCanonicalOrder, CanonicalTetras
+from tetra.bands import BandArray
+from tetra.instrument import _phase, _refinement_level
 from tetra.fermi import _minimum_E, _maximum_E
 from tetra.numstates import _tetra_Es
+from tetra.fused import FusedSweep
+from tetra.triangle import DosContrib2D
 
-def DosValues_AllE(num_Es, n, Efn, R):
+def DosValues_AllE(num_Es, n, Efn, R, dtype=np.float64):
     '''Return a list of D(E) values giving the density of states at energy E
     summed over all tetrahedra and band indices; E ranges over num_Es equally
     spaced values from the minimum energy eigenvalue to the maximum energy
@@ -13,21 +17,28 @@ def DosValues_AllE(num_Es, n, Efn, R):
 
     Also returns the list of energy values used and lists of tetrahedra and
     E(k) values so that these can be used in further calculations (such as
-    FindFermi()).
+    FindFermi()). These are in the canonical order of MakeTetra and
+    MakeSubmesh (in the optimal reciprocal lattice orientation) whatever
+    the default mesh order.
 
     The calculation of D(E) is implemented as described in BJA94 Appendix C.
 
-    n = Brillouin zone submesh density (the total number of k-points sampled
-    is (n+1)**3).
+    n = Brillouin zone submesh density; either an integer (the total number
+    of k-points sampled is (n+1)**3) or a tuple (n1, n2, n3) giving the
+    density along each reciprocal lattice vector.
 
     Efn = a function E(k) which returns a list of the band energies at the
     Brillouin zone point k, with the returned list sorted in ascending order;
     k is expressed in the reciprocal lattice basis.
 
     R = a numpy matrix with rows given by the reciprocal lattice vectors.
+
+    dtype = storage type of the sampled energies; numpy.float32 halves the
+    memory use of Eks (see bands.BandArray).
     '''
     # Get E(k) values and tetras.
-    tetras, Eks = _dos_setup(n, Efn, R)
+    plan, Eks = _dos_setup(n, Efn, R, dtype)
+    tetras = plan.tetras
     Emin, Emax = _minimum_E(Eks), _maximum_E(Eks)
     # Get D(E) values.
     E_vals = np.linspace(Emin, Emax, num_Es)
@@ -36,76 +47,127 @@ def DosValues_AllE(num_Es, n, Efn, R):
     for E in E_vals:
         dos_args.append([E, tetras, Eks])
 
-    with Pool() as pool:
-        dos_vals = pool.starmap(Dos, dos_args)
+    with _refinement_level(n), _phase("dos"):
+        with Pool() as pool:
+            dos_vals = pool.starmap(Dos, dos_args)
 
-    return dos_vals, E_vals, tetras, Eks
+    return (dos_vals, E_vals) + _canonical_mesh(plan, Eks)
 
-def DosValues(Emin, Emax, num_Es, n, Efn, R):
+def DosValues(Emin, Emax, num_Es, n, Efn, R, dtype=np.float64):
     '''Return a list of D(E) values giving the density of states at energy E
     summed over all tetrahedra and band indices; E ranges over num_Es equally
     spaced values from Emin to Emax.
 
     Also returns the list of energy values used and lists of tetrahedra and
     E(k) values so that these can be used in further calculations (such as
-    FindFermi()).
+    FindFermi()). These are in the canonical order of MakeTetra and
+    MakeSubmesh (in the optimal reciprocal lattice orientation) whatever
+    the default mesh order.
 
     The calculation of D(E) is implemented as described in BJA94 Appendix C.
 
-    n = Brillouin zone submesh density (the total number of k-points sampled
-    is (n+1)**3).
+    n = Brillouin zone submesh density; either an integer (the total number
+    of k-points sampled is (n+1)**3) or a tuple (n1, n2, n3) giving the
+    density along each reciprocal lattice vector.
 
     Efn = a function E(k) which returns a list of the band energies at the
     Brillouin zone point k, with the returned list sorted in ascending order;
     k is expressed in the reciprocal lattice basis.
 
     R = a numpy matrix with rows given by the reciprocal lattice vectors.
+
+    dtype = storage type of the sampled energies; numpy.float32 halves the
+    memory use of Eks (see bands.BandArray).
+    '''
+    plan, Eks = _dos_setup(n, Efn, R, dtype)
+    return _dos_values(Emin, Emax, num_Es, n, plan, Eks)
+
+def _dos_values(Emin, Emax, num_Es, n, plan, Eks):
+    '''Return the values of DosValues, given the plan and energies at n.
     '''
-    tetras, Eks = _dos_setup(n, Efn, R)
+    tetras = plan.tetras
     # Get D(E) values.
     E_vals = np.linspace(Emin, Emax, num_Es)
     dos_vals = []
-    for E in E_vals:
-        dos_vals.append(Dos(E, tetras, Eks))
-    return dos_vals, E_vals, tetras, Eks
-
-def _dos_setup(n, Efn, R):
-    # Get optimal reciprocal lattice orientation.
-    G_order, G_neg = OptimizeGs(R)
-    # Generate submesh and tetrahedra.
-    submesh = MakeSubmesh(n)
-    tetras = MakeTetra(n)
-    # Sample E(k).
-    Eks = MakeEks(Efn, submesh, G_order, G_neg)
-    return tetras, Eks
-
-def DosValuesPerBand(Emin, Emax, num_Es, n, Efn, R):
+    with _refinement_level(n), _phase("dos"):
+        for E in E_vals:
+            dos_vals.append(Dos(E, tetras, Eks))
+    return (dos_vals, E_vals) + _canonical_mesh(plan, Eks)
+
+def _dos_setup(n, Efn, R, dtype=np.float64):
+    with _refinement_level(n):
+        # Get submesh and tetrahedra in the optimal reciprocal lattice
+        # orientation.
+        with _phase("mesh"):
+            plan = GetMeshPlan(n, R)
+        # Sample E(k).
+        with _phase("sample"):
+            Eks = MakeEks(Efn, plan.submesh, plan.G_order, plan.G_neg, dtype)
+    return plan, Eks
+
+async def _dos_setup_async(n, Efn, R, dtype, max_in_flight, retries, retry_delay):
+    '''As _dos_setup, for a coroutine function Efn.
+    '''
+    with _refinement_level(n):
+        with _phase("mesh"):
+            plan = GetMeshPlan(n, R)
+        with _phase("sample"):
+            Eks = await MakeEksAsync(Efn, plan.submesh, plan.G_order, plan.G_neg, dtype,
+                    max_in_flight, retries, retry_delay)
+    return plan, Eks
+
+def _canonical_mesh(plan, Eks):
+    '''Return (tetras, Eks) converted from the layout of plan to the
+    canonical order of MakeTetra and MakeSubmesh, so that the values
+    returned by the DOS drivers do not depend on SetDefaultMeshOrder.
+    '''
+    if plan.k_order is None:
+        return plan.tetras, Eks
+    return CanonicalTetras(plan), BandArray(ToCanonicalOrder(Eks.data, plan), Eks.dtype)
+
+async def DosValuesAsync(Emin, Emax, num_Es, n, Efn, R, dtype=np.float64, max_in_flight=8,
+        retries=2, retry_delay=0.1):
+    '''As DosValues, but for a coroutine function Efn, which is sampled by
+    MakeEksAsync with the given max_in_flight, retries and retry_delay.
+    '''
+    plan, Eks = await _dos_setup_async(n, Efn, R, dtype, max_in_flight, retries, retry_delay)
+    return _dos_values(Emin, Emax, num_Es, n, plan, Eks)
+
+def DosValuesPerBand(Emin, Emax, num_Es, n, Efn, R, dtype=np.float64):
     '''Return a list of D_i(E) values giving the density of states at energy E
     summed over all tetrahedra separated by band index i; E ranges over num_Es
     equally spaced values from Emin to Emax.
 
     Also returns the list of energy values used and lists of tetrahedra and
     E(k) values so that these can be used in further calculations (such as
-    FindFermi()).
+    FindFermi()). These are in the canonical order of MakeTetra and
+    MakeSubmesh (in the optimal reciprocal lattice orientation) whatever
+    the default mesh order.
 
     The calculation of D(E) is implemented as described in BJA94 Appendix C.
 
-    n = Brillouin zone submesh density (the total number of k-points sampled
-    is (n+1)**3).
+    n = Brillouin zone submesh density; either an integer (the total number
+    of k-points sampled is (n+1)**3) or a tuple (n1, n2, n3) giving the
+    density along each reciprocal lattice vector.
 
     Efn = a function E(k) which returns a list of the band energies at the
     Brillouin zone point k, with the returned list sorted in ascending order;
     k is expressed in the reciprocal lattice basis.
 
     R = a numpy matrix with rows given by the reciprocal lattice vectors.
+
+    dtype = storage type of the sampled energies; numpy.float32 halves the
+    memory use of Eks (see bands.BandArray).
     '''
-    tetras, Eks = _dos_setup(n, Efn, R)
+    plan, Eks = _dos_setup(n, Efn, R, dtype)
+    tetras = plan.tetras
     # Get D(E) values.
     E_vals = np.linspace(Emin, Emax, num_Es)
     dos_vals = []
-    for E in E_vals:
-        dos_vals.append(DosPerBand(E, tetras, Eks))
-    return dos_vals, E_vals, tetras, Eks
+    with _refinement_level(n), _phase("dos"):
+        for E in E_vals:
+            dos_vals.append(DosPerBand(E, tetras, Eks))
+    return (dos_vals, E_vals) + _canonical_mesh(plan, Eks)
 
 def DosPerBand(E, tetras, Eks):
     '''Return a list with elements D_i(E), the density of states at energy E
@@ -117,17 +179,12 @@ def DosPerBand(E, tetras, Eks):
     indices of submesh (i.e. submesh[kN1] = k1, etc.). The tetrahedra must be
     constructed as described in BJA94 Section III.
 
-    Eks = a list in which each element is a sorted list of eigenstate energies
+    Eks = the eigenstate energies E_n(k) as a BandArray (see ksample.MakeEks),
+    or a list in which each element is a sorted list of eigenstate energies
     E_n(k), with k being the k-point at the corresponding element of submesh
     (i.e. Eks[kN][band_index] = E_n(k)).
     '''
-    num_bands = len(Eks[0])
-    num_tetra = len(tetras)
-    Dis = [0.0]*num_bands
-    for tet in tetras:
-        for band_index in range(num_bands):
-            Dis[band_index] += DosContrib(E, tet, num_tetra, Eks, band_index)
-    return Dis
+    return FusedSweep(E, tetras, Eks, weights=False).dos_per_band.tolist()
 
 def Dos(E, tetras, Eks):
     '''Return D(E), the density of states at energy E summed over all
@@ -139,17 +196,12 @@ def Dos(E, tetras, Eks):
     indices of submesh (i.e. submesh[kN1] = k1, etc.). The tetrahedra must be
     constructed as described in BJA94 Section III.
 
-    Eks = a list in which each element is a sorted list of eigenstate energies
+    Eks = the eigenstate energies E_n(k) as a BandArray (see ksample.MakeEks),
+    or a list in which each element is a sorted list of eigenstate energies
     E_n(k), with k being the k-point at the corresponding element of submesh
     (i.e. Eks[kN][band_index] = E_n(k)).
     '''
-    num_bands = len(Eks[0])
-    num_tetra = len(tetras)
-    D = 0.0
-    for tet in tetras:
-        for band_index in range(num_bands):
-            D += DosContrib(E, tet, num_tetra, Eks, band_index)
-    return D
+    return FusedSweep(E, tetras, Eks, weights=False).dos
 
 def DosContrib(E, tetra, num_tetra, Eks, band_index):
     '''Return the contribution to the density of states at energy E from the
@@ -169,7 +221,12 @@ def DosContrib(E, tetra, num_tetra, Eks, band_index):
     (i.e. Eks[kN][band_index] = E_n(k)).
 
     band_index = the band index n to consider, corresponding to n in E_n(k).
+
+    If tetra has three vertices, it is taken to be a triangle of a
+    two-dimensional submesh (see triangle.DosContrib2D).
     '''
+    if len(tetra) == 3:
+        return DosContrib2D(E, tetra, num_tetra, Eks, band_index)
     E1, E2, E3, E4 = _tetra_Es(tetra, band_index, Eks)
     if E <= E1:
         return 0.0
@@ -1,7 +1,10 @@
-from scipy.optimize import bisect
+import numpy as np
 from tetra.numstates import NumStates
-from tetra.ksample import OptimizeGs, MakeEks
-from tetra.submesh import MakeSubmesh, MakeTetra
+from tetra.ksample import MakeEks, MakeEksAsync
+from tetra.submesh import RefineDims
+from tetra.plan import GetMeshPlan
+from tetra.instrument import _phase, _refinement_level
+from tetra.bands import _band_major
 
 def FindFermiToTol(n0, Efn, R, num_electrons, tol=None, tetras0=None, Eks0=None):
     '''Returns the Fermi energy E_F, at which the integrated number of
@@ -10,8 +13,9 @@ def FindFermiToTol(n0, Efn, R, num_electrons, tol=None, tetras0=None, Eks0=None)
     e.g. for a collinear spin-polarized system, Eks must not contain only
     up-spins or only down-spins but instead contain all states of both types.
 
-    n0 = initial value for Brillouin zone submesh density (the total number of
-    k-points sampled is (n+1)**3).
+    n0 = initial value for Brillouin zone submesh density; either an integer
+    (the total number of k-points sampled is (n+1)**3) or a tuple
+    (n1, n2, n3) giving the density along each reciprocal lattice vector.
 
     Efn = a function E(k) which returns a list of the band energies at the
     Brillouin zone point k, with the returned list sorted in ascending order;
@@ -20,45 +24,79 @@ def FindFermiToTol(n0, Efn, R, num_electrons, tol=None, tetras0=None, Eks0=None)
     R = a numpy matrix with rows given by the reciprocal lattice vectors.
 
     tol = if given, accuracy to determine the Fermi energy to; quit if
-            |E_F(n) - E_F(2*n)| < tol.
+            |E_F(n) - E_F(2*n)| < tol. For anisotropic n0, only the
+            under-resolved axes are refined at each step (see RefineDims).
 
     tetras0 = pre-determined tetrahedron list at n=n0.
 
     Eks0 = pre-determined band energy sampled over submesh with n=n0.
     '''
-    # Get optimal reciprocal lattice orientation.
-    G_order, G_neg = OptimizeGs(R)
-
-    val, old_val = None, None
-    if tetras0 != None and Eks0 != None:
-        val = FindFermi(num_electrons, tetras0, Eks0)
-    else:
-        # Generate submesh and tetrahedra.
-        submesh = MakeSubmesh(n0)
-        tetras = MakeTetra(n0)
-        # Sample E(k).
-        Eks = MakeEks(Efn, submesh, G_order, G_neg)
-        # Get E_F.
-        val = FindFermi(num_electrons, tetras, Eks)
-    print("Got E_Fermi = {} at n = {}".format(val, n0))
-
+    levels = _fermi_levels(n0, R, tol)
+    try:
+        n = next(levels)
+        if tetras0 is not None and Eks0 is not None:
+            with _refinement_level(n0), _phase("fermi"):
+                val = FindFermi(num_electrons, tetras0, Eks0)
+            n = levels.send(val)
+        while True:
+            n = levels.send(_fermi_at_n(n, Efn, R, num_electrons))
+    except StopIteration as stop:
+        return stop.value
+
+def _fermi_levels(n0, R, tol):
+    '''Generator implementing the refinement loop shared by FindFermiToTol
+    and FindFermiToTolAsync: yields each submesh density at which to find
+    E_F, starting from n0, and is sent the E_F found there. Stops with the
+    value of E_F at the last density, once tol is met (or after the first
+    density if tol is None).
+    '''
+    n = n0
+    val = yield n
     if tol == None:
         return val
-
-    n = n0
+    old_val = None
     while old_val == None or abs(val - old_val) > tol:
         old_val = val
-        n *= 2
-        # Generate submesh and tetrahedra.
-        submesh = MakeSubmesh(n)
-        tetras = MakeTetra(n)
+        n = RefineDims(n, R)
+        val = yield n
+    return val
+
+def _fermi_at_n(n, Efn, R, num_electrons):
+    with _refinement_level(n):
+        # Get submesh and tetrahedra in the optimal reciprocal lattice
+        # orientation.
+        with _phase("mesh"):
+            plan = GetMeshPlan(n, R)
         # Sample E(k).
-        Eks = MakeEks(Efn, submesh, G_order, G_neg)
+        with _phase("sample"):
+            Eks = MakeEks(Efn, plan.submesh, plan.G_order, plan.G_neg)
         # Get E_F.
-        val = FindFermi(num_electrons, tetras, Eks)
-        print("Got E_Fermi = {} at n = {}".format(val, n))
+        with _phase("fermi"):
+            return FindFermi(num_electrons, plan.tetras, Eks)
 
-    return val
+async def FindFermiToTolAsync(n0, Efn, R, num_electrons, tol=None, max_in_flight=8,
+        retries=2, retry_delay=0.1):
+    '''As FindFermiToTol, but for a coroutine function Efn, which is sampled
+    by MakeEksAsync with the given max_in_flight, retries and retry_delay.
+    '''
+    levels = _fermi_levels(n0, R, tol)
+    try:
+        n = next(levels)
+        while True:
+            n = levels.send(await _fermi_at_n_async(n, Efn, R, num_electrons,
+                    max_in_flight, retries, retry_delay))
+    except StopIteration as stop:
+        return stop.value
+
+async def _fermi_at_n_async(n, Efn, R, num_electrons, max_in_flight, retries, retry_delay):
+    with _refinement_level(n):
+        with _phase("mesh"):
+            plan = GetMeshPlan(n, R)
+        with _phase("sample"):
+            Eks = await MakeEksAsync(Efn, plan.submesh, plan.G_order, plan.G_neg,
+                    max_in_flight=max_in_flight, retries=retries, retry_delay=retry_delay)
+        with _phase("fermi"):
+            return FindFermi(num_electrons, plan.tetras, Eks)
 
 def FindFermi(num_electrons, tetras, Eks):
     '''Returns the Fermi energy E_F, at which the integrated number of
@@ -76,9 +114,12 @@ def FindFermi(num_electrons, tetras, Eks):
     E_n(k), with k being the k-point at the corresponding element of submesh
     (i.e. Eks[kN][band_index] = E_n(k)).
     '''
+    # Import scipy here rather than at module level: importing scipy.optimize
+    # dominates the startup time of short jobs which never solve for E_F.
+    from scipy.optimize import bisect
     def statecount_error(E):
-        count = NumStates(E, tetras, Eks)
-        print("At E = ", E, " count = ", count)
+        with _phase("numstates"):
+            count = NumStates(E, tetras, Eks)
         return count - num_electrons
     emin = _minimum_E(Eks)
     emax = _maximum_E(Eks)
@@ -86,17 +127,7 @@ def FindFermi(num_electrons, tetras, Eks):
     return E_Fermi
 
 def _minimum_E(Eks):
-    minval = None
-    for Es_at_k in Eks:
-        for energy in Es_at_k:
-            if minval == None or energy < minval:
-                minval = energy
-    return minval
+    return float(np.min(_band_major(Eks)))
 
 def _maximum_E(Eks):
-    maxval = None
-    for Es_at_k in Eks:
-        for energy in Es_at_k:
-            if maxval == None or energy > maxval:
-                maxval = energy
-    return maxval
+    return float(np.max(_band_major(Eks)))
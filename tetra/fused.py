@@ -0,0 +1,393 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from math import fsum
+import os
+import threading
+import warnings
+import numpy as np
+from tetra.bands import _band_major
+from tetra import jit
+
+SweepResult = namedtuple("SweepResult", ["num_states", "dos", "dos_per_band", "weights"])
+SweepResult.__doc__ = '''Results of FusedSweep at energy E.
+
+num_states = n(E), the integrated density of states (as NumStates).
+
+dos = D(E), the density of states (as Dos).
+
+dos_per_band = numpy array with elements D_i(E) (as DosPerBand).
+
+weights = numpy array of integration weights w[n][j] for Fermi energy E,
+including the curvature correction (as Weights), or None if weights were
+not requested.
+'''
+
+# Number of tetrahedra processed at once; bounds the size of the temporary
+# arrays to a few MB independent of the submesh density.
+_BLOCK_SIZE = 2**15
+
+_BACKENDS = ("numpy", "numba")
+
+_backend = {"name": "numpy", "num_threads": None}
+
+# Thread pools by number of threads. A pool is never shut down, since
+# another thread may be using it; one is kept for each thread count used.
+_pools = {}
+_pool_lock = threading.Lock()
+_pool_thread = threading.local()
+
+def _reset_pools():
+    # The threads of the pools do not survive fork (e.g. in the worker
+    # processes of DosValues_AllE); start new pools in the child.
+    _pools.clear()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pools)
+
+def SetBackend(name):
+    '''Select the kernel used by FusedSweep (and so by NumStates, Dos,
+    DosPerBand, Weights and the top-level functions): "numpy" (vectorized
+    over blocks of tetrahedra) or "numba" (a compiled loop over the
+    tetrahedra, parallelized over chunks of tetrahedra, which avoids the
+    temporary arrays of the NumPy kernel). If "numba" is selected but numba
+    is not installed, a warning is issued and "numpy" is used instead.
+    '''
+    if name not in _BACKENDS:
+        raise ValueError("Unknown backend {} in SetBackend.".format(name))
+    if name == "numba" and not jit.Available():
+        warnings.warn("numba is not available; using the numpy backend.")
+        name = "numpy"
+    _backend["name"] = name
+
+def GetBackend():
+    '''Return the name of the kernel used by FusedSweep (see SetBackend).
+    '''
+    return _backend["name"]
+
+def SetNumThreads(num_threads=None):
+    '''Set the number of threads used by FusedSweep; if None, the number of
+    CPUs is used. The tetrahedra are divided into blocks of a fixed size
+    which do not depend on the number of threads, and the per-block partial
+    results are combined in block order, so the results are bit-for-bit
+    identical for any number of threads.
+
+    FusedSweep may be called from several threads at once. When called
+    from one of the threads of its own pool (e.g. from a function run
+    concurrently with the sweep's tasks), it runs on the calling thread
+    instead, so that it cannot wait on tasks queued behind itself.
+    '''
+    if num_threads is not None and num_threads < 1:
+        raise ValueError("num_threads must be at least 1.")
+    _backend["num_threads"] = num_threads
+
+def GetNumThreads():
+    '''Return the number of threads used by FusedSweep (see SetNumThreads).
+    '''
+    if _backend["num_threads"] is None:
+        return os.cpu_count() or 1
+    return _backend["num_threads"]
+
+def FusedSweep(E, tetras, Eks, weights=True):
+    '''Return a SweepResult giving n(E), D(E), the per-band D_i(E), and
+    (if weights is True) the integration weights with Fermi energy E, from a
+    single pass over all tetrahedra and band indices. Each (tetrahedron,
+    band) pair has its corner energies gathered and sorted once; the result
+    is equal to the sums of NumStatesContrib, DosContrib and WeightContrib
+    over all tetrahedra and bands, up to floating-point rounding.
+
+    NumStates, Dos, DosPerBand and Weights are implemented in terms of this
+    function. The kernel used is selected by SetBackend.
+
+    If tetras has three columns, its rows are the triangles of a
+    two-dimensional submesh (see submesh.MakeTriangles) and the
+    contributions are those of the triangle method (see triangle.py); these
+    are always computed by the NumPy kernel.
+
+    The calculations are implemented as described in BJA94 Appendices A, B
+    and C and Section V.
+
+    tetras = a list of tuples of the form (kN1, kN2, kN3, kN4) denoting the
+    vertices of tetrahedra to include in the summation, where the kN's are
+    indices of submesh (i.e. submesh[kN1] = k1, etc.). The tetrahedra must be
+    constructed as described in BJA94 Section III.
+
+    Eks = the eigenstate energies E_n(k) as a BandArray (see ksample.MakeEks),
+    or a list in which each element is a sorted list of eigenstate energies
+    E_n(k), with k being the k-point at the corresponding element of submesh
+    (i.e. Eks[kN][band_index] = E_n(k)).
+    '''
+    tetras = np.asarray(tetras, dtype=np.intp)
+    Es_by_band = _band_major(Eks)
+    num_threads = GetNumThreads()
+    if _backend["name"] == "numba" and tetras.shape[1] == 4:
+        num_states, dos_per_band, ws = jit._sweep(E, tetras, Es_by_band, weights,
+                _BLOCK_SIZE, num_threads)
+        return SweepResult(num_states, fsum(dos_per_band), dos_per_band, ws)
+    num_bands, num_ks = Es_by_band.shape
+    num_tetra = tetras.shape[0]
+    sweep_block = _sweep_block if tetras.shape[1] == 4 else _sweep_block_2d
+
+    def sweep_task(task):
+        band_index, start = task
+        tet_block = tetras[start:start+_BLOCK_SIZE]
+        # Accumulate in double precision regardless of the storage type.
+        corner_Es = Es_by_band[band_index][tet_block].astype(np.float64, copy=False)
+        n_T, D_T, w_T = sweep_block(E, corner_Es, num_tetra, weights)
+        lo, ws_local = None, None
+        if weights:
+            lo, ws_local = _local_weights(tet_block, w_T)
+        return np.sum(n_T), np.sum(D_T), lo, ws_local
+
+    # The (band, block) tasks run concurrently; the NumPy operations in
+    # _sweep_block release the GIL. Their results are combined here in task
+    # order, with a Kahan compensation for each weight.
+    tasks = [(band_index, start) for band_index in range(num_bands)
+            for start in range(0, num_tetra, _BLOCK_SIZE)]
+    n_parts = []
+    D_parts = [[] for band_index in range(num_bands)]
+    ws, ws_comp = None, None
+    if weights:
+        ws = np.zeros((num_bands, num_ks), dtype=np.float64)
+        ws_comp = np.zeros((num_bands, num_ks), dtype=np.float64)
+    for (band_index, start), (n_part, D_part, lo, ws_local) in zip(tasks,
+            _map(sweep_task, tasks, num_threads)):
+        n_parts.append(n_part)
+        D_parts[band_index].append(D_part)
+        if weights:
+            k_range = slice(lo, lo + len(ws_local))
+            _kahan_add(ws[band_index, k_range], ws_comp[band_index, k_range], ws_local)
+    if weights:
+        ws -= ws_comp
+    dos_per_band = np.array([fsum(D_band) for D_band in D_parts], dtype=np.float64)
+    return SweepResult(fsum(n_parts), fsum(dos_per_band), dos_per_band, ws)
+
+def _map(fn, tasks, num_threads):
+    '''Return an iterator over fn(task) for each of tasks, in order, using a
+    shared pool of num_threads threads. Must not be relied on for
+    concurrency from within fn: if called from a thread of one of the
+    pools, the tasks run serially on that thread, since waiting on the pool
+    from its own threads could deadlock.
+    '''
+    if num_threads == 1 or len(tasks) == 1 or getattr(_pool_thread, "active", False):
+        return map(fn, tasks)
+    with _pool_lock:
+        executor = _pools.get(num_threads)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=num_threads,
+                    initializer=_mark_pool_thread)
+            _pools[num_threads] = executor
+    return executor.map(fn, tasks)
+
+def _mark_pool_thread():
+    _pool_thread.active = True
+
+def _local_weights(tet_block, w_T):
+    '''Return (lo, ws_local), where ws_local[kN - lo] is the sum of the
+    weights w_T at the vertices kN of a block of tetrahedra. Only the range
+    of k-point indices spanned by the block is covered; this range is small
+    when the tetrahedra are ordered along a space-filling curve (see
+    plan.GetMeshPlan).
+
+    Each weight is split into a high part, a multiple of a power of two
+    large enough that the high parts at each k-point add without rounding
+    in any order, and the remaining low part (Rump, Ogita and Oishi, SIAM J.
+    Sci. Comput. 31, 189 (2008)). Adding the separate sums of the two parts
+    gives each element of ws_local to within about one rounding of the
+    exact sum.
+    '''
+    lo, hi = tet_block.min(), tet_block.max()
+    num_local = hi - lo + 1
+    kNs = (tet_block - lo).ravel()
+    w = w_T.ravel()
+    scale = np.zeros(num_local, dtype=np.float64)
+    np.maximum.at(scale, kNs, np.abs(w))
+    counts = np.bincount(kNs, minlength=num_local)
+    # sigma > 2 counts max|w| at each k-point, so that every partial sum of
+    # the high parts there is a multiple of 2**-53 sigma no larger than sigma.
+    sigma = np.ldexp(1.0, np.frexp(scale)[1] + np.frexp(counts)[1] + 1)[kNs]
+    w_high = (sigma + w) - sigma
+    w_low = w - w_high
+    return lo, (np.bincount(kNs, weights=w_high, minlength=num_local)
+            + np.bincount(kNs, weights=w_low, minlength=num_local))
+
+def _kahan_add(total, comp, values):
+    '''Add values to total elementwise, in place, with the Kahan compensation
+    for each element kept in comp; total - comp approaches the exact sum.
+    '''
+    y = values - comp
+    s = total + y
+    comp[...] = (s - total) - y
+    total[...] = s
+
+def _sweep_block(E, corner_Es, num_tetra, weights):
+    '''Return the per-tetrahedron contributions n_T(E), D_T(E) and (if
+    weights is True) the curvature-corrected weights, for a block of
+    tetrahedra of a single band with corner energies corner_Es (an array
+    with shape (num_block, 4), in the vertex order of the tetrahedra). The
+    returned weights are in the same vertex order.
+
+    E is either a single energy or an array giving an energy for each
+    tetrahedron of the block.
+
+    The region formulas are those of NumStatesContrib, DosContrib (through
+    _tetra_dos), and WeightContrib. Their degenerate-energy special cases
+    are never reached there (e.g. E1 < E <= E2 excludes E1 == E2), so they
+    are not needed here.
+    '''
+    order = np.argsort(corner_Es, axis=1, kind='stable')
+    Es = np.take_along_axis(corner_Es, order, axis=1)
+    E1, E2, E3, E4 = Es[:, 0], Es[:, 1], Es[:, 2], Es[:, 3]
+    E = np.broadcast_to(np.asarray(E, dtype=np.float64), E1.shape)
+    num_block = Es.shape[0]
+    V = 1.0 / num_tetra
+    n_T = np.zeros(num_block, dtype=np.float64)
+    D_T = V * _tetra_dos(E, E1, E2, E3, E4)
+    w = np.zeros((num_block, 4), dtype=np.float64) if weights else None
+
+    # E1 < E <= E2
+    r = np.nonzero((E1 < E) & (E <= E2))[0]
+    if len(r) > 0:
+        e, e1, e2, e3, e4 = E[r], E1[r], E2[r], E3[r], E4[r]
+        x = e - e1
+        denom = (e2 - e1)*(e3 - e1)*(e4 - e1)
+        n_T[r] = V * x**3 / denom
+        if weights:
+            C = (V/4) * x**3 / denom
+            w[r, 0] = C * (4 - x*(1/(e2 - e1) + 1/(e3 - e1) + 1/(e4 - e1)))
+            w[r, 1] = C * x / (e2 - e1)
+            w[r, 2] = C * x / (e3 - e1)
+            w[r, 3] = C * x / (e4 - e1)
+    # E2 < E <= E3
+    r = np.nonzero((E2 < E) & (E <= E3))[0]
+    if len(r) > 0:
+        e, e1, e2, e3, e4 = E[r], E1[r], E2[r], E3[r], E4[r]
+        y = e - e2
+        fac = V / ((e3 - e1)*(e4 - e1))
+        corr = ((e3 - e1) + (e4 - e2))/((e3 - e2)*(e4 - e2))
+        n_T[r] = fac * ((e2 - e1)**2 + 3.0*(e2 - e1)*y + 3.0*y**2 - corr*y**3)
+        if weights:
+            C1 = (V/4) * (e - e1)**2 / ((e4 - e1)*(e3 - e1))
+            C2 = (V/4) * (e - e1)*(e - e2)*(e3 - e) / ((e4 - e1)*(e3 - e2)*(e3 - e1))
+            C3 = (V/4) * (e - e2)**2 * (e4 - e) / ((e4 - e2)*(e3 - e2)*(e4 - e1))
+            w[r, 0] = C1 + (C1 + C2)*(e3 - e)/(e3 - e1) + (C1 + C2 + C3)*(e4 - e)/(e4 - e1)
+            w[r, 1] = C1 + C2 + C3 + (C2 + C3)*(e3 - e)/(e3 - e2) + C3*(e4 - e)/(e4 - e2)
+            w[r, 2] = (C1 + C2)*(e - e1)/(e3 - e1) + (C2 + C3)*(e - e2)/(e3 - e2)
+            w[r, 3] = (C1 + C2 + C3)*(e - e1)/(e4 - e1) + C3*(e - e2)/(e4 - e2)
+    # E3 < E <= E4
+    r = np.nonzero((E3 < E) & (E <= E4))[0]
+    if len(r) > 0:
+        e, e1, e2, e3, e4 = E[r], E1[r], E2[r], E3[r], E4[r]
+        z = e4 - e
+        denom = (e4 - e1)*(e4 - e2)*(e4 - e3)
+        n_T[r] = V * (1.0 - z**3/denom)
+        if weights:
+            C = (V/4) * z**3 / denom
+            w[r, 0] = V/4 - C*z/(e4 - e1)
+            w[r, 1] = V/4 - C*z/(e4 - e2)
+            w[r, 2] = V/4 - C*z/(e4 - e3)
+            w[r, 3] = V/4 - C*(4 - (1/(e4 - e1) + 1/(e4 - e2) + 1/(e4 - e3))*z)
+    # E > E4
+    r = E > E4
+    n_T[r] = V
+    if weights:
+        w[r, :] = V/4
+
+    if not weights:
+        return n_T, D_T, None
+    # Curvature correction (BJA94 Eq. 22), using D_T from above.
+    w += (D_T / 40)[:, np.newaxis] * (np.sum(Es, axis=1)[:, np.newaxis] - 4*Es)
+    # Return weights to the vertex order of the tetrahedra.
+    w_tet = np.empty_like(w)
+    np.put_along_axis(w_tet, order, w, axis=1)
+    return n_T, D_T, w_tet
+
+def _sweep_block_2d(E, corner_Es, num_triangle, weights):
+    '''As _sweep_block, for a block of triangles with corner energies
+    corner_Es (an array with shape (num_block, 3)). The region formulas are
+    those of triangle.NumStatesContrib2D, DosContrib2D (through
+    _triangle_dos) and WeightContrib2D.
+    '''
+    order = np.argsort(corner_Es, axis=1, kind='stable')
+    Es = np.take_along_axis(corner_Es, order, axis=1)
+    E1, E2, E3 = Es[:, 0], Es[:, 1], Es[:, 2]
+    E = np.broadcast_to(np.asarray(E, dtype=np.float64), E1.shape)
+    num_block = Es.shape[0]
+    V = 1.0 / num_triangle
+    n_T = np.zeros(num_block, dtype=np.float64)
+    D_T = V * _triangle_dos(E, E1, E2, E3)
+    w = np.zeros((num_block, 3), dtype=np.float64) if weights else None
+
+    # E1 < E <= E2
+    r = np.nonzero((E1 < E) & (E <= E2))[0]
+    if len(r) > 0:
+        e, e1, e2, e3 = E[r], E1[r], E2[r], E3[r]
+        a = (e - e1)/(e2 - e1)
+        b = (e - e1)/(e3 - e1)
+        n_T[r] = V * a*b
+        if weights:
+            C = V*a*b/3
+            w[r, 0] = C*(3 - a - b)
+            w[r, 1] = C*a
+            w[r, 2] = C*b
+    # E2 < E <= E3
+    r = np.nonzero((E2 < E) & (E <= E3))[0]
+    if len(r) > 0:
+        e, e1, e2, e3 = E[r], E1[r], E2[r], E3[r]
+        c = (e3 - e)/(e3 - e1)
+        d = (e3 - e)/(e3 - e2)
+        n_T[r] = V * (1.0 - c*d)
+        if weights:
+            C = V*c*d/3
+            w[r, 0] = V/3 - C*c
+            w[r, 1] = V/3 - C*d
+            w[r, 2] = V/3 - C*(3 - c - d)
+    # E > E3
+    r = E > E3
+    n_T[r] = V
+    if weights:
+        w[r, :] = V/3
+
+    if not weights:
+        return n_T, D_T, None
+    w_tri = np.empty_like(w)
+    np.put_along_axis(w_tri, order, w, axis=1)
+    return n_T, D_T, w_tri
+
+def _tetra_dos(E, E1, E2, E3, E4):
+    '''Return the density of states of a single tetrahedron of unit volume
+    with sorted corner energies E1 <= E2 <= E3 <= E4, at energies E; all
+    arguments are arrays of equal shape. These are the formulas of
+    DosContrib, evaluated elementwise; _sweep_block and PairSpectra use
+    them scaled by the tetrahedron volume.
+    '''
+    D = np.zeros(E.shape, dtype=np.float64)
+    r = np.nonzero((E1 < E) & (E <= E2))[0]
+    if len(r) > 0:
+        e, e1, e2, e3, e4 = E[r], E1[r], E2[r], E3[r], E4[r]
+        D[r] = 3*(e - e1)**2 / ((e2 - e1)*(e3 - e1)*(e4 - e1))
+    r = np.nonzero((E2 < E) & (E <= E3))[0]
+    if len(r) > 0:
+        e, e1, e2, e3, e4 = E[r], E1[r], E2[r], E3[r], E4[r]
+        y = e - e2
+        corr = ((e3 - e1) + (e4 - e2))/((e3 - e2)*(e4 - e2))
+        D[r] = (3*(e2 - e1) + 6*y - 3*corr*y**2) / ((e3 - e1)*(e4 - e1))
+    r = np.nonzero((E3 < E) & (E <= E4))[0]
+    if len(r) > 0:
+        e, e1, e2, e3, e4 = E[r], E1[r], E2[r], E3[r], E4[r]
+        D[r] = 3*(e4 - e)**2 / ((e4 - e1)*(e4 - e2)*(e4 - e3))
+    return D
+
+def _triangle_dos(E, E1, E2, E3):
+    '''As _tetra_dos, for a triangle of unit area with sorted corner
+    energies E1 <= E2 <= E3 (the formulas of triangle.DosContrib2D).
+    '''
+    D = np.zeros(E.shape, dtype=np.float64)
+    r = np.nonzero((E1 < E) & (E <= E2))[0]
+    if len(r) > 0:
+        e, e1, e2, e3 = E[r], E1[r], E2[r], E3[r]
+        D[r] = 2*(e - e1) / ((e2 - e1)*(e3 - e1))
+    r = np.nonzero((E2 < E) & (E <= E3))[0]
+    if len(r) > 0:
+        e, e1, e2, e3 = E[r], E1[r], E2[r], E3[r]
+        D[r] = 2*(e3 - e) / ((e3 - e1)*(e3 - e2))
+    return D
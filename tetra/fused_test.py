@@ -0,0 +1,135 @@
+import threading
+import unittest
+from math import fsum
+import numpy as np
+from tetra.fused import FusedSweep, SetBackend, GetBackend, SetNumThreads
+from tetra import fused, jit
+from tetra.benchmark import HexagonalMultiBand, _Reference
+from tetra.plan import GetMeshPlan
+from tetra.ksample import MakeEks
+from tetra.dos import DosContrib
+
+class TestFusedSweep(unittest.TestCase):
+    def tearDown(self):
+        SetBackend("numpy")
+        SetNumThreads(None)
+        fused._BLOCK_SIZE = self.block_size
+
+    def setUp(self):
+        self.block_size = fused._BLOCK_SIZE
+
+    def test_matches_contrib_sums(self):
+        model = HexagonalMultiBand()
+        plan = GetMeshPlan(4, model.R)
+        Eks = MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg)
+        ref = _Reference(model, plan)
+        # Energies below, inside and above the bands, including an energy
+        # equal to a sampled band energy.
+        for E in (-4.0, -1.0, Eks[0][1], 0.5, 1.2, 4.0):
+            result = FusedSweep(E, plan.tetras, Eks)
+            self.assertAlmostEqual(result.num_states, ref.NumStates(E), places=12)
+            self.assertAlmostEqual(result.dos, ref.Dos(E), places=12)
+            dos_per_band = [fsum(DosContrib(E, tet, ref.num_tetra, ref.Eks, b)
+                    for tet in ref.tetras) for b in range(ref.num_bands)]
+            self.assertTrue(np.allclose(result.dos_per_band, dos_per_band, rtol=0.0, atol=1e-12))
+            self.assertTrue(np.allclose(result.weights, ref.Weights(E), rtol=0.0, atol=1e-15))
+        self.assertTrue(FusedSweep(0.5, plan.tetras, Eks, weights=False).weights is None)
+
+    @unittest.skipUnless(jit.Available(), "numba not installed")
+    def test_numba_backend(self):
+        SetBackend("numba")
+        self.assertEqual(GetBackend(), "numba")
+        self.test_matches_contrib_sums()
+
+    def test_kernel_logic(self):
+        # Run the numba kernel as plain Python, so that its formulas and the
+        # blockwise scatter of the weights are checked without numba.
+        def njit(**options):
+            return lambda fn: fn
+        saved = dict(jit._kernel)
+        jit._kernel.clear()
+        (jit._kernel["sweep_band"], jit._kernel["block_ranges"],
+                jit._kernel["add_blocks"]) = jit._compile(njit, range)
+        jit._kernel["set_num_threads"] = lambda num_threads: None
+        jit._kernel["max_threads"] = 1
+        try:
+            SetBackend("numba")
+            fused._BLOCK_SIZE = 100
+            self.test_matches_contrib_sums()
+        finally:
+            jit._kernel.clear()
+            jit._kernel.update(saved)
+
+    def test_threads_reproducible(self):
+        model = HexagonalMultiBand()
+        plan = GetMeshPlan(6, model.R)
+        Eks = MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg)
+        # Use many small blocks so that each thread processes several.
+        fused._BLOCK_SIZE = 100
+        backends = ["numpy"] + (["numba"] if jit.Available() else [])
+        for backend in backends:
+            SetBackend(backend)
+            results = []
+            for num_threads in (1, 3, 8):
+                SetNumThreads(num_threads)
+                results.append(FusedSweep(0.3, plan.tetras, Eks))
+            for result in results[1:]:
+                self.assertEqual(result.num_states, results[0].num_states)
+                self.assertTrue((result.dos_per_band == results[0].dos_per_band).all())
+                self.assertTrue((result.weights == results[0].weights).all())
+
+    def test_compensated_weights(self):
+        # Terms which cancel exactly are lost by plain summation.
+        tet_block = np.array([[3, 4, 5, 6]]*3)
+        w_T = np.array([[1e16, 1.0, 0.1, 2.0], [1.0, -1e16, 0.2, 3.0], [-1e16, 1e16, 0.3, 5.0]])
+        lo, ws_local = fused._local_weights(tet_block, w_T)
+        self.assertEqual(lo, 3)
+        self.assertEqual(ws_local.tolist(), [fsum(w_T[:, j]) for j in range(4)])
+
+        # Compare with the correctly rounded sums of the same per-tetrahedron
+        # weights, over many small blocks.
+        model = HexagonalMultiBand()
+        plan = GetMeshPlan(6, model.R)
+        Eks = MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg)
+        fused._BLOCK_SIZE = 100
+        E = 0.3
+        ws = FusedSweep(E, plan.tetras, Eks).weights
+        for b in range(Eks.num_bands):
+            w_T = fused._sweep_block(E, Eks.data[b][plan.tetras], len(plan.tetras), True)[2]
+            terms = [[] for kN in range(len(plan.submesh))]
+            for tet, w in zip(plan.tetras.tolist(), w_T.tolist()):
+                for kN, w_kN in zip(tet, w):
+                    terms[kN].append(w_kN)
+            expected = np.array([fsum(t) for t in terms])
+            self.assertTrue(np.all(np.abs(ws[b] - expected) <= np.spacing(np.abs(expected))))
+
+    def test_nested_and_concurrent(self):
+        model = HexagonalMultiBand()
+        plan = GetMeshPlan(4, model.R)
+        Eks = MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg)
+        fused._BLOCK_SIZE = 100
+        SetNumThreads(2)
+        expected = FusedSweep(0.3, plan.tetras, Eks).weights
+        results = []
+
+        def run():
+            # Sweeps from within the pool's own threads run serially there;
+            # pools with other thread counts are used alongside.
+            for num_threads in (2, 3, 2):
+                results.extend(fused._map(lambda E: FusedSweep(E, plan.tetras, Eks).weights,
+                        [0.3]*4, num_threads))
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(60.0)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(results), 12)
+        for ws in results:
+            self.assertTrue((ws == expected).all())
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            SetBackend("fortran")
+
+if __name__ == "__main__":
+    unittest.main()
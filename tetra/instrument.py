@@ -0,0 +1,151 @@
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+import tracemalloc
+
+PhaseRecord = namedtuple("PhaseRecord", ["level", "phase", "wall_time", "peak_bytes"])
+PhaseRecord.__doc__ = '''Timing and memory use of one execution of a phase of a calculation.
+
+level = submesh density n of the refinement level the phase belongs to, or
+None if the phase is not part of a refinement loop.
+
+phase = name of the phase; one of "mesh" (submesh and tetrahedra
+construction), "sample" (sampling of E(k) or X(k)), "fermi" (solution for
+the Fermi energy), "numstates" (one evaluation of n(E) during the Fermi
+energy solution), "weights" (integration weights), "dos" (density of
+states evaluation), or "contract" (summation of X(k) against the weights).
+
+wall_time = elapsed wall-clock time in seconds.
+
+peak_bytes = peak traced memory during the phase, in bytes above the traced
+memory at its start, as reported by tracemalloc; None if memory is not
+tracked. Includes the memory of phases nested within it.
+'''
+
+_recorder = ContextVar("tetra_recorder", default=None)
+_level = ContextVar("tetra_level", default=None)
+# One-element list holding the peak traced memory seen so far by the
+# innermost enclosing phase; nested phases reset the tracemalloc peak, so
+# they pass the peaks they would hide up to their parent.
+_peak = ContextVar("tetra_peak", default=None)
+
+class PhaseRecorder:
+    '''Collects a PhaseRecord for each phase of the calculations performed
+    while the recorder is active. Calculations are not instrumented unless a
+    recorder is active. Usage:
+
+        with PhaseRecorder() as rec:
+            SumEnergy(n, Efn, R, num_electrons, tolerance)
+        for level, phases in rec.ByLevel().items():
+            ...
+
+    callback = if given, a function called with each PhaseRecord as soon as
+    the corresponding phase finishes.
+
+    track_memory = if True, record the peak memory of each phase using
+    tracemalloc. This slows down the calculation significantly. If tracemalloc
+    is not already tracing, it is started when the recorder is entered and
+    stopped when the recorder exits.
+    '''
+    def __init__(self, callback=None, track_memory=False):
+        self.records = []
+        self.callback = callback
+        self.track_memory = track_memory
+        self._token = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._token = _recorder.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _recorder.reset(self._token)
+        self._token = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return False
+
+    def Record(self, record):
+        '''Add record to the list of records and pass it to the callback.
+        '''
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def ByLevel(self):
+        '''Return an OrderedDict mapping each refinement level (in the order
+        the levels were first seen) to an OrderedDict mapping each phase name
+        to a dict with keys "wall_time" (total seconds), "calls" (number of
+        executions), and "peak_bytes" (the largest peak_bytes of the
+        executions, or None if memory was not tracked).
+        '''
+        levels = OrderedDict()
+        for rec in self.records:
+            phases = levels.setdefault(rec.level, OrderedDict())
+            totals = phases.setdefault(rec.phase, {"wall_time": 0.0, "calls": 0,
+                    "peak_bytes": None})
+            totals["wall_time"] += rec.wall_time
+            totals["calls"] += 1
+            if rec.peak_bytes is not None:
+                totals["peak_bytes"] = max(totals["peak_bytes"] or 0, rec.peak_bytes)
+        return levels
+
+    def AsDicts(self):
+        '''Return the records as a list of dicts, suitable for serialization.
+        Levels given as tuples (n1, n2, n3) are converted to lists.
+        '''
+        dicts = []
+        for rec in self.records:
+            d = rec._asdict()
+            if isinstance(d["level"], tuple):
+                d["level"] = list(d["level"])
+            dicts.append(d)
+        return dicts
+
+@contextmanager
+def _phase(name):
+    '''Record the enclosed block as an execution of the named phase, if a
+    PhaseRecorder is active.
+    '''
+    rec = _recorder.get()
+    if rec is None:
+        yield
+        return
+    track = rec.track_memory and tracemalloc.is_tracing()
+    if track:
+        parent = _peak.get()
+        if parent is not None:
+            parent[0] = max(parent[0], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        mem_start = tracemalloc.get_traced_memory()[0]
+        peak = [mem_start]
+        token = _peak.set(peak)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - start
+        peak_bytes = None
+        if track:
+            _peak.reset(token)
+            if tracemalloc.is_tracing():
+                peak[0] = max(peak[0], tracemalloc.get_traced_memory()[1])
+                peak_bytes = peak[0] - mem_start
+                if parent is not None:
+                    parent[0] = max(parent[0], peak[0])
+        rec.Record(PhaseRecord(_level.get(), name, wall_time, peak_bytes))
+
+@contextmanager
+def _refinement_level(n):
+    '''Attribute phases executed in the enclosed block to refinement level n.
+    '''
+    token = _level.set(n)
+    try:
+        yield
+    finally:
+        _level.reset(token)
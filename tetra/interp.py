@@ -0,0 +1,245 @@
+'''Smooth periodic interpolation of band energies sampled on a coarse submesh,
+for use in place of an expensive Efn on dense submeshes.
+
+Each band E_n(k) is represented as a lattice Fourier series
+
+    E_n(k) = sum_R c_n(R) exp(2 pi i k.R),
+
+where the sum runs over the direct lattice vectors R (in the lattice basis)
+nearest the origin, with several times more terms than sampled k-points.
+The coefficients are chosen to reproduce the sampled energies exactly while
+minimizing the roughness sum_R rho(R) |c_n(R)|**2, with the roughness
+function of Pickett, Krakauer and Allen, PRB 38, 2721 (1988):
+
+    rho(R) = (1 - c1 (|R|/R_min)**2)**2 + c2 (|R|/R_min)**6, c1 = c2 = 3/4.
+
+No point-group symmetry is assumed, so each star contains only R (the
+series is not forced to be even in k).
+'''
+from collections import namedtuple
+import numpy as np
+from tetra.submesh import _mesh_dims
+
+InterpError = namedtuple("InterpError", ["max_abs", "rms", "max_abs_per_band", "num_points"])
+InterpError.__doc__ = '''Interpolation error at k-points held out of the fit.
+
+max_abs = maximum absolute error over all held-out points and bands.
+
+rms = root-mean-square error over all held-out points and bands.
+
+max_abs_per_band = numpy array with the maximum absolute error of each band.
+
+num_points = number of held-out k-points.
+'''
+
+_C1, _C2 = 0.75, 0.75
+
+# Number of k-points evaluated at once by EvaluateMany; bounds the size of
+# the temporary (num_ks, num_Rs) phase array.
+_EVAL_BLOCK_SIZE = 1024
+
+# Number of lattice vectors handled at once by the fit; bounds the size of
+# the temporary (num_ks, num_Rs) phase arrays.
+_FIT_BLOCK_SIZE = 1024
+
+class StarInterpolant:
+    '''Band energies interpolated by a lattice Fourier series. Construct
+    using FitInterpolant or InterpolateEfn.
+
+    A StarInterpolant may be passed anywhere an Efn is expected (e.g. to
+    MakeEks, FindFermiToTol, SumEnergy or DosValues): calling it with a
+    k-point in the reciprocal lattice basis returns the sorted band energies
+    at that point. MakeEks evaluates all k-points of the submesh at once
+    using EvaluateMany.
+
+    error = InterpError giving the error at the held-out k-points, or None
+    if no points were held out.
+    '''
+    def __init__(self, Rs, cos_coeffs, sin_coeffs, error=None):
+        self.Rs = Rs
+        self.cos_coeffs = cos_coeffs
+        self.sin_coeffs = sin_coeffs
+        self.error = error
+
+    @property
+    def num_bands(self):
+        return self.cos_coeffs.shape[0]
+
+    def __call__(self, k):
+        return self.EvaluateMany(np.asarray(k, dtype=np.float64)[np.newaxis, :])[0].tolist()
+
+    def EvaluateMany(self, ks):
+        '''Return a numpy array with shape (num_ks, num_bands) giving the
+        sorted interpolated band energies at each of the k-points ks (an
+        array with shape (num_ks, 3), in the reciprocal lattice basis).
+        '''
+        ks = np.asarray(ks, dtype=np.float64)
+        Es = np.empty((ks.shape[0], self.num_bands), dtype=np.float64)
+        for start in range(0, ks.shape[0], _EVAL_BLOCK_SIZE):
+            phase = 2*np.pi*(ks[start:start+_EVAL_BLOCK_SIZE] @ self.Rs.T)
+            Es[start:start+_EVAL_BLOCK_SIZE] = (np.cos(phase) @ self.cos_coeffs.T
+                    + np.sin(phase) @ self.sin_coeffs.T)
+        # Sorting restores the band ordering where interpolation error
+        # reorders nearly degenerate bands.
+        Es.sort(axis=1)
+        return Es
+
+def InterpolateEfn(n0, Efn, R=None, star_ratio=5, holdout=0.1, seed=0):
+    '''Sample Efn on the coarse submesh MakeSubmesh(n0) and return a
+    StarInterpolant fit to the sampled energies (see FitInterpolant).
+
+    n0 = coarse submesh density; either an integer or a tuple (n1, n2, n3).
+    Points of the submesh related by a reciprocal lattice vector are
+    sampled once, so Efn is called prod(n0) times.
+
+    Efn = a function E(k) which returns a list of the band energies at the
+    Brillouin zone point k, with the returned list sorted in ascending order;
+    k is expressed in the reciprocal lattice basis.
+
+    R = a numpy matrix with rows given by the reciprocal lattice vectors;
+    if None, the lattice is taken to be simple cubic.
+
+    star_ratio, holdout and seed are as for FitInterpolant.
+    '''
+    dims = _mesh_dims(n0, "InterpolateEfn")
+    grids = np.meshgrid(*[np.arange(d)/d for d in dims], indexing='ij')
+    ks = np.stack([g.ravel() for g in grids], axis=1)
+    Eks = np.array([Efn(k) for k in ks], dtype=np.float64)
+    return FitInterpolant(ks, Eks, R, star_ratio, holdout, seed)
+
+def FitInterpolant(ks, Eks, R=None, star_ratio=5, holdout=0.1, seed=0):
+    '''Return a StarInterpolant reproducing the band energies Eks sampled at
+    the k-points ks.
+
+    ks = array with shape (num_ks, 3) of k-points in the reciprocal lattice
+    basis. Points equal modulo a reciprocal lattice vector (e.g. opposite
+    faces of a submesh) must have equal energies; only the first is used.
+
+    Eks = array-like with shape (num_ks, num_bands) of sorted band energies.
+
+    R = a numpy matrix with rows given by the reciprocal lattice vectors,
+    used to measure the lengths of direct lattice vectors in the roughness
+    function; if None, the lattice is taken to be simple cubic.
+
+    star_ratio = number of Fourier terms per sampled k-point.
+
+    holdout = fraction of the k-points withheld from a preliminary fit to
+    estimate the interpolation error (reported as the error attribute of the
+    result). The returned interpolant is fit to all k-points. If 0, no error
+    estimate is made.
+
+    seed = seed for the random choice of held-out k-points.
+
+    The fit solves a dense linear system in the num_ks distinct k-points, so
+    its memory use is a few times 8*num_ks**2 bytes (about 0.4 GB in all
+    for the 4096 distinct points of n0 = 16) and its time grows as
+    num_ks**3; the lattice vectors are handled in blocks, so star_ratio
+    affects only the time.
+    '''
+    ks = np.asarray(ks, dtype=np.float64)
+    Eks = np.asarray(Eks, dtype=np.float64)
+    if Eks.ndim != 2 or Eks.shape[0] != ks.shape[0]:
+        raise ValueError("Eks must have shape (num_ks, num_bands) matching ks.")
+    # Remove periodic images; they would make the fit singular.
+    reduced = np.round(np.mod(ks, 1.0), 10) % 1.0
+    _, unique_index = np.unique(reduced, axis=0, return_index=True)
+    unique_index.sort()
+    ks, Eks = ks[unique_index], Eks[unique_index]
+    num_ks = ks.shape[0]
+
+    A = _direct_lattice(R)
+    Rs, rho = _lattice_stars(A, star_ratio*num_ks)
+
+    error = None
+    num_held = int(round(holdout*num_ks))
+    if num_held > 0:
+        if num_ks - num_held < 1:
+            raise ValueError("holdout leaves no k-points to fit.")
+        held = np.random.RandomState(seed).choice(num_ks, num_held, replace=False)
+        fit = np.setdiff1d(np.arange(num_ks), held)
+        trial = _fit(ks[fit], Eks[fit], Rs, rho)
+        diff = trial.EvaluateMany(ks[held]) - Eks[held]
+        error = InterpError(float(np.max(np.abs(diff))), float(np.sqrt(np.mean(diff**2))),
+                np.max(np.abs(diff), axis=0), num_held)
+    return _fit(ks, Eks, Rs, rho, error)
+
+def _fit(ks, Eks, Rs, rho, error=None):
+    '''Return a StarInterpolant for the minimum-roughness series through
+    the points (ks, Eks).
+
+    Minimizing sum_R rho(R) |c(R)|**2 subject to E(k_j) = E_j gives
+    c(R) = rho(R)**-1 sum_j lambda_j exp(-2 pi i k_j.R), where the Lagrange
+    multipliers lambda_j solve H lambda = E with
+    H_ij = sum_R rho(R)**-1 cos(2 pi (k_i - k_j).R). Since the energies are
+    real, c(-R) = c(R)*, and the terms for R and -R are combined into
+    a(R) cos(2 pi k.R) + b(R) sin(2 pi k.R), with
+    a(R) = 2 rho(R)**-1 sum_j lambda_j cos(2 pi k_j.R) and b(R) likewise
+    with sin (without the factor of 2 for R = 0).
+
+    Writing cos(2 pi (k_i - k_j).R) as a sum of products of cosines and of
+    sines, H, a and b are accumulated over blocks of _FIT_BLOCK_SIZE lattice
+    vectors. The memory used is that of H, num_ks**2 floats, plus
+    2*num_ks*_FIT_BLOCK_SIZE floats for the block, rather than growing as
+    num_ks*num_Rs = star_ratio*num_ks**2.
+    '''
+    # Keep R = 0 and the R whose first nonzero component is positive.
+    origin = np.all(Rs == 0, axis=1)
+    first = Rs[np.arange(Rs.shape[0]), np.argmax(Rs != 0, axis=1)]
+    keep = origin | (first > 0)
+    Rs = Rs[keep]
+    weight = np.where(origin[keep], 1.0, 2.0) / rho[keep]
+    num_ks, num_Rs = ks.shape[0], Rs.shape[0]
+    H = np.zeros((num_ks, num_ks), dtype=np.float64)
+    for start in range(0, num_Rs, _FIT_BLOCK_SIZE):
+        phase = 2*np.pi*(ks @ Rs[start:start+_FIT_BLOCK_SIZE].T)
+        w = weight[start:start+_FIT_BLOCK_SIZE]
+        cos_block = np.cos(phase)
+        H += (cos_block * w) @ cos_block.T
+        # Reuse the phase array for the sines.
+        sin_block = np.sin(phase, out=phase)
+        H += (sin_block * w) @ sin_block.T
+    lambdas = np.linalg.solve(H, Eks)
+    del H
+    cos_coeffs = np.empty((Eks.shape[1], num_Rs), dtype=np.float64)
+    sin_coeffs = np.empty((Eks.shape[1], num_Rs), dtype=np.float64)
+    for start in range(0, num_Rs, _FIT_BLOCK_SIZE):
+        stop = min(start + _FIT_BLOCK_SIZE, num_Rs)
+        phase = 2*np.pi*(ks @ Rs[start:stop].T)
+        cos_coeffs[:, start:stop] = (lambdas.T @ np.cos(phase)) * weight[start:stop]
+        sin_coeffs[:, start:stop] = (lambdas.T @ np.sin(phase)) * weight[start:stop]
+    return StarInterpolant(Rs, cos_coeffs, sin_coeffs, error)
+
+def _direct_lattice(R):
+    '''Return the matrix with rows given by the direct lattice vectors
+    corresponding to the reciprocal lattice vectors R (a_i.b_j = 2 pi delta_ij).
+    '''
+    if R is None:
+        return np.eye(3)
+    return 2*np.pi*np.linalg.inv(np.asarray(R, dtype=np.float64)).T
+
+def _lattice_stars(A, num_Rs):
+    '''Return the (at least num_Rs) direct lattice vectors nearest the
+    origin, in the lattice basis, together with their roughness rho(R).
+    Whole shells of equal length are included.
+    '''
+    metric = A @ A.T
+    volume = abs(np.linalg.det(A))
+    radius = (3*num_Rs*volume/(4*np.pi))**(1/3) + np.sqrt(np.max(np.diag(metric)))
+    inv_metric = np.linalg.inv(metric)
+    while True:
+        bounds = [int(np.ceil(radius*np.sqrt(inv_metric[i, i]))) for i in range(3)]
+        grids = np.meshgrid(*[np.arange(-b, b+1) for b in bounds], indexing='ij')
+        Rs = np.stack([g.ravel() for g in grids], axis=1)
+        lengths = np.sqrt(np.einsum('ij,jk,ik->i', Rs, metric, Rs))
+        inside = lengths <= radius
+        if np.count_nonzero(inside) >= num_Rs:
+            break
+        radius *= 1.25
+    order = np.argsort(lengths, kind='stable')
+    cutoff = lengths[order[num_Rs-1]]*(1 + 1e-9)
+    keep = order[lengths[order] <= cutoff]
+    Rs, lengths = Rs[keep], lengths[keep]
+    R_min = np.min(lengths[lengths > 0])
+    x = (lengths/R_min)**2
+    rho = (1 - _C1*x)**2 + _C2*x**3
+    return Rs.astype(np.float64), rho
@@ -0,0 +1,55 @@
+import unittest
+import numpy as np
+from tetra.interp import InterpolateEfn, FitInterpolant
+from tetra import interp
+from tetra.benchmark import CubicSBand, HexagonalMultiBand
+from tetra.plan import GetMeshPlan
+from tetra.ksample import MakeEks
+from tetra.fermi import FindFermiToTol
+
+class TestInterpolation(unittest.TestCase):
+    def test_reproduces_samples(self):
+        model = HexagonalMultiBand()
+        f = InterpolateEfn(4, model.Efn, model.R, holdout=0.0)
+        self.assertTrue(f.error is None)
+        for k in ([0.0, 0.0, 0.0], [0.25, 0.5, 0.75], [0.75, 0.0, 0.25]):
+            self.assertTrue(np.allclose(f(k), model.Efn(k), rtol=0.0, atol=1e-9))
+
+    def test_block_size(self):
+        # The fit is accumulated over blocks of lattice vectors; the result
+        # must not depend on the block size.
+        model = HexagonalMultiBand()
+        ks = np.random.RandomState(1).rand(20, 3)
+        f = InterpolateEfn(3, model.Efn, model.R)
+        block_size = interp._FIT_BLOCK_SIZE
+        try:
+            interp._FIT_BLOCK_SIZE = 7
+            f_small = InterpolateEfn(3, model.Efn, model.R)
+        finally:
+            interp._FIT_BLOCK_SIZE = block_size
+        self.assertTrue(np.allclose(f.EvaluateMany(ks), f_small.EvaluateMany(ks),
+                rtol=0.0, atol=1e-10))
+        self.assertAlmostEqual(f.error.max_abs, f_small.error.max_abs, places=10)
+
+    def test_periodic_images(self):
+        model = CubicSBand()
+        ks = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.5, 0.5, 0.5]])
+        Eks = [model.Efn(k) for k in ks]
+        f = FitInterpolant(ks, Eks, model.R, holdout=0.0)
+        for k, Es in zip(ks, Eks):
+            self.assertTrue(np.allclose(f(k), Es, rtol=0.0, atol=1e-9))
+
+    def test_dense_mesh(self):
+        model = CubicSBand()
+        f = InterpolateEfn(8, model.Efn, model.R)
+        self.assertEqual(f.error.num_points, 51)
+        self.assertTrue(f.error.max_abs < 1e-2)
+        plan = GetMeshPlan(12, model.R)
+        Eks = MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg)
+        Eks_interp = MakeEks(f, plan.submesh, plan.G_order, plan.G_neg)
+        self.assertTrue(np.allclose(Eks_interp.data, Eks.data, rtol=0.0, atol=1e-3))
+        E_Fermi = FindFermiToTol(8, f, model.R, model.num_electrons, tol=1e-2)
+        self.assertAlmostEqual(E_Fermi, 0.0, places=2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,226 @@
+'''Compiled (numba) kernel for FusedSweep, used when the "numba" backend is
+selected by fused.SetBackend. numba is imported and the kernel compiled on
+first use; if numba is not installed, Available() returns False and
+FusedSweep uses its NumPy kernel.
+'''
+from math import fsum
+import numpy as np
+
+_kernel = {}
+
+def Available():
+    '''Return True if the numba kernel can be used.
+    '''
+    return _get_kernel() is not None
+
+def _sweep(E, tetras, Es_by_band, weights, block_size, num_threads):
+    '''Return (num_states, dos_per_band, ws) as for FusedSweep, using the
+    compiled kernel with num_threads threads. Must only be called if
+    Available() is True.
+
+    The tetrahedra are processed in parallel in blocks of block_size, each
+    giving compensated partial sums of n_T(E) and D_T(E) and scattering its
+    weights into its own accumulator covering the range of k-point indices
+    spanned by the block (as fused._local_weights). The accumulators are
+    then added to ws in block order. All of these sums are Kahan-compensated,
+    and the results do not depend on num_threads.
+    '''
+    kernel = _get_kernel()
+    kernel["set_num_threads"](min(num_threads, kernel["max_threads"]))
+    num_bands, num_ks = Es_by_band.shape
+    num_tetra = tetras.shape[0]
+    ws = None
+    if weights:
+        ws = np.zeros((num_bands, num_ks), dtype=np.float64)
+        los, lengths = kernel["block_ranges"](tetras, block_size, num_tetra)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+    else:
+        los = np.zeros(0, dtype=np.intp)
+        offsets = np.zeros(1, dtype=np.intp)
+    # Block accumulators, stored one after another; their total length is
+    # about num_ks (times a small factor for the canonical layout).
+    w_buf = np.empty(offsets[-1], dtype=np.float64)
+    c_buf = np.empty(offsets[-1], dtype=np.float64)
+    n_parts = []
+    dos_per_band = np.zeros(num_bands, dtype=np.float64)
+    for band_index in range(num_bands):
+        n_blocks, D_blocks = kernel["sweep_band"](float(E), tetras, Es_by_band[band_index],
+                block_size, num_tetra, weights, los, offsets, w_buf, c_buf)
+        n_parts.extend(n_blocks.tolist())
+        dos_per_band[band_index] = fsum(D_blocks.tolist())
+        if weights:
+            kernel["add_blocks"](ws[band_index], los, offsets, w_buf, c_buf)
+    return fsum(n_parts), dos_per_band, ws
+
+def _get_kernel():
+    if "sweep_band" in _kernel:
+        return _kernel
+    if "unavailable" in _kernel:
+        return None
+    try:
+        import numba
+    except ImportError:
+        _kernel["unavailable"] = True
+        return None
+    _kernel["sweep_band"], _kernel["block_ranges"], _kernel["add_blocks"] = _compile(
+            numba.njit, numba.prange)
+    _kernel["set_num_threads"] = numba.set_num_threads
+    _kernel["max_threads"] = numba.config.NUMBA_NUM_THREADS
+    return _kernel
+
+def _compile(njit, prange):
+    '''Return the kernel functions (sweep_band, block_ranges, add_blocks), compiled by
+    the decorator njit with parallel loops over prange. With njit returning
+    its argument unchanged and prange = range, the kernel runs as plain
+    Python (used by the tests when numba is not installed).
+    '''
+    @njit(cache=True, nogil=True)
+    def sweep_tetra(E, Es, p, V, w):
+        '''Sort the corner energies Es (and their vertex positions p) in
+        place and return (n_T, D_T); if w is nonempty, set w[p[j]] to the
+        weight of the vertex with the j'th lowest energy, including the
+        curvature correction. The region formulas
+        are those of fused._sweep_block.
+        '''
+        # Stable insertion sort of the four corners, so that vertices with
+        # equal energies are ordered as by the NumPy kernel.
+        for a in range(1, 4):
+            j = a
+            while j > 0 and Es[j] < Es[j-1]:
+                Es[j], Es[j-1] = Es[j-1], Es[j]
+                p[j], p[j-1] = p[j-1], p[j]
+                j -= 1
+        E1, E2, E3, E4 = Es[0], Es[1], Es[2], Es[3]
+        weights = w.shape[0] > 0
+        n_T, D_T = 0.0, 0.0
+        w0, w1, w2, w3 = 0.0, 0.0, 0.0, 0.0
+        if E1 < E and E <= E2:
+            x = E - E1
+            denom = (E2 - E1)*(E3 - E1)*(E4 - E1)
+            n_T = V * x**3 / denom
+            D_T = V * 3*x**2 / denom
+            if weights:
+                C = (V/4) * x**3 / denom
+                w0 = C * (4 - x*(1/(E2 - E1) + 1/(E3 - E1) + 1/(E4 - E1)))
+                w1 = C * x / (E2 - E1)
+                w2 = C * x / (E3 - E1)
+                w3 = C * x / (E4 - E1)
+        elif E2 < E and E <= E3:
+            y = E - E2
+            fac = V / ((E3 - E1)*(E4 - E1))
+            corr = ((E3 - E1) + (E4 - E2))/((E3 - E2)*(E4 - E2))
+            n_T = fac * ((E2 - E1)**2 + 3.0*(E2 - E1)*y + 3.0*y**2 - corr*y**3)
+            D_T = fac * (3*(E2 - E1) + 6*y - 3*corr*y**2)
+            if weights:
+                C1 = (V/4) * (E - E1)**2 / ((E4 - E1)*(E3 - E1))
+                C2 = (V/4) * (E - E1)*(E - E2)*(E3 - E) / ((E4 - E1)*(E3 - E2)*(E3 - E1))
+                C3 = (V/4) * (E - E2)**2 * (E4 - E) / ((E4 - E2)*(E3 - E2)*(E4 - E1))
+                w0 = C1 + (C1 + C2)*(E3 - E)/(E3 - E1) + (C1 + C2 + C3)*(E4 - E)/(E4 - E1)
+                w1 = C1 + C2 + C3 + (C2 + C3)*(E3 - E)/(E3 - E2) + C3*(E4 - E)/(E4 - E2)
+                w2 = (C1 + C2)*(E - E1)/(E3 - E1) + (C2 + C3)*(E - E2)/(E3 - E2)
+                w3 = (C1 + C2 + C3)*(E - E1)/(E4 - E1) + C3*(E - E2)/(E4 - E2)
+        elif E3 < E and E <= E4:
+            z = E4 - E
+            denom = (E4 - E1)*(E4 - E2)*(E4 - E3)
+            n_T = V * (1.0 - z**3/denom)
+            D_T = V * 3*z**2/denom
+            if weights:
+                C = (V/4) * z**3 / denom
+                w0 = V/4 - C*z/(E4 - E1)
+                w1 = V/4 - C*z/(E4 - E2)
+                w2 = V/4 - C*z/(E4 - E3)
+                w3 = V/4 - C*(4 - (1/(E4 - E1) + 1/(E4 - E2) + 1/(E4 - E3))*z)
+        elif E > E4:
+            n_T = V
+            if weights:
+                w0, w1, w2, w3 = V/4, V/4, V/4, V/4
+        if weights:
+            # Curvature correction (BJA94 Eq. 22).
+            Es_sum = E1 + E2 + E3 + E4
+            w[p[0]] = w0 + (D_T / 40)*(Es_sum - 4*E1)
+            w[p[1]] = w1 + (D_T / 40)*(Es_sum - 4*E2)
+            w[p[2]] = w2 + (D_T / 40)*(Es_sum - 4*E3)
+            w[p[3]] = w3 + (D_T / 40)*(Es_sum - 4*E4)
+        return n_T, D_T
+
+    @njit(cache=True, nogil=True, parallel=True)
+    def block_ranges(tetras, block_size, num_tetra):
+        '''Return (los, lengths): the lowest k-point index of each block of
+        tetrahedra, and the length of the range of k-point indices which
+        the block spans.
+        '''
+        num_blocks = (num_tetra + block_size - 1) // block_size
+        los = np.empty(num_blocks, dtype=np.intp)
+        lengths = np.empty(num_blocks, dtype=np.intp)
+        for b in prange(num_blocks):
+            lo = tetras[b*block_size, 0]
+            hi = lo
+            for t in range(b*block_size, min((b + 1)*block_size, num_tetra)):
+                for j in range(4):
+                    lo = min(lo, tetras[t, j])
+                    hi = max(hi, tetras[t, j])
+            los[b] = lo
+            lengths[b] = hi - lo + 1
+        return los, lengths
+
+    @njit(cache=True, nogil=True, parallel=True)
+    def sweep_band(E, tetras, E_band, block_size, num_tetra, weights, los, offsets, w_buf,
+            c_buf):
+        num_blocks = (num_tetra + block_size - 1) // block_size
+        n_blocks = np.zeros(num_blocks)
+        D_blocks = np.zeros(num_blocks)
+        V = 1.0 / num_tetra
+        for b in prange(num_blocks):
+            Es = np.empty(4)
+            p = np.empty(4, dtype=np.intp)
+            w = np.empty(4 if weights else 0)
+            if weights:
+                local = w_buf[offsets[b]:offsets[b+1]]
+                local_comp = c_buf[offsets[b]:offsets[b+1]]
+                local[:] = 0.0
+                local_comp[:] = 0.0
+                lo = los[b]
+            # Kahan-compensated sums over the tetrahedra of the block.
+            n_sum, n_comp, D_sum, D_comp = 0.0, 0.0, 0.0, 0.0
+            for t in range(b*block_size, min((b + 1)*block_size, num_tetra)):
+                for j in range(4):
+                    p[j] = j
+                    Es[j] = E_band[tetras[t, j]]
+                n_T, D_T = sweep_tetra(E, Es, p, V, w)
+                y = n_T - n_comp
+                s = n_sum + y
+                n_comp = (s - n_sum) - y
+                n_sum = s
+                y = D_T - D_comp
+                s = D_sum + y
+                D_comp = (s - D_sum) - y
+                D_sum = s
+                if weights:
+                    for j in range(4):
+                        i = tetras[t, j] - lo
+                        y = w[j] - local_comp[i]
+                        s = local[i] + y
+                        local_comp[i] = (s - local[i]) - y
+                        local[i] = s
+            n_blocks[b] = n_sum
+            D_blocks[b] = D_sum
+        return n_blocks, D_blocks
+
+    @njit(cache=True, nogil=True)
+    def add_blocks(ws_band, los, offsets, w_buf, c_buf):
+        '''Add the block accumulators left in w_buf and c_buf by sweep_band
+        to ws_band, in block order, keeping a Kahan compensation for each
+        k-point.
+        '''
+        comp = np.zeros(ws_band.shape[0])
+        for b in range(los.shape[0]):
+            for i in range(offsets[b+1] - offsets[b]):
+                kN = los[b] + i
+                y = w_buf[offsets[b] + i] - (c_buf[offsets[b] + i] + comp[kN])
+                s = ws_band[kN] + y
+                comp[kN] = (s - ws_band[kN]) - y
+                ws_band[kN] = s
+        for kN in range(ws_band.shape[0]):
+            ws_band[kN] -= comp[kN]
+
+    return sweep_band, block_ranges, add_blocks
@@ -0,0 +1,195 @@
+'''Joint density of states and interband spectra by the tetrahedron method.
+
+For a pair of bands (n, m), the transition energy E_m(k) - E_n(k) is linear
+within each tetrahedron when E_n(k) and E_m(k) are, so the spectrum
+
+    J_nm(omega) = sum_k f_n(k) (1 - f_m(k)) M_nm(k) delta(omega - (E_m(k) - E_n(k)))
+
+is the density of states of the "band" E_m - E_n, with each tetrahedron
+weighted by the occupation factor and the matrix element M_nm. Within a
+tetrahedron these are taken to be constant: M_nm is its average over the
+vertices, and the occupation factor is the occupied volume fraction of band
+n times the unoccupied volume fraction of band m, each from the linear
+interpolation of the tetrahedron method. This is exact for insulators; for
+metals it neglects the correlation of the two fractions within tetrahedra
+cut by the Fermi surface.
+
+With M_nm(k) = |<m k|p|n k>|**2, the imaginary part of the interband
+dielectric function is proportional to J(omega)/omega**2, with
+J = sum_{n,m} J_nm.
+'''
+import numpy as np
+from tetra.bands import _band_major
+from tetra.ksample import MakeEks
+from tetra.plan import GetMeshPlan
+from tetra.fermi import FindFermi
+from tetra.fused import _tetra_dos, _triangle_dos, _sweep_block, _sweep_block_2d
+from tetra.instrument import _phase, _refinement_level
+
+# Number of (tetrahedron, pair) entries processed at once by Spectrum; each
+# entry expands to one element per frequency within its range of
+# transition energies.
+_BLOCK_SIZE = 2**12
+
+class PairSpectra:
+    '''The sorted corner transition energies E_m - E_n of each tetrahedron
+    for a set of band pairs (n, m), from which spectra on any frequency grid
+    are computed by Spectrum. Tetrahedra in which no vertex has n occupied
+    and m unoccupied are dropped when the PairSpectra is constructed.
+
+    The occupation factor f_n (1 - f_m) of each tetrahedron is n_T/V for
+    band n times 1 - n_T/V for band m, where n_T is the tetrahedron's
+    contribution to the number of states at E_F (see numstates.NumStatesContrib)
+    and V its volume. It is continuous in E_F; in tetrahedra cut by the Fermi
+    surface of both bands, the product neglects the correlation between the
+    two fractions. Insulators are unaffected.
+
+    tetras = a list of tuples of the form (kN1, kN2, kN3, kN4) denoting the
+    vertices of tetrahedra to include in the summation, where the kN's are
+    indices of submesh (i.e. submesh[kN1] = k1, etc.). The tetrahedra must be
+    constructed as described in BJA94 Section III. Triangles of a
+    two-dimensional submesh (see submesh.MakeTriangles) may be given instead.
+
+    Eks = the eigenstate energies E_n(k) as a BandArray (see ksample.MakeEks),
+    or a list in which each element is a sorted list of eigenstate energies
+    E_n(k), with k being the k-point at the corresponding element of submesh
+    (i.e. Eks[kN][band_index] = E_n(k)).
+
+    E_Fermi = the Fermi energy (see fermi.FindFermi); states with energy
+    <= E_Fermi are occupied.
+
+    pairs = a list of band index pairs (n, m) to include; if None, all pairs
+    with n < m are included.
+
+    Mks = if given, the matrix elements M_nm(k) of each pair, as a BandArray
+    with one row per pair in the order of pairs (e.g. from ksample.MakeXks
+    with an Xfn returning one value per pair), or a list in which
+    Mks[kN][pair_index] = M_nm(k). The values must be real (e.g. squared
+    magnitudes of momentum matrix elements). If None, M_nm = 1 and Spectrum
+    gives the joint density of states.
+    '''
+    def __init__(self, tetras, Eks, E_Fermi, pairs=None, Mks=None):
+        tetras = np.asarray(tetras, dtype=np.intp)
+        Es_by_band = _band_major(Eks).astype(np.float64, copy=False)
+        num_bands, num_ks = Es_by_band.shape
+        if pairs is None:
+            pairs = [(n, m) for n in range(num_bands) for m in range(n+1, num_bands)]
+        self.pairs = [(int(n), int(m)) for n, m in pairs]
+        self.E_Fermi = E_Fermi
+        Ms = None
+        if Mks is not None:
+            Ms = _band_major(Mks)
+            if np.iscomplexobj(Ms):
+                raise ValueError("Mks must be real; pass |M_nm(k)|**2.")
+            Ms = Ms.astype(np.float64, copy=False)
+            if Ms.shape != (len(self.pairs), num_ks):
+                raise ValueError("Mks must have one value per pair at each k-point.")
+        num_tetra, num_corners = tetras.shape
+        sweep_block = _sweep_block if num_corners == 4 else _sweep_block_2d
+        V = 1.0 / num_tetra
+        corners, factors, pair_index = [], [], []
+        for p, (n, m) in enumerate(self.pairs):
+            # Band n must be partly occupied and band m partly empty.
+            if not (Es_by_band[n].min() < E_Fermi and Es_by_band[m].max() > E_Fermi):
+                continue
+            for start in range(0, num_tetra, _BLOCK_SIZE):
+                tet_block = tetras[start:start+_BLOCK_SIZE]
+                occupied_n = sweep_block(E_Fermi, Es_by_band[n][tet_block], num_tetra,
+                        False)[0] / V
+                occupied_m = sweep_block(E_Fermi, Es_by_band[m][tet_block], num_tetra,
+                        False)[0] / V
+                occupation = occupied_n * (1.0 - occupied_m)
+                keep = np.nonzero(occupation > 0.0)[0]
+                if len(keep) == 0:
+                    continue
+                tet_block = tet_block[keep]
+                corners.append(np.sort(Es_by_band[m][tet_block] - Es_by_band[n][tet_block],
+                        axis=1))
+                factor = V * occupation[keep]
+                if Ms is not None:
+                    factor *= np.mean(Ms[p][tet_block], axis=1)
+                factors.append(factor)
+                pair_index.append(np.full(len(keep), p, dtype=np.intp))
+        if len(corners) == 0:
+            self.corners = np.zeros((0, num_corners), dtype=np.float64)
+            self.factors = np.zeros(0, dtype=np.float64)
+            self.pair_index = np.zeros(0, dtype=np.intp)
+        else:
+            self.corners = np.concatenate(corners)
+            self.factors = np.concatenate(factors)
+            self.pair_index = np.concatenate(pair_index)
+
+    def Spectrum(self, omegas, per_pair=False):
+        '''Return the spectrum J(omega) = sum_{n,m} J_nm(omega) at each of the
+        frequencies omegas (in ascending order) as a numpy array, or, if
+        per_pair is True, an array with shape (len(pairs), len(omegas))
+        giving each J_nm(omega).
+
+        All frequencies are handled in one pass over the tetrahedra: each
+        contributes only at the frequencies between its smallest and largest
+        corner transition energy, which are found by binary search.
+        '''
+        omegas = np.asarray(omegas, dtype=np.float64)
+        if np.any(np.diff(omegas) < 0.0):
+            raise ValueError("omegas must be in ascending order.")
+        num_omegas = len(omegas)
+        num_bins = num_omegas*len(self.pairs) if per_pair else num_omegas
+        spectrum = np.zeros(num_bins, dtype=np.float64)
+        dos = _tetra_dos if self.corners.shape[1] == 4 else _triangle_dos
+        for start in range(0, len(self.factors), _BLOCK_SIZE):
+            corners = self.corners[start:start+_BLOCK_SIZE]
+            # Frequencies omegas[lo:hi] satisfy E1 < omega <= E4.
+            lo = np.searchsorted(omegas, corners[:, 0], side='right')
+            hi = np.searchsorted(omegas, corners[:, -1], side='right')
+            counts = hi - lo
+            entry = np.repeat(np.arange(len(corners)), counts)
+            first = np.repeat(np.cumsum(counts) - counts, counts)
+            freq = lo[entry] + np.arange(len(entry)) - first
+            Es = [corners[entry, j] for j in range(corners.shape[1])]
+            contrib = dos(omegas[freq], *Es) * self.factors[start:start+_BLOCK_SIZE][entry]
+            if per_pair:
+                freq = self.pair_index[start:start+_BLOCK_SIZE][entry]*num_omegas + freq
+            spectrum += np.bincount(freq, weights=contrib, minlength=num_bins)
+        if per_pair:
+            return spectrum.reshape(len(self.pairs), num_omegas)
+        return spectrum
+
+def JointDosValues(omega_min, omega_max, num_omegas, n, Efn, R, num_electrons, pairs=None,
+        dtype=np.float64):
+    '''Return a numpy array of joint density of states values J(omega), with
+    omega ranging over num_omegas equally spaced values from omega_min to
+    omega_max.
+
+    Also returns the array of frequencies used and the PairSpectra, which
+    gives spectra on other frequency grids (and per band pair) without
+    resampling; its E_Fermi attribute is the Fermi energy found by FindFermi.
+
+    n = Brillouin zone submesh density; either an integer (the total number
+    of k-points sampled is (n+1)**3), a tuple (n1, n2, n3) giving the
+    density along each reciprocal lattice vector, or a tuple (n1, n2) for a
+    two-dimensional submesh.
+
+    Efn = a function E(k) which returns a list of the band energies at the
+    Brillouin zone point k, with the returned list sorted in ascending order;
+    k is expressed in the reciprocal lattice basis.
+
+    R = a numpy matrix with rows given by the reciprocal lattice vectors.
+
+    num_electrons = number of electrons, which determines E_F.
+
+    pairs = band index pairs (n, m) to include (see PairSpectra).
+
+    dtype = storage type of the sampled energies (see bands.BandArray).
+    '''
+    with _refinement_level(n):
+        with _phase("mesh"):
+            plan = GetMeshPlan(n, R)
+        with _phase("sample"):
+            Eks = MakeEks(Efn, plan.submesh, plan.G_order, plan.G_neg, dtype)
+        with _phase("fermi"):
+            E_Fermi = FindFermi(num_electrons, plan.tetras, Eks)
+        with _phase("joint"):
+            spectra = PairSpectra(plan.tetras, Eks, E_Fermi, pairs)
+            omega_vals = np.linspace(omega_min, omega_max, num_omegas)
+            jdos_vals = spectra.Spectrum(omega_vals)
+    return jdos_vals, omega_vals, spectra
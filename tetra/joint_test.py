@@ -0,0 +1,84 @@
+import unittest
+from math import cos, pi
+import numpy as np
+from tetra.joint import PairSpectra, JointDosValues
+from tetra.fused import FusedSweep
+from tetra.bands import BandArray
+from tetra.plan import GetMeshPlan
+from tetra.ksample import MakeEks
+from tetra.fermi import FindFermi
+
+def _insulator_Efn(k):
+    c = cos(2*pi*k[0]) + cos(2*pi*k[1]) + cos(2*pi*k[2])
+    return [-4.0 + 0.5*c, 3.0 - 0.3*c + 0.2*cos(2*pi*(k[0] - k[1]))]
+
+def _metal_Efn(k):
+    c = cos(2*pi*k[0]) + cos(2*pi*k[1]) + cos(2*pi*k[2])
+    return sorted([-c, 1.0 - 0.5*c + 0.3*cos(2*pi*k[2]), 4.0 + 0.2*c])
+
+class TestPairSpectra(unittest.TestCase):
+    def test_insulator_matches_difference_dos(self):
+        plan = GetMeshPlan(6)
+        Eks = MakeEks(_insulator_Efn, plan.submesh)
+        E_Fermi = FindFermi(1.0, plan.tetras, Eks)
+        spectra = PairSpectra(plan.tetras, Eks, E_Fermi)
+        # Every tetrahedron has band 0 filled and band 1 empty, so J(omega)
+        # is the density of states of the band E_1 - E_0.
+        diffs = BandArray.FromKMajor((Eks.data[1] - Eks.data[0])[:, np.newaxis])
+        omegas = np.linspace(4.0, 10.0, 61)
+        expected = [FusedSweep(w, plan.tetras, diffs, weights=False).dos for w in omegas]
+        self.assertTrue(np.allclose(spectra.Spectrum(omegas), expected, rtol=0.0, atol=1e-12))
+        # The spectrum integrates to the number of transitions per k-point.
+        fine = np.linspace(4.0, 10.0, 20001)
+        J = spectra.Spectrum(fine)
+        integral = np.sum((J[1:] + J[:-1])/2*np.diff(fine))
+        self.assertAlmostEqual(integral, 1.0, places=4)
+
+    def test_pairs_and_matrix_elements(self):
+        plan = GetMeshPlan(5)
+        Eks = MakeEks(_metal_Efn, plan.submesh)
+        E_Fermi = FindFermi(1.2, plan.tetras, Eks)
+        pairs = [(0, 1), (0, 2), (1, 2)]
+        spectra = PairSpectra(plan.tetras, Eks, E_Fermi, pairs)
+        omegas = np.linspace(0.0, 8.0, 81)
+        per_pair = spectra.Spectrum(omegas, per_pair=True)
+        self.assertEqual(per_pair.shape, (3, 81))
+        self.assertTrue(np.allclose(per_pair.sum(axis=0), spectra.Spectrum(omegas),
+                rtol=0.0, atol=1e-12))
+        self.assertTrue(np.all(per_pair >= 0.0))
+        # A partially occupied band contributes both as n and as m.
+        self.assertTrue(np.all(per_pair.max(axis=1) > 0.0))
+
+        Mks = np.outer(np.ones(len(plan.submesh)), [2.0, 0.0, 1.0])
+        weighted = PairSpectra(plan.tetras, Eks, E_Fermi, pairs, Mks).Spectrum(omegas, True)
+        self.assertTrue(np.allclose(weighted, per_pair*np.array([[2.0], [0.0], [1.0]]),
+                rtol=0.0, atol=1e-12))
+
+        # Band 2 is empty, so the occupation factors of (0, 2) sum to the
+        # number of states of band 0 at E_F.
+        band_0 = BandArray.FromKMajor(Eks.data[0][:, np.newaxis])
+        self.assertAlmostEqual(float(np.sum(spectra.factors[spectra.pair_index == 1])),
+                FusedSweep(E_Fermi, plan.tetras, band_0, weights=False).num_states, places=12)
+
+        with self.assertRaises(ValueError):
+            spectra.Spectrum(omegas[::-1])
+        with self.assertRaises(ValueError):
+            PairSpectra(plan.tetras, Eks, E_Fermi, pairs, Mks[:, :2])
+        with self.assertRaises(ValueError):
+            PairSpectra(plan.tetras, Eks, E_Fermi, pairs, Mks*1j)
+
+    def test_two_dimensional(self):
+        def Efn(k):
+            E = -2.0*(cos(2*pi*k[0]) + cos(2*pi*k[1]))
+            return [E, 10.0 - E]
+        J, omegas, spectra = JointDosValues(2.0, 18.0, 33, (8, 8), Efn, None, 1.0)
+        self.assertTrue(spectra.E_Fermi > 4.0 and spectra.E_Fermi < 6.0)
+        # E_1 - E_0 = 10 - 2 E_0, so J(omega) = D_0((10 - omega)/2)/2.
+        plan = GetMeshPlan((8, 8))
+        Eks = MakeEks(lambda k: [Efn(k)[0]], plan.submesh)
+        for w, J_w in zip(omegas, J):
+            D = FusedSweep((10.0 - w)/2, plan.tetras, Eks, weights=False).dos
+            self.assertAlmostEqual(J_w, D/2, places=10)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,9 @@
+import asyncio
 import numpy as np
+from tetra.submesh import _mesh_dims
+from tetra.bands import BandArray, _storage_dtype
 
-def OptimizeGs(R):
+def OptimizeGs(R, n=None):
     '''Rearrange the reciprocal lattice vectors such that the Cartesian
     distance from submesh cell point 3 to point 6 (as depicted in BJA94
     Fig. 5) is minimized, in order to minimize interpolation error.
@@ -8,6 +11,12 @@ def OptimizeGs(R):
 
     R = a numpy matrix with rows given by the reciprocal lattice vectors.
 
+    n = if given, the submesh density (n1, n2, n3) along the original
+    reciprocal lattice vectors. The submesh cell edges are then G_i/ni
+    instead of G_i, and the 3-6 diagonal is minimized for the submesh cell
+    rather than for the reciprocal lattice cell. An integer n has no effect
+    on the result.
+
     Returns two vectors G_order = (o0, o1, o2) and G_neg = (n0, n1, n2).
     The value of G_order is drawn from the permutations of (0, 1, 2) and
     indicates the optimal permutation of the reciprocal lattice vectors,
@@ -19,14 +28,19 @@ def OptimizeGs(R):
     permutations = ((0, 1, 2), (0, 2, 1), (1, 0, 2), (1, 2, 0), (2, 0, 1), (2, 1, 0))
     signs = ((1, 1, 1), (1, 1, -1), (1, -1, 1), (1, -1, -1),
              (-1, 1, 1), (-1, 1, -1), (-1, -1, 1), (-1, -1, -1))
+    if n is None:
+        dims = (1, 1, 1)
+    else:
+        dims = _mesh_dims(n, "OptimizeGs")
     G_order = None
     G_neg = None
     opt_36 = None
     for perm in permutations:
         for sign in signs:
+            # Rows of this_R are the submesh cell edges in the permuted basis.
             this_R = np.zeros((3, 3), dtype=np.float64)
             for i in range(3):
-                this_R[perm[i], :] = sign[i] * R[i, :]
+                this_R[perm[i], :] = sign[i] * R[i, :] / dims[i]
             k3_to_k6 = np.linalg.norm(-this_R[0, :] + this_R[1, :] - this_R[2, :])
             if opt_36 == None or k3_to_k6 < opt_36:
                 opt_36 = k3_to_k6
@@ -34,6 +48,28 @@ def OptimizeGs(R):
                 G_neg = sign
     return G_order, G_neg
 
+def OptimizeGs2D(R, n=None):
+    '''The two-dimensional counterpart of OptimizeGs: choose the sign of the
+    second reciprocal lattice vector such that the Cartesian distance from
+    submesh cell point 2 to point 3 (see submesh.MakeTriangles) is
+    minimized. Only the first two rows of R are used.
+
+    n = if given, the submesh density (n1, n2) along the first two
+    reciprocal lattice vectors.
+
+    Returns G_order = (0, 1, 2) and G_neg = (1, +/-1, 1), with the same
+    meaning as for OptimizeGs.
+    '''
+    if n is None:
+        dims = (1, 1)
+    else:
+        dims = _mesh_dims(n, "OptimizeGs2D", allow_2d=True)[:2]
+    G0 = R[0, :] / dims[0]
+    G1 = R[1, :] / dims[1]
+    if np.linalg.norm(-G0 + G1) <= np.linalg.norm(-G0 - G1):
+        return (0, 1, 2), (1, 1, 1)
+    return (0, 1, 2), (1, -1, 1)
+
 def Get_k_Orig(k_opt, G_order, G_neg):
     '''Convert k_opt (a k-point in the represented in the optimal permutation
     of the reciprocal lattice as determined by OptimizeGs) into the
@@ -66,10 +102,28 @@ def GetRopt(R, G_order, G_neg):
         R_opt[G_order[i], :] = G_neg[i]*R[i, :]
     return R_opt
 
-def MakeEks(Efn, submesh, G_order=None, G_neg=None):
-    '''Generate Eks, a list in which each element is a sorted list of
-    eigenstate energies E_n(k), with k being the k-point at the corresponding
-    element of submesh (i.e. Eks[kN][band_index] = E_n(k)).
+def GetNopt(n, G_order):
+    '''Return the submesh density in the optimal permutation of the
+    reciprocal lattice vectors, given the submesh density n = (n1, n2, n3)
+    along the original reciprocal lattice vectors; i.e. the returned value
+    n_opt satisfies n_opt[o0] = n[0] and similarly for n[1] and n[2].
+    If n is an integer, it is returned unchanged.
+
+    The value of G_order is drawn from the permutations of (0, 1, 2) and
+    indicates the optimal permutation of the reciprocal lattice vectors.
+    '''
+    if isinstance(n, (int, np.integer)) or G_order is None:
+        return n
+    dims = _mesh_dims(n, "GetNopt")
+    n_opt = [0]*3
+    for i in range(3):
+        n_opt[G_order[i]] = dims[i]
+    return tuple(n_opt)
+
+def MakeEks(Efn, submesh, G_order=None, G_neg=None, dtype=np.float64):
+    '''Generate Eks, a BandArray holding the sorted eigenstate energies
+    E_n(k), with k being the k-point at the corresponding element of submesh
+    (i.e. Eks[kN][band_index] = Eks.data[band_index, kN] = E_n(k)).
 
     Efn = a function E(k) which returns a list of the band energies at the
     Brillouin zone point k, with the returned list sorted in ascending order;
@@ -84,26 +138,43 @@ def MakeEks(Efn, submesh, G_order=None, G_neg=None):
     reciprocal lattice vector is negated.
     Concretely, R_opt[o0, :] = G_neg[0]*R[0, :] and similarly for R[1, :]
     and R[2, :].
+
+    dtype = storage type of the energies; numpy.float32 halves the memory
+    use (see BandArray).
+
+    If Efn has an EvaluateMany method (e.g. an interp.StarInterpolant), all
+    k-points are evaluated in one call to Efn.EvaluateMany(ks), which must
+    return an array with shape (num_ks, num_bands).
     '''
-    Eks = []
-    for k in submesh:
+    if hasattr(Efn, "EvaluateMany"):
+        ks_orig = np.asarray(submesh, dtype=np.float64)
+        if G_order is not None and G_neg is not None:
+            ks_orig = ks_orig[:, list(G_order)] * np.asarray(G_neg)
+        Es = np.asarray(Efn.EvaluateMany(ks_orig))
+        if np.any(np.diff(Es, axis=1) < 0.0):
+            raise ValueError("Energies returned by Efn not sorted.")
+        return BandArray.FromKMajor(Es, dtype)
+    Eks = None
+    for kN, k in enumerate(submesh):
         k_orig = k
-        if G_order != None and G_neg != None:
+        if G_order is not None and G_neg is not None:
             k_orig = Get_k_Orig(k, G_order, G_neg)
         Es = Efn(k_orig)
         _check_sort(Es)
-        Eks.append(Es)
-    return Eks
+        if Eks is None:
+            Eks = np.empty((len(Es), len(submesh)), dtype=dtype)
+        Eks[:, kN] = Es
+    return BandArray(Eks, dtype)
 
 def _check_sort(Es):
     for i, E in enumerate(Es):
         if i > 0 and Es[i] < Es[i-1]:
             raise ValueError("Energies returned by Efn not sorted.")
 
-def MakeXks(Xfn, submesh, G_order=None, G_neg=None):
-    '''Generate Xks, a list in which each element is a list of matrix elements
-    X_n(k), with k being the k-point at the corresponding element of submesh
-    (i.e. Eks[kN][band_index] = E_n(k)).
+def MakeXks(Xfn, submesh, G_order=None, G_neg=None, dtype=np.float64):
+    '''Generate Xks, a BandArray holding the matrix elements X_n(k), with k
+    being the k-point at the corresponding element of submesh
+    (i.e. Xks[kN][band_index] = Xks.data[band_index, kN] = X_n(k)).
 
     Xfn = a function X(k) which returns a list of the values of the matrix
     elements of the operator X at k; the returned values are ordered in the
@@ -119,12 +190,89 @@ def MakeXks(Xfn, submesh, G_order=None, G_neg=None):
     reciprocal lattice vector is negated.
     Concretely, R_opt[o0, :] = G_neg[0]*R[0, :] and similarly for R[1, :]
     and R[2, :].
+
+    dtype = storage type of the matrix elements (see BandArray). If Xfn
+    returns complex values, the complex type of the same precision is used.
     '''
-    Xks = []
-    for k in submesh:
+    Xks = None
+    for kN, k in enumerate(submesh):
         k_orig = k
-        if G_order != None and G_neg != None:
-            k_orig = Get_k_orig(k, G_order, G_neg)
-        Xs = Xfn(k_orig)
-        Xks.append(Xs)
-    return Xks
+        if G_order is not None and G_neg is not None:
+            k_orig = Get_k_Orig(k, G_order, G_neg)
+        Xs = np.asarray(Xfn(k_orig))
+        if Xks is None:
+            Xks = np.empty((len(Xs), len(submesh)), dtype=_storage_dtype(dtype, Xs))
+        elif np.iscomplexobj(Xs) and not np.iscomplexobj(Xks):
+            Xks = Xks.astype(_storage_dtype(dtype, Xs))
+        Xks[:, kN] = Xs
+    return BandArray(Xks, dtype)
+
+async def MakeEksAsync(Efn, submesh, G_order=None, G_neg=None, dtype=np.float64,
+        max_in_flight=8, retries=2, retry_delay=0.1):
+    '''As MakeEks, but for a coroutine function Efn (e.g. one waiting on an
+    out-of-process band solver). Up to max_in_flight k-points are evaluated
+    concurrently; the results are placed in submesh order regardless of the
+    order in which they complete.
+
+    max_in_flight = maximum number of calls to Efn awaited at once.
+
+    retries = number of times a failed call to Efn is repeated before its
+    exception is raised; the remaining calls are then cancelled.
+
+    retry_delay = time in seconds to wait before the first repeat of a
+    failed call; the wait doubles before each further repeat, so that a
+    failing solver is not called again at once.
+    '''
+    Eks_list = await _sample_async(Efn, submesh, G_order, G_neg, max_in_flight, retries,
+            retry_delay)
+    Eks = np.empty((len(Eks_list[0]), len(submesh)), dtype=dtype)
+    for kN, Es in enumerate(Eks_list):
+        _check_sort(Es)
+        Eks[:, kN] = Es
+    return BandArray(Eks, dtype)
+
+async def MakeXksAsync(Xfn, submesh, G_order=None, G_neg=None, dtype=np.float64,
+        max_in_flight=8, retries=2, retry_delay=0.1):
+    '''As MakeXks, but for a coroutine function Xfn; max_in_flight, retries
+    and retry_delay are as for MakeEksAsync.
+    '''
+    Xks_list = await _sample_async(Xfn, submesh, G_order, G_neg, max_in_flight, retries,
+            retry_delay)
+    return BandArray.FromKMajor(Xks_list, dtype)
+
+async def _sample_async(fn, submesh, G_order, G_neg, max_in_flight, retries, retry_delay):
+    '''Return the list [fn(k_orig) for k in submesh], evaluated by
+    max_in_flight workers which share one iterator over the k-point indices.
+    '''
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1.")
+    if len(submesh) == 0:
+        raise ValueError("submesh must contain at least one k-point.")
+    results = [None]*len(submesh)
+    indices = iter(range(len(submesh)))
+
+    async def worker():
+        for kN in indices:
+            k_orig = submesh[kN]
+            if G_order is not None and G_neg is not None:
+                k_orig = Get_k_Orig(k_orig, G_order, G_neg)
+            results[kN] = await _call_with_retries(fn, k_orig, retries, retry_delay)
+
+    workers = [asyncio.ensure_future(worker()) for i in range(min(max_in_flight, len(submesh)))]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for w in workers:
+            w.cancel()
+        raise
+    return results
+
+async def _call_with_retries(fn, k, retries, retry_delay):
+    for attempt in range(retries + 1):
+        try:
+            return await fn(k)
+        except Exception:
+            if attempt == retries:
+                raise
+        # Exponential backoff; other workers continue meanwhile.
+        await asyncio.sleep(retry_delay * 2**attempt)
@@ -1,6 +1,12 @@
+import asyncio
 import unittest
 import numpy as np
-from tetra.ksample import OptimizeGs, Get_k_Orig, GetRopt
+from tetra.ksample import OptimizeGs, Get_k_Orig, GetRopt, MakeEks, MakeEksAsync
+from tetra.plan import GetMeshPlan
+from tetra.sum import SumEnergy, SumEnergyAsync
+from tetra.fermi import FindFermiToTolAsync
+from tetra.dos import DosValuesAsync
+from tetra.benchmark import HexagonalMultiBand
 
 class TestOptimizeGs(unittest.TestCase):
     def test_cubic(self):
@@ -42,6 +48,81 @@ class TestGet_k_Orig(unittest.TestCase):
         k_orig_expect = (2.0, -1.0, -3.0)
         _vec_equal(self, k_orig_expect, k_orig)
 
+class TestMakeEksAsync(unittest.TestCase):
+    def test_order_and_concurrency(self):
+        model = HexagonalMultiBand()
+        plan = GetMeshPlan(3, model.R)
+        state = {"in_flight": 0, "max_in_flight": 0}
+        attempts = {}
+        async def Efn(k):
+            key = tuple(k)
+            attempts[key] = attempts.get(key, 0) + 1
+            state["in_flight"] += 1
+            state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+            # Complete out of order; the first call at every third k-point
+            # fails.
+            await asyncio.sleep(0.001*(len(attempts) % 3))
+            state["in_flight"] -= 1
+            if len(attempts) % 3 == 0 and attempts[key] == 1:
+                raise IOError("solver unavailable")
+            return model.Efn(k)
+        Eks = asyncio.run(MakeEksAsync(Efn, plan.submesh, plan.G_order, plan.G_neg,
+                max_in_flight=4, retries=1, retry_delay=0.0))
+        expected = MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg)
+        self.assertTrue((Eks.data == expected.data).all())
+        self.assertEqual(state["max_in_flight"], 4)
+
+    def test_failure_raised(self):
+        async def Efn(k):
+            raise IOError("solver unavailable")
+        with self.assertRaises(IOError):
+            asyncio.run(MakeEksAsync(Efn, GetMeshPlan(1).submesh, retries=2, retry_delay=0.0))
+
+    def test_retry_backoff(self):
+        times = []
+        async def Efn(k):
+            times.append(asyncio.get_running_loop().time())
+            raise IOError("solver unavailable")
+        with self.assertRaises(IOError):
+            asyncio.run(MakeEksAsync(Efn, [(0.0, 0.0, 0.0)], retries=2, retry_delay=0.02))
+        self.assertEqual(len(times), 3)
+        self.assertGreaterEqual(times[1] - times[0], 0.02)
+        self.assertGreaterEqual(times[2] - times[1], 0.04)
+
+    def test_empty_submesh(self):
+        async def Efn(k):
+            return [0.0]
+        with self.assertRaises(ValueError):
+            asyncio.run(MakeEksAsync(Efn, []))
+
+    def test_drivers_retry_delay(self):
+        model = HexagonalMultiBand()
+        drivers = [
+            lambda Efn: FindFermiToTolAsync(1, Efn, model.R, model.num_electrons,
+                    retries=1, retry_delay=0.25),
+            lambda Efn: DosValuesAsync(-1.0, 1.0, 3, 1, Efn, model.R,
+                    retries=1, retry_delay=0.25),
+            lambda Efn: SumEnergyAsync(1, Efn, model.R, model.num_electrons,
+                    retries=1, retry_delay=0.25)]
+        for driver in drivers:
+            times = []
+            async def Efn(k):
+                times.append(asyncio.get_running_loop().time())
+                raise IOError("solver unavailable")
+            with self.assertRaises(IOError):
+                asyncio.run(driver(Efn))
+            # The first call fails and is repeated after retry_delay.
+            self.assertGreaterEqual(max(times) - min(times), 0.25)
+
+    def test_sum_energy(self):
+        model = HexagonalMultiBand()
+        async def Efn(k):
+            return model.Efn(k)
+        energy, n, ws = SumEnergy(3, model.Efn, model.R, model.num_electrons)
+        energy_a, n_a, ws_a = asyncio.run(SumEnergyAsync(3, Efn, model.R, model.num_electrons))
+        self.assertEqual((energy, n), (energy_a, n_a))
+        self.assertTrue((ws == ws_a).all())
+
 def _vec_equal(testcase, v, u):
     testcase.assertEqual(len(v), len(u))
     for i in range(len(v)):
@@ -1,3 +1,6 @@
+from tetra.fused import FusedSweep
+from tetra.triangle import NumStatesContrib2D
+
 def NumStates(E, tetras, Eks):
     '''Return n(E), the total number of states with energy <= E summed over
     all tetrahedra and band indices.
@@ -8,22 +11,16 @@ def NumStates(E, tetras, Eks):
     indices of submesh (i.e. submesh[kN1] = k1, etc.). The tetrahedra must be
     constructed as described in BJA94 Section III.
 
-    Eks = a list in which each element is a sorted list of eigenstate energies
+    Eks = the eigenstate energies E_n(k) as a BandArray (see ksample.MakeEks),
+    or a list in which each element is a sorted list of eigenstate energies
     E_n(k), with k being the k-point at the corresponding element of submesh
     (i.e. Eks[kN][band_index] = E_n(k)).
+
+    The contributions of the tetrahedra are evaluated band by band over
+    contiguous rows of Eks and summed with compensated (math.fsum) summation
+    of per-block partial sums; see fused.FusedSweep.
     '''
-    num_bands = len(Eks[0])
-    num_tetra = len(tetras)
-    n = 0.0
-    c = 0.0
-    for tet in tetras:
-        for band_index in range(num_bands):
-            contrib = NumStatesContrib(E, tet, num_tetra, Eks, band_index)
-            y = contrib - c
-            t = n + y
-            c = (t - n) - y
-            n = t
-    return n
+    return FusedSweep(E, tetras, Eks, weights=False).num_states
 
 def NumStatesContrib(E, tetra, num_tetra, Eks, band_index):
     '''Return the contribution to the number of states with energy less than
@@ -44,7 +41,12 @@ def NumStatesContrib(E, tetra, num_tetra, Eks, band_index):
     (i.e. Eks[kN][band_index] = E_n(k)).
 
     band_index = the band index n to consider, corresponding to n in E_n(k).
+
+    If tetra has three vertices, it is taken to be a triangle of a
+    two-dimensional submesh (see triangle.NumStatesContrib2D).
     '''
+    if len(tetra) == 3:
+        return NumStatesContrib2D(E, tetra, num_tetra, Eks, band_index)
     E1, E2, E3, E4 = _tetra_Es(tetra, band_index, Eks)
     if E <= E1:
         return 0.0
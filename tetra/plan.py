@@ -0,0 +1,268 @@
+from collections import OrderedDict, namedtuple
+import threading
+import numpy as np
+from tetra.ksample import OptimizeGs, OptimizeGs2D, GetNopt
+from tetra.submesh import (MortonKOrder, MortonCellOrder, _mesh_dims, _submesh_array,
+        _tetra_array, _triangle_array)
+
+MeshPlan = namedtuple("MeshPlan", ["n", "n_opt", "G_order", "G_neg", "submesh", "tetras",
+        "order", "k_order"])
+MeshPlan.__doc__ = '''The submesh, tetrahedra, and reciprocal lattice orientation used for
+Brillouin zone summation at a particular submesh density.
+
+n = submesh density along the original reciprocal lattice vectors.
+
+n_opt = submesh density along the optimally permuted reciprocal lattice
+vectors (see ksample.GetNopt); submesh and tetras are constructed at n_opt.
+
+G_order, G_neg = optimal reciprocal lattice orientation as returned by
+ksample.OptimizeGs, or None if no reciprocal lattice was given.
+
+submesh = read-only numpy array with shape (num_ks, 3); row kN is the
+k-point MakeSubmesh(n_opt)[kN] for the canonical layout, and
+MakeSubmesh(n_opt)[k_order[kN]] otherwise.
+
+tetras = read-only integer numpy array with shape (num_tetra, 4) giving the
+tetrahedra MakeTetra(n_opt), with vertices indexing into submesh. For the
+canonical layout, row i is MakeTetra(n_opt)[i]; otherwise the tetrahedra
+are reordered along with the submesh. For a two-dimensional plan, the
+shape is (num_triangles, 3), giving the triangles MakeTriangles(n_opt).
+
+order = layout of the submesh and tetrahedra; "canonical" or "morton".
+
+k_order = for non-canonical layouts, read-only integer numpy array giving
+the permutation from the canonical submesh order to the plan's submesh
+order (see submesh.MortonKOrder); None for the canonical layout. Use
+ToCanonicalOrder to convert per-k results to the canonical order.
+'''
+
+_ORDERS = ("canonical", "morton")
+
+_CacheInfo = namedtuple("MeshPlanCacheInfo", ["hits", "misses", "evictions",
+        "entries", "nbytes", "max_entries", "max_bytes"])
+
+_DEFAULT_MAX_ENTRIES = 16
+_DEFAULT_MAX_BYTES = 512 * 2**20
+
+_lock = threading.Lock()
+# Submesh, tetrahedra, and k-point permutation, keyed by the submesh
+# dimensions (n1, n2, n3) and layout.
+# Ordered from least to most recently used.
+_meshes = OrderedDict()
+# Optimal (G_order, G_neg), keyed by (dims, R). These are tiny, so only the
+# number of entries is bounded.
+_orders = OrderedDict()
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "nbytes": 0}
+_limits = {"max_entries": _DEFAULT_MAX_ENTRIES, "max_bytes": _DEFAULT_MAX_BYTES}
+_default_order = {"order": "canonical"}
+
+def GetMeshPlan(n, R=None, order=None):
+    '''Return a MeshPlan for submesh density n, reusing the submesh and
+    tetrahedra from earlier calls where possible. The arrays in the returned
+    plan are shared between callers and must not be modified.
+
+    n = Brillouin zone submesh density; either an integer or a tuple
+    (n1, n2, n3) giving the density along each reciprocal lattice vector.
+    A tuple (n1, n2) gives a two-dimensional plan, with the submesh
+    MakeSubmesh2D(n) and the triangles MakeTriangles(n) in place of the
+    tetrahedra (see triangle.py); two-dimensional plans always use the
+    canonical layout.
+
+    R = a numpy matrix with rows given by the reciprocal lattice vectors.
+    If given, the submesh is constructed in the optimal orientation of the
+    reciprocal lattice as determined by OptimizeGs(R, n) (OptimizeGs2D for
+    a two-dimensional plan); otherwise the reciprocal lattice vectors are
+    used as-is.
+
+    order = memory layout of the submesh and tetrahedra: "canonical" (the
+    order of MakeSubmesh and MakeTetra) or "morton" (k-points and submesh
+    cells in Morton order, which keeps the corner gathers and weight
+    scatters of nearby tetrahedra within a small range of k-point indices).
+    If None, the layout set by SetDefaultMeshOrder is used.
+    '''
+    if order is None:
+        order = _default_order["order"]
+    if order not in _ORDERS:
+        raise ValueError("Unknown mesh order {} in GetMeshPlan.".format(order))
+    dims = _mesh_dims(n, "GetMeshPlan", allow_2d=True)
+    if R is None:
+        G_order, G_neg = None, None
+    else:
+        G_order, G_neg = _get_order(dims, n, R)
+    if len(dims) == 2:
+        # Morton order gains little for the small two-dimensional meshes.
+        submesh, tetras, k_order = _get_mesh(dims, "canonical")
+        return MeshPlan(n, dims, G_order, G_neg, submesh, tetras, "canonical", k_order)
+    n_opt = GetNopt(n, G_order)
+    submesh, tetras, k_order = _get_mesh(_mesh_dims(n_opt), order)
+    return MeshPlan(n, n_opt, G_order, G_neg, submesh, tetras, order, k_order)
+
+def SetDefaultMeshOrder(order):
+    '''Set the memory layout ("canonical" or "morton") used by GetMeshPlan
+    when no order is given. This affects the top-level functions (SumFn,
+    SumEnergy, DosValues, etc.) only in speed: per-k results, tetrahedra
+    and band energies which they return are converted back to the
+    canonical order.
+    '''
+    if order not in _ORDERS:
+        raise ValueError("Unknown mesh order {} in SetDefaultMeshOrder.".format(order))
+    _default_order["order"] = order
+
+def GetDefaultMeshOrder():
+    '''Return the memory layout used by GetMeshPlan when no order is given.
+    '''
+    return _default_order["order"]
+
+def ToCanonicalOrder(values, plan, axis=-1):
+    '''Return a copy of values, an array with a k-point axis (given by axis)
+    in the submesh order of plan, with that axis in the canonical order of
+    MakeSubmesh(plan.n_opt). For example, weights w[n][j] computed on
+    plan.tetras are converted by ToCanonicalOrder(w, plan).
+    '''
+    values = np.asarray(values)
+    if plan.k_order is None:
+        return values.copy()
+    values = np.moveaxis(values, axis, -1)
+    canonical = np.empty_like(values)
+    canonical[..., plan.k_order] = values
+    return np.moveaxis(canonical, -1, axis)
+
+def FromCanonicalOrder(values, plan, axis=-1):
+    '''Inverse of ToCanonicalOrder: return a copy of values with the k-point
+    axis (given by axis) converted from the canonical order to the submesh
+    order of plan.
+    '''
+    values = np.asarray(values)
+    if plan.k_order is None:
+        return values.copy()
+    return np.take(values, plan.k_order, axis=axis)
+
+def CanonicalTetras(plan):
+    '''Return the tetrahedra of plan as they would be in the canonical
+    layout: row i is MakeTetra(plan.n_opt)[i], with vertices indexing into
+    MakeSubmesh(plan.n_opt). For the canonical layout, plan.tetras is
+    returned.
+    '''
+    if plan.k_order is None:
+        return plan.tetras
+    # Undo the Morton ordering of the cells (see _build_mesh), keeping the
+    # 6 tetrahedra of each cell together, then map vertices to canonical
+    # k-point indices.
+    cell_order = MortonCellOrder(plan.n_opt)
+    cells = plan.tetras.reshape(-1, 6, 4)
+    canonical = np.empty_like(cells)
+    canonical[cell_order] = cells
+    return plan.k_order[canonical.reshape(-1, 4)]
+
+def MeshPlanCacheInfo():
+    '''Return a named tuple (hits, misses, evictions, entries, nbytes,
+    max_entries, max_bytes) describing the state of the mesh plan cache.
+    Hits and misses count lookups of the submesh and tetrahedra; nbytes is
+    the total size of the cached arrays.
+    '''
+    with _lock:
+        return _CacheInfo(_stats["hits"], _stats["misses"], _stats["evictions"],
+                len(_meshes), _stats["nbytes"], _limits["max_entries"],
+                _limits["max_bytes"])
+
+def SetMeshPlanCacheLimits(max_entries=None, max_bytes=None):
+    '''Set the maximum number of cached meshes and the maximum total size
+    in bytes of the cached arrays; arguments which are None are left
+    unchanged. Least recently used meshes are evicted until the cache
+    satisfies the new limits. A mesh which is larger than max_bytes on its
+    own is never cached.
+    '''
+    if max_entries is not None and max_entries < 0:
+        raise ValueError("Must have max_entries >= 0 in SetMeshPlanCacheLimits.")
+    if max_bytes is not None and max_bytes < 0:
+        raise ValueError("Must have max_bytes >= 0 in SetMeshPlanCacheLimits.")
+    with _lock:
+        if max_entries is not None:
+            _limits["max_entries"] = max_entries
+        if max_bytes is not None:
+            _limits["max_bytes"] = max_bytes
+        _evict(0)
+
+def ClearMeshPlanCache():
+    '''Remove all cached meshes and orientations and reset the cache
+    statistics.
+    '''
+    with _lock:
+        _meshes.clear()
+        _orders.clear()
+        for key in _stats:
+            _stats[key] = 0
+
+def _get_order(dims, n, R):
+    R = np.asarray(R, dtype=np.float64)
+    key = (dims, R.tobytes())
+    with _lock:
+        if key in _orders:
+            _orders.move_to_end(key)
+            return _orders[key]
+    if len(dims) == 2:
+        order = OptimizeGs2D(R, dims)
+    else:
+        order = OptimizeGs(R, n)
+    with _lock:
+        _orders[key] = order
+        while len(_orders) > 4*_limits["max_entries"]:
+            _orders.popitem(last=False)
+    return order
+
+def _get_mesh(dims, order):
+    key = (dims, order)
+    with _lock:
+        if key in _meshes:
+            _stats["hits"] += 1
+            _meshes.move_to_end(key)
+            return _meshes[key]
+        _stats["misses"] += 1
+    # Build outside the lock: other threads may use the cache meanwhile.
+    # If two threads build the same mesh, the second result replaces the
+    # first; both are equal.
+    mesh = _build_mesh(dims, order)
+    for arr in mesh:
+        if arr is not None:
+            arr.flags.writeable = False
+    size = _mesh_nbytes(mesh)
+    with _lock:
+        if size <= _limits["max_bytes"] and _limits["max_entries"] > 0:
+            if key in _meshes:
+                _stats["nbytes"] -= _mesh_nbytes(_meshes.pop(key))
+            _evict(size)
+            _meshes[key] = mesh
+            _stats["nbytes"] += size
+    return mesh
+
+def _build_mesh(dims, order):
+    submesh = _submesh_array(dims)
+    if len(dims) == 2:
+        return submesh, _triangle_array(dims), None
+    tetras = _tetra_array(dims)
+    if order == "canonical":
+        return submesh, tetras, None
+    k_order = MortonKOrder(dims)
+    cell_order = MortonCellOrder(dims)
+    # Position of each canonical k-point in the reordered submesh.
+    k_position = np.empty_like(k_order)
+    k_position[k_order] = np.arange(len(k_order), dtype=k_order.dtype)
+    # Keep the 6 tetrahedra of each cell together.
+    tetras = tetras.reshape(-1, 6, 4)[cell_order].reshape(-1, 4)
+    return submesh[k_order], k_position[tetras], k_order
+
+def _mesh_nbytes(mesh):
+    return sum(arr.nbytes for arr in mesh if arr is not None)
+
+def _evict(incoming):
+    '''Evict least recently used meshes until there is room for one more
+    mesh of size incoming (or, if incoming == 0, until the limits are met).
+    Must be called with _lock held.
+    '''
+    max_entries = _limits["max_entries"]
+    if incoming > 0:
+        max_entries -= 1
+    while _meshes and (len(_meshes) > max_entries
+            or _stats["nbytes"] + incoming > _limits["max_bytes"]):
+        _stats["nbytes"] -= _mesh_nbytes(_meshes.popitem(last=False)[1])
+        _stats["evictions"] += 1
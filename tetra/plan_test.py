@@ -0,0 +1,110 @@
+import unittest
+import numpy as np
+from tetra.plan import GetMeshPlan, MeshPlanCacheInfo, SetMeshPlanCacheLimits, ClearMeshPlanCache
+from tetra.plan import ToCanonicalOrder, FromCanonicalOrder, SetDefaultMeshOrder
+from tetra.plan import _DEFAULT_MAX_ENTRIES, _DEFAULT_MAX_BYTES
+from tetra.submesh import MakeSubmesh, MakeTetra
+from tetra.ksample import OptimizeGs, GetNopt, MakeEks
+from tetra.fused import FusedSweep
+from tetra.sum import SumEnergy
+from tetra.dos import DosValues
+from tetra.benchmark import HexagonalMultiBand
+
+class TestMeshPlan(unittest.TestCase):
+    def setUp(self):
+        ClearMeshPlanCache()
+        SetMeshPlanCacheLimits(_DEFAULT_MAX_ENTRIES, _DEFAULT_MAX_BYTES)
+
+    def tearDown(self):
+        ClearMeshPlanCache()
+        SetMeshPlanCacheLimits(_DEFAULT_MAX_ENTRIES, _DEFAULT_MAX_BYTES)
+
+    def test_matches_uncached(self):
+        Rhex = np.array([[1.0, 0.0, 0.0], [-0.5, np.sqrt(3)/2.0, 0.0], [0.0, 0.0, 0.5]])
+        n = (4, 4, 2)
+        plan = GetMeshPlan(n, Rhex)
+        G_order, G_neg = OptimizeGs(Rhex, n)
+        self.assertEqual((plan.G_order, plan.G_neg), (G_order, G_neg))
+        n_opt = GetNopt(n, G_order)
+        self.assertEqual(plan.n_opt, n_opt)
+        self.assertTrue((plan.submesh == np.array(MakeSubmesh(n_opt))).all())
+        self.assertTrue((plan.tetras == np.array(MakeTetra(n_opt))).all())
+
+    def test_shared_readonly(self):
+        plan = GetMeshPlan(3)
+        again = GetMeshPlan(3)
+        self.assertTrue(plan.tetras is again.tetras)
+        with self.assertRaises(ValueError):
+            plan.tetras[0, 0] = 1
+        info = MeshPlanCacheInfo()
+        self.assertEqual((info.hits, info.misses, info.entries), (1, 1, 1))
+        self.assertEqual(info.nbytes, plan.submesh.nbytes + plan.tetras.nbytes)
+
+    def test_evict_bytes(self):
+        small = GetMeshPlan(2)
+        small_bytes = small.submesh.nbytes + small.tetras.nbytes
+        SetMeshPlanCacheLimits(max_bytes=small_bytes)
+        GetMeshPlan(1)
+        info = MeshPlanCacheInfo()
+        self.assertEqual(info.entries, 1)
+        self.assertEqual(info.evictions, 1)
+        self.assertTrue(info.nbytes <= small_bytes)
+        # Too large to cache at all.
+        GetMeshPlan(4)
+        self.assertEqual(MeshPlanCacheInfo().entries, 1)
+
+    def test_evict_entries(self):
+        SetMeshPlanCacheLimits(max_entries=2)
+        for n in (1, 2, 3):
+            GetMeshPlan(n)
+        GetMeshPlan(1)
+        info = MeshPlanCacheInfo()
+        self.assertEqual(info.entries, 2)
+        self.assertEqual(info.misses, 4)
+
+class TestMortonOrder(unittest.TestCase):
+    def tearDown(self):
+        SetDefaultMeshOrder("canonical")
+
+    def test_same_tetrahedra(self):
+        n = (4, 3, 5)
+        canonical = GetMeshPlan(n, order="canonical")
+        morton = GetMeshPlan(n, order="morton")
+        self.assertTrue((morton.submesh == canonical.submesh[morton.k_order]).all())
+        tetras_back = set(tuple(morton.k_order[tet]) for tet in morton.tetras)
+        self.assertEqual(tetras_back, set(tuple(tet) for tet in canonical.tetras))
+        Xs = np.arange(2*len(canonical.submesh)).reshape(2, -1)
+        self.assertTrue((ToCanonicalOrder(FromCanonicalOrder(Xs, morton), morton) == Xs).all())
+
+    def test_same_results(self):
+        model = HexagonalMultiBand()
+        results = []
+        for order in ("canonical", "morton"):
+            plan = GetMeshPlan(4, model.R, order)
+            Eks = MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg)
+            sweep = FusedSweep(0.3, plan.tetras, Eks)
+            results.append((sweep.num_states, ToCanonicalOrder(sweep.weights, plan)))
+        self.assertAlmostEqual(results[0][0], results[1][0], places=12)
+        self.assertTrue(np.allclose(results[0][1], results[1][1], rtol=0.0, atol=1e-15))
+
+    def test_driver_weights_canonical(self):
+        model = HexagonalMultiBand()
+        energy, n, ws = SumEnergy(4, model.Efn, model.R, model.num_electrons)
+        SetDefaultMeshOrder("morton")
+        energy_m, n_m, ws_m = SumEnergy(4, model.Efn, model.R, model.num_electrons)
+        self.assertAlmostEqual(energy, energy_m, places=10)
+        self.assertTrue(np.allclose(ws, ws_m, rtol=0.0, atol=1e-15))
+
+    def test_driver_dos_canonical(self):
+        model = HexagonalMultiBand()
+        dos, E_vals, tetras, Eks = DosValues(-1.0, 1.0, 5, 4, model.Efn, model.R)
+        SetDefaultMeshOrder("morton")
+        dos_m, E_vals_m, tetras_m, Eks_m = DosValues(-1.0, 1.0, 5, 4, model.Efn, model.R)
+        self.assertTrue(np.allclose(dos, dos_m, rtol=0.0, atol=1e-12))
+        self.assertTrue(np.array_equal(tetras, tetras_m))
+        self.assertTrue(np.array_equal(Eks.data, Eks_m.data))
+        plan = GetMeshPlan(4, model.R, "canonical")
+        self.assertTrue(np.array_equal(tetras_m, plan.tetras))
+
+if __name__ == "__main__":
+    unittest.main()
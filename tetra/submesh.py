@@ -2,26 +2,31 @@ import numpy as np
 
 def MakeSubmesh(n):
     '''Return a list containing the submesh of k-points in the reciprocal
-    lattice basis covering the full Brillouin zone. The number of k-points
-    in all 3 dimensions is given by n+1 (i.e. we require that n1 = n2 = n3);
-    the total number of k-points in the submesh is (n+1)**3.
+    lattice basis covering the full Brillouin zone.
+
+    n = submesh density; either an integer, in which case n1 = n2 = n3 = n,
+    or a tuple (n1, n2, n3) giving the number of submesh intervals along
+    each reciprocal lattice vector. The number of k-points along dimension i
+    is ni+1; the total number of k-points in the submesh is
+    (n1+1)*(n2+1)*(n3+1).
 
     The submesh generation is implemented as described in BJA94 Section III.
     As noted there, the submesh should have the symmetry of the reciprocal
     lattice; this restricts the allowed values of n1, n2, and n3. This
-    restriction can always be satisfied by setting n1 = n2 = n3.
+    restriction can always be satisfied by setting n1 = n2 = n3; for lattices
+    with reciprocal lattice vectors of very different lengths, choosing ni
+    roughly proportional to |G_i| avoids oversampling the short directions.
     We assume the submesh shift (i0, j0, k0) is zero.
     '''
-    if n <= 0:
-        raise ValueError("Must have n > 0 in MakeSubmesh.")
+    n1, n2, n3 = _mesh_dims(n, "MakeSubmesh")
     submesh = []
-    step = 1/n
-    for k in range(n+1):
-        k3 = k*step
-        for j in range(n+1):
-            k2 = j*step
-            for i in range(n+1):
-                k1 = i*step
+    step1, step2, step3 = 1/n1, 1/n2, 1/n3
+    for k in range(n3+1):
+        k3 = k*step3
+        for j in range(n2+1):
+            k2 = j*step2
+            for i in range(n1+1):
+                k1 = i*step1
                 submesh.append((k1, k2, k3))
     return submesh
 
@@ -39,38 +44,235 @@ def MakeSubmesh(n):
 
 def MakeTetra(n):
     '''Return a list containing the tetrahedra dividing the full Brillouin
-    zone. The number of k-points in all 3 dimensions is given by n+1 (i.e. we
-    require that n1 = n2 = n3); the total number of k-points in the submesh
-    is (n+1)**3.
+    zone.
 
-    The submesh is defined as that returned by MakeSubmesh(n).
+    n = submesh density; either an integer (n1 = n2 = n3 = n) or a tuple
+    (n1, n2, n3). The submesh is defined as that returned by MakeSubmesh(n);
+    the number of tetrahedra is 6*n1*n2*n3.
 
     Tetrahedra generation is implemented as described in BJA94 Section III.
     '''
+    dims = _mesh_dims(n, "MakeTetra")
+    n1, n2, n3 = dims
     tetra = []
     subcell_tetras = [(1, 2, 3, 6), (1, 3, 5, 6), (3, 5, 6, 7), (3, 6, 7, 8),
                       (3, 4, 6, 8), (2, 3, 4, 6)]
     # Range over n instead of n+1 here to ensure that the cell is always in
     # the first Brillouin zone.
-    # The number of submesh cells is given by n**3.
-    for k in range(n):
-        for j in range(n):
-            for i in range(n):
+    # The number of submesh cells is given by n1*n2*n3.
+    for k in range(n3):
+        for j in range(n2):
+            for i in range(n1):
                 points = [(i, j, k), (i+1, j, k), (i, j+1, k), (i+1, j+1, k),
                           (i, j, k+1), (i+1, j, k+1), (i, j+1, k+1), (i+1, j+1, k+1)]
                 for sc_t in subcell_tetras:
                     vertices = []
                     for point_index in sc_t:
                         this_i, this_j, this_k = points[point_index-1]
-                        vertices.append(_submesh_index(n, this_i, this_j, this_k))
+                        vertices.append(_submesh_index(dims, this_i, this_j, this_k))
                     tetra.append(vertices)
     return tetra
 
+def MakeSubmesh2D(n):
+    '''Return a list containing the submesh of k-points in the reciprocal
+    lattice basis covering the full two-dimensional Brillouin zone spanned by
+    the first two reciprocal lattice vectors, for use with the triangles
+    returned by MakeTriangles(n).
+
+    n = submesh density; either an integer, in which case n1 = n2 = n, or a
+    tuple (n1, n2). The total number of k-points in the submesh is
+    (n1+1)*(n2+1). Each k-point is returned as (k1, k2, 0.0), so that band
+    energy functions E(k) of three-dimensional k may be used unchanged.
+    '''
+    if isinstance(n, (int, np.integer)):
+        n = (n, n)
+    n1, n2 = _mesh_dims(n, "MakeSubmesh2D", allow_2d=True)
+    submesh = []
+    step1, step2 = 1/n1, 1/n2
+    for j in range(n2+1):
+        k2 = j*step2
+        for i in range(n1+1):
+            k1 = i*step1
+            submesh.append((k1, k2, 0.0))
+    return submesh
+
+# Triangles of a submesh cell, numbered as in MakeTriangles.
+_SUBCELL_TRIANGLES = ((1, 2, 3), (2, 3, 4))
+
+def MakeTriangles(n):
+    '''Return a list containing the triangles dividing the full
+    two-dimensional Brillouin zone; the two-dimensional counterpart of
+    MakeTetra.
+
+    n = submesh density; either an integer (n1 = n2 = n) or a tuple
+    (n1, n2). The submesh is defined as that returned by MakeSubmesh2D(n);
+    the number of triangles is 2*n1*n2.
+
+    Each submesh cell, with corners numbered 1 = (i, j), 2 = (i+1, j),
+    3 = (i, j+1) and 4 = (i+1, j+1), is divided along its 2-3 diagonal into
+    the triangles (1, 2, 3) and (2, 3, 4), as BJA94 divides the cell along
+    its 3-6 diagonal. OptimizeGs2D chooses the orientation of the
+    reciprocal lattice for which this diagonal is shortest.
+    '''
+    if isinstance(n, (int, np.integer)):
+        n = (n, n)
+    dims = _mesh_dims(n, "MakeTriangles", allow_2d=True)
+    n1, n2 = dims
+    triangles = []
+    for j in range(n2):
+        for i in range(n1):
+            points = [(i, j), (i+1, j), (i, j+1), (i+1, j+1)]
+            for sc_t in _SUBCELL_TRIANGLES:
+                vertices = []
+                for point_index in sc_t:
+                    this_i, this_j = points[point_index-1]
+                    vertices.append(_submesh_index(dims, this_i, this_j, 0))
+                triangles.append(vertices)
+    return triangles
+
+def _submesh_array(n):
+    '''Return the submesh MakeSubmesh(n) as a numpy array with shape
+    (num_ks, 3), constructed without Python-level loops.
+    '''
+    dims = _mesh_dims(n, "MakeSubmesh", allow_2d=True)
+    if len(dims) == 2:
+        k2s, k1s = np.meshgrid(np.arange(dims[1]+1)*(1/dims[1]),
+                               np.arange(dims[0]+1)*(1/dims[0]), indexing='ij')
+        return np.stack((k1s.ravel(), k2s.ravel(), np.zeros(k1s.size)), axis=1)
+    n1, n2, n3 = dims
+    k3s, k2s, k1s = np.meshgrid(np.arange(n3+1)*(1/n3), np.arange(n2+1)*(1/n2),
+                                np.arange(n1+1)*(1/n1), indexing='ij')
+    return np.stack((k1s.ravel(), k2s.ravel(), k3s.ravel()), axis=1)
+
+def _tetra_array(n):
+    '''Return the tetrahedra MakeTetra(n) as an integer numpy array with
+    shape (num_tetra, 4), constructed without Python-level loops.
+    '''
+    dims = _mesh_dims(n, "MakeTetra")
+    n1, n2, n3 = dims
+    subcell_tetras = np.array([(1, 2, 3, 6), (1, 3, 5, 6), (3, 5, 6, 7), (3, 6, 7, 8),
+                               (3, 4, 6, 8), (2, 3, 4, 6)], dtype=np.intp)
+    # Offsets of the submesh cell points (as numbered in BJA94 Fig. 5)
+    # from the cell origin.
+    point_offsets = np.array([_submesh_index(dims, di, dj, dk)
+                              for dk in range(2) for dj in range(2) for di in range(2)],
+                             dtype=np.intp)
+    ks, js, iis = np.meshgrid(np.arange(n3), np.arange(n2), np.arange(n1), indexing='ij')
+    origins = _submesh_index(dims, iis.ravel(), js.ravel(), ks.ravel()).astype(np.intp)
+    tetra = origins[:, np.newaxis, np.newaxis] + point_offsets[subcell_tetras - 1]
+    return tetra.reshape(-1, 4)
+
+def _triangle_array(n):
+    '''Return the triangles MakeTriangles(n) as an integer numpy array with
+    shape (num_triangles, 3), constructed without Python-level loops.
+    '''
+    dims = _mesh_dims(n, "MakeTriangles", allow_2d=True)
+    n1, n2 = dims
+    subcell_triangles = np.array(_SUBCELL_TRIANGLES, dtype=np.intp)
+    point_offsets = np.array([_submesh_index(dims, di, dj, 0)
+                              for dj in range(2) for di in range(2)], dtype=np.intp)
+    js, iis = np.meshgrid(np.arange(n2), np.arange(n1), indexing='ij')
+    origins = _submesh_index(dims, iis.ravel(), js.ravel(), 0).astype(np.intp)
+    triangles = origins[:, np.newaxis, np.newaxis] + point_offsets[subcell_triangles - 1]
+    return triangles.reshape(-1, 3)
+
+def MortonKOrder(n):
+    '''Return an integer numpy array k_order giving the submesh MakeSubmesh(n)
+    in Morton (Z-curve) order: the k-point at position i of the reordered
+    submesh is MakeSubmesh(n)[k_order[i]]. Consecutive k-points in Morton
+    order are close together in all three dimensions, so that the vertices
+    of nearby tetrahedra are also close together in memory.
+    '''
+    n1, n2, n3 = _mesh_dims(n, "MortonKOrder")
+    return _morton_order(n1+1, n2+1, n3+1)
+
+def MortonCellOrder(n):
+    '''Return an integer numpy array cell_order giving the submesh cells in
+    Morton order, where the cells are numbered in the order in which
+    MakeTetra(n) generates them (i.e. MakeTetra(n)[6*c:6*c+6] are the
+    tetrahedra of cell c).
+    '''
+    n1, n2, n3 = _mesh_dims(n, "MortonCellOrder")
+    return _morton_order(n1, n2, n3)
+
+def _morton_order(m1, m2, m3):
+    '''Return the permutation which sorts the points (i, j, k) of an
+    m1 x m2 x m3 grid, numbered with i fastest, by their Morton code.
+    '''
+    ks, js, iis = np.meshgrid(np.arange(m3), np.arange(m2), np.arange(m1), indexing='ij')
+    bits = max(int(max(m1, m2, m3) - 1).bit_length(), 1)
+    codes = np.zeros(m1*m2*m3, dtype=np.int64)
+    for axis, vals in enumerate((iis.ravel(), js.ravel(), ks.ravel())):
+        vals = vals.astype(np.int64)
+        for bit in range(bits):
+            codes |= ((vals >> bit) & 1) << (3*bit + axis)
+    return np.argsort(codes, kind='stable').astype(np.intp)
+
+def RefineDims(n, R=None):
+    '''Return the submesh density to use for the next step of a convergence
+    loop which starts at submesh density n.
+
+    If n is an integer, the returned value is 2*n. If n = (n1, n2, n3) (or
+    (n1, n2) for a two-dimensional submesh), only
+    the under-resolved axes are doubled: the submesh step along axis i is
+    |G_i|/ni, and axis i is doubled if its step is larger than half of the
+    largest step. Repeated refinement therefore drives the submesh towards
+    equal Cartesian steps along all axes.
+
+    R = a numpy matrix with rows given by the reciprocal lattice vectors
+    (in the same order as n). If R is None, all reciprocal lattice vectors
+    are taken to have the same length.
+    '''
+    if isinstance(n, (int, np.integer)):
+        return 2*n
+    dims = _mesh_dims(n, "RefineDims", allow_2d=True)
+    if R is None:
+        lengths = [1.0]*len(dims)
+    else:
+        lengths = [np.linalg.norm(R[i, :]) for i in range(len(dims))]
+    steps = [lengths[i] / dims[i] for i in range(len(dims))]
+    max_step = max(steps)
+    refined = []
+    for i in range(len(dims)):
+        if steps[i] > max_step / 2:
+            refined.append(2*dims[i])
+        else:
+            refined.append(dims[i])
+    return tuple(refined)
+
+def NumKs(n):
+    '''Return the number of k-points in the submesh MakeSubmesh(n), or in
+    MakeSubmesh2D(n) if n = (n1, n2).
+    '''
+    dims = _mesh_dims(n, "NumKs", allow_2d=True)
+    return int(np.prod([d+1 for d in dims]))
+
+def _mesh_dims(n, caller="_mesh_dims", allow_2d=False):
+    '''Return the submesh density n as a tuple (n1, n2, n3), where n is either
+    an integer or a sequence of three integers. If allow_2d is True, n may
+    also be a sequence of two integers, which is returned as (n1, n2).
+    '''
+    if isinstance(n, (int, np.integer)):
+        dims = (int(n), int(n), int(n))
+    else:
+        dims = tuple(int(ni) for ni in n)
+        if len(dims) == 2 and not allow_2d:
+            raise ValueError("Two-dimensional n = (n1, n2) is not supported in {}.".format(caller))
+        if len(dims) not in (2, 3):
+            raise ValueError("Must have n = (n1, n2, n3) in {}.".format(caller))
+    if min(dims) <= 0:
+        raise ValueError("Must have n > 0 in {}.".format(caller))
+    return dims
+
 def _submesh_index(n, i, j, k):
-    return i + j*(n+1) + k*((n+1)**2)
+    if isinstance(n, (int, np.integer)):
+        return i + j*(n+1) + k*((n+1)**2)
+    n1, n2 = n[0], n[1]
+    return i + j*(n1+1) + k*((n1+1)*(n2+1))
 
 def _submesh_ijk(n, index):
-    i = index % (n+1)
-    j = ((index % ((n+1)**2)) - i) / (n+1)
-    k = (index - i - j*(n+1)) / ((n+1)**2)
+    n1, n2, n3 = _mesh_dims(n)
+    i = index % (n1+1)
+    j = (index // (n1+1)) % (n2+1)
+    k = index // ((n1+1)*(n2+1))
     return i, j, k
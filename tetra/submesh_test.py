@@ -0,0 +1,66 @@
+import unittest
+import numpy as np
+from tetra.submesh import MakeSubmesh, MakeTetra, RefineDims, NumKs, _submesh_index, _submesh_ijk
+from tetra.ksample import OptimizeGs, GetNopt
+
+class TestMakeSubmesh(unittest.TestCase):
+    def test_isotropic_matches_tuple(self):
+        self.assertEqual(MakeSubmesh(3), MakeSubmesh((3, 3, 3)))
+        self.assertEqual(MakeTetra(3), MakeTetra((3, 3, 3)))
+
+    def test_anisotropic_counts(self):
+        n = (4, 3, 2)
+        submesh = MakeSubmesh(n)
+        tetras = MakeTetra(n)
+        self.assertEqual(len(submesh), 5*4*3)
+        self.assertEqual(len(submesh), NumKs(n))
+        self.assertEqual(len(tetras), 6*4*3*2)
+        # Every submesh point is a vertex of some tetrahedron.
+        vertices = set()
+        for tet in tetras:
+            vertices.update(tet)
+        self.assertEqual(vertices, set(range(len(submesh))))
+
+    def test_anisotropic_index(self):
+        n = (4, 3, 2)
+        submesh = MakeSubmesh(n)
+        for i, j, k in ((0, 0, 0), (4, 0, 0), (1, 2, 1), (4, 3, 2)):
+            kN = _submesh_index(n, i, j, k)
+            self.assertEqual(_submesh_ijk(n, kN), (i, j, k))
+            expected = (i/n[0], j/n[1], k/n[2])
+            for d in range(3):
+                self.assertAlmostEqual(submesh[kN][d], expected[d])
+
+    def test_bad_n(self):
+        with self.assertRaises(ValueError):
+            MakeSubmesh((4, 0, 2))
+        with self.assertRaises(ValueError):
+            MakeTetra((4, 4))
+
+class TestRefineDims(unittest.TestCase):
+    def test_int(self):
+        self.assertEqual(RefineDims(8), 16)
+
+    def test_refine_underresolved(self):
+        R = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 0.2]])
+        # Step along G_3 is 0.2/2 = 0.1, much finer than 1/4 = 0.25.
+        self.assertEqual(RefineDims((4, 4, 2), R), (8, 8, 2))
+        # Steps are now 0.125, 0.125, 0.1: all axes are under-resolved.
+        self.assertEqual(RefineDims((8, 8, 2), R), (16, 16, 4))
+
+class TestOptimizeGsAnisotropic(unittest.TestCase):
+    def test_submesh_diagonal(self):
+        Rhex = np.array([[1.0, 0.0, 0.0], [-0.5, np.sqrt(3)/2.0, 0.0], [0.0, 0.0, 0.1]])
+        n = (8, 8, 1)
+        G_order, G_neg = OptimizeGs(Rhex, n)
+        n_opt = GetNopt(n, G_order)
+        steps = np.zeros((3, 3))
+        for i in range(3):
+            steps[G_order[i], :] = G_neg[i]*Rhex[i, :]/n[i]
+            self.assertEqual(n_opt[G_order[i]], n[i])
+        d_opt = np.linalg.norm(-steps[0, :] + steps[1, :] - steps[2, :])
+        d_orig = np.linalg.norm(-Rhex[0, :]/8 + Rhex[1, :]/8 - Rhex[2, :]/1)
+        self.assertTrue(d_opt <= d_orig)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,22 +1,23 @@
-import sys
 from math import fsum
-import time
-from tetra.ksample import OptimizeGs, MakeEks, MakeXks
-from tetra.submesh import MakeSubmesh, MakeTetra
+import numpy as np
+from tetra.ksample import MakeEks, MakeXks, MakeEksAsync, MakeXksAsync
+from tetra.submesh import RefineDims
+from tetra.plan import GetMeshPlan, ToCanonicalOrder, FromCanonicalOrder
 from tetra.fermi import FindFermi
-from tetra.weights import Weights
+from tetra.fused import FusedSweep
 from tetra.numstates import NumStates
+from tetra.instrument import _phase, _refinement_level
+from tetra.bands import _band_major
 
-clock_start = None
-
-def SumFn(n, Efn, Xfn, R, num_electrons, tolerance=None):
+def SumFn(n, Efn, Xfn, R, num_electrons, tolerance=None, E_Fermi=None, checkpoint=None):
     '''Calculate the expectation value of Xfn over the Brillouin zone
     using the tetrahedron method. Returns the expectation value, as well as
     the submesh density n used to achieve the specified tolerance and the
     integration weights used (for use in additional summations by SumMesh).
 
-    n = Brillouin zone submesh density (the total number of k-points sampled
-    is (n+1)**3).
+    n = Brillouin zone submesh density; either an integer (the total number
+    of k-points sampled is (n+1)**3) or a tuple (n1, n2, n3) giving the
+    density along each reciprocal lattice vector.
 
     Efn = a function E(k) which returns a list of the band energies at the
     Brillouin zone point k, with the returned list sorted in ascending order;
@@ -31,70 +32,126 @@ def SumFn(n, Efn, Xfn, R, num_electrons, tolerance=None):
 
     tolerance = summation error tolerance. If tolerance != None, the value
     of n is repeatedly doubled (starting from the given value) until the
-    difference between iterations is less than tolerance.
+    difference between iterations is less than tolerance. For anisotropic n,
+    only the under-resolved axes are doubled (see submesh.RefineDims).
+
+    E_Fermi = if given, the Fermi energy to use instead of solving for the
+    Fermi energy from num_electrons at each n (num_electrons is then
+    ignored). The integration weights are then obtained in a single sweep
+    over the tetrahedra.
+
+    checkpoint = if given, a checkpoint.Checkpoint in which the sampled
+    values and the result at each n are saved as they are completed. A
+    call interrupted while using a checkpoint directory resumes from the
+    saved state when repeated with the same directory.
     '''
     # Calculate the expectation value for a particular n.
     def doSum(this_n):
-        G_order, G_neg, submesh, Eks, ws = _sum_setup(this_n, Efn, R, num_electrons)
+        plan, Eks, ws = _sum_setup(this_n, Efn, R, num_electrons, E_Fermi, checkpoint,
+                "SumFn")
         # Sample X.
-        Xks = MakeXks(Xfn, submesh, G_order, G_neg)
+        with _phase("sample"):
+            if checkpoint is not None:
+                Xks = checkpoint.MakeXks(Xfn, plan, job="SumFn")
+            else:
+                Xks = MakeXks(Xfn, plan.submesh, plan.G_order, plan.G_neg)
         # Calculate sum.
-        result = _SumByWeights(ws, Xks)
-        return result, ws
+        with _phase("contract"):
+            result = _SumByWeights(ws, Xks)
+        return result, ToCanonicalOrder(ws, plan)
     # Refine n until tolerance is met.
-    return _sum_until_tol(doSum, n, tolerance)
+    return _sum_until_tol(doSum, n, R, tolerance, checkpoint, "SumFn")
 
-def _sum_setup(n, Efn, R, num_electrons):
+def _sum_setup(n, Efn, R, num_electrons, E_Fermi=None, checkpoint=None, job=None):
     '''Setup for summation common to SumFn and SumEnergy.
     '''
-    # Get optimal reciprocal lattice orientation.
-    G_order, G_neg = OptimizeGs(R)
-    # Generate submesh and tetrahedra.
-    submesh = MakeSubmesh(n)
-    tetras = MakeTetra(n)
-    tetras_size = sys.getsizeof(tetras)
-    for t_i in range(len(tetras)):
-        tetras_size += sys.getsizeof(tetras[t_i])
-    #print("size of tetras = {}".format(str(tetras_size)))
-    #print("size of tetras per submesh cell = {}".format(str(tetras_size / n**3)))
-    submesh_size = sys.getsizeof(submesh)
-    #print("size of submesh = {}".format(str(submesh_size)))
-    #print("size of submesh per submesh cell = {}".format(str(submesh_size / n**3)))
+    # Get submesh and tetrahedra in the optimal reciprocal lattice orientation.
+    with _phase("mesh"):
+        plan = GetMeshPlan(n, R)
     # Sample E.
-    Eks = MakeEks(Efn, submesh, G_order, G_neg)
-    print("In tetra.sum, at n = {} finished submesh sample; time = {}".format(str(n), str(time.time() - clock_start)))
-    Eks_size = sys.getsizeof(Eks)
-    for E_i in range(len(Eks)):
-        Eks_size += sys.getsizeof(Eks[E_i])
-    #print("size of Eks = {}".format(str(Eks_size)))
-    #print("size of Eks per submesh cell = {}".format(str(Eks_size / n**3)))
+    with _phase("sample"):
+        if checkpoint is not None:
+            Eks = checkpoint.MakeEks(Efn, plan, job=job)
+        else:
+            Eks = MakeEks(Efn, plan.submesh, plan.G_order, plan.G_neg)
+    return plan, Eks, _sum_weights(plan, Eks, num_electrons, E_Fermi)
+
+def _sum_weights(plan, Eks, num_electrons, E_Fermi):
+    tetras = plan.tetras
     # Get Fermi energy by n(E_F) = num_electrons.
-    E_Fermi = FindFermi(num_electrons, tetras, Eks)
-    print("In tetra.sum, at n = {} got E_Fermi = {}; time = {}".format(str(n), str(E_Fermi), str(time.time() - clock_start)))
-    # Get integration weights.
-    ws = Weights(E_Fermi, tetras, Eks)
-    ws_size = sys.getsizeof(ws)
-    for w_i in range(len(ws)):
-        ws_size += sys.getsizeof(ws[w_i])
-    #print("size of ws = {}".format(str(ws_size)))
-    #print("size of ws per submesh cell = {}".format(str(ws_size / n**3)))
-    print(len(ws))
-    print(len(ws[0]))
-    return G_order, G_neg, submesh, Eks, ws
-
-def _sum_until_tol(doSum, n, tolerance):
-    last_result = None
-    result, ws = doSum(n)
+    if E_Fermi is None:
+        with _phase("fermi"):
+            E_Fermi = FindFermi(num_electrons, tetras, Eks)
+    # Get integration weights. The fused sweep sorts the corner energies of
+    # each tetrahedron once for both the weights and their curvature
+    # correction.
+    with _phase("weights"):
+        return FusedSweep(E_Fermi, tetras, Eks).weights
+
+async def _sum_setup_async(n, Efn, R, num_electrons, E_Fermi, max_in_flight, retries,
+        retry_delay):
+    '''As _sum_setup, for a coroutine function Efn.
+    '''
+    with _phase("mesh"):
+        plan = GetMeshPlan(n, R)
+    with _phase("sample"):
+        Eks = await MakeEksAsync(Efn, plan.submesh, plan.G_order, plan.G_neg,
+                max_in_flight=max_in_flight, retries=retries, retry_delay=retry_delay)
+    return plan, Eks, _sum_weights(plan, Eks, num_electrons, E_Fermi)
+
+def _sum_until_tol(doSum, n, R, tolerance, checkpoint=None, job=None):
+    # Levels completed by an earlier, interrupted run are loaded from the
+    # checkpoint instead of being recomputed.
+    def doLevel(this_n):
+        if checkpoint is not None:
+            saved = checkpoint.LoadLevel(job, this_n)
+            if saved is not None:
+                return saved
+        with _refinement_level(this_n):
+            result, ws = doSum(this_n)
+        if checkpoint is not None:
+            checkpoint.SaveLevel(job, this_n, result, ws)
+        return result, ws
+
+    levels = _refinement_levels(n, R, tolerance)
+    try:
+        this_n = next(levels)
+        while True:
+            this_n = levels.send(doLevel(this_n))
+    except StopIteration as stop:
+        return stop.value
+
+async def _sum_until_tol_async(doSum, n, R, tolerance):
+    '''As _sum_until_tol (without checkpointing), for a coroutine function
+    doSum.
+    '''
+    levels = _refinement_levels(n, R, tolerance)
+    try:
+        this_n = next(levels)
+        while True:
+            with _refinement_level(this_n):
+                level = await doSum(this_n)
+            this_n = levels.send(level)
+    except StopIteration as stop:
+        return stop.value
+
+def _refinement_levels(n, R, tolerance):
+    '''Generator implementing the refinement loop shared by _sum_until_tol
+    and _sum_until_tol_async: yields each submesh density to compute,
+    starting from n, and is sent the (result, ws) computed there. Stops
+    with the value (result, n, ws) at the last density, once the tolerance
+    is met (or after the first density if tolerance is None).
+    '''
+    this_n = n
+    result, ws = yield this_n
     if tolerance == None:
-        return result, n, ws
-    print("In tetra.sum, at n = {} got result = {}; time = {}".format(str(n), str(result), str(time.time() - clock_start)))
-    try_n = 2*n
+        return result, this_n, ws
+    last_result = None
     while not _sum_finished(result, last_result, tolerance):
         last_result = result
-        result, ws = doSum(try_n)
-        print("In tetra.sum, at n = {} got result = {}; time = {}".format(str(try_n), str(result), str(time.time() - clock_start)))
-        try_n = 2*try_n
-    return result, try_n/2, ws
+        this_n = RefineDims(this_n, R)
+        result, ws = yield this_n
+    return result, this_n, ws
 
 def _sum_finished(result, last_result, tolerance):
     if last_result == None:
@@ -109,30 +166,29 @@ def _SumByWeights(weights, Xks):
     using the tetrahedron method, given precalculated (k,n) integration
     weights and sampled values of X_n(k).
 
-    weights = a list of integration weights w[n][j].
+    weights = integration weights w[n][j], as a list or numpy array.
 
-    Xks = a list of matrix elements X[j][n], with band indices ordered in the
-    same way as the eigenstate energies. Xks can be generated by
-    ksample.MakeXks.
+    Xks = the matrix elements X[j][n] as a BandArray (see ksample.MakeXks),
+    or a list of per-k lists, with band indices ordered in the same way as
+    the eigenstate energies. If these are complex, a complex value is
+    returned.
     '''
-    num_bands = len(weights)
-    num_ks = len(weights[0])
-    mult_vals = []
-    # Accumulate list of values and then sum to take advantage of
-    # floating-point error correction in fsum.
-    for j in range(num_ks):
-        for n in range(num_bands):
-            mult_vals.append(Xks[j][n]*weights[n][j])
-    return fsum(mult_vals)
-
-def SumEnergy(n, Efn, R, num_electrons, tolerance=None):
+    Xs_by_band = _band_major(Xks)
+    mult_vals = np.asarray(weights, dtype=np.float64) * Xs_by_band
+    # Sum with fsum to take advantage of its floating-point error correction.
+    if np.iscomplexobj(mult_vals):
+        return complex(fsum(mult_vals.real.ravel()), fsum(mult_vals.imag.ravel()))
+    return fsum(mult_vals.ravel())
+
+def SumEnergy(n, Efn, R, num_electrons, tolerance=None, E_Fermi=None, checkpoint=None):
     '''Calculate the expectation value of the energy over the Brillouin zone
     using the tetrahedron method. Returns the expectation value, as well as
     the submesh density n used to achieve the specified tolerance and the
     integration weights used (for use in additional summations by SumMesh).
 
-    n = Brillouin zone submesh density (the total number of k-points sampled
-    is (n+1)**3).
+    n = Brillouin zone submesh density; either an integer (the total number
+    of k-points sampled is (n+1)**3) or a tuple (n1, n2, n3) giving the
+    density along each reciprocal lattice vector.
 
     Efn = a function E(k) which returns a list of the band energies at the
     Brillouin zone point k, with the returned list sorted in ascending order;
@@ -142,28 +198,71 @@ def SumEnergy(n, Efn, R, num_electrons, tolerance=None):
 
     tolerance = summation error tolerance. If tolerance != None, the value
     of n is repeatedly doubled (starting from the given value) until the
-    difference between iterations is less than tolerance.
+    difference between iterations is less than tolerance. For anisotropic n,
+    only the under-resolved axes are doubled (see submesh.RefineDims).
+
+    E_Fermi = if given, the Fermi energy to use instead of solving for the
+    Fermi energy from num_electrons at each n (num_electrons is then
+    ignored). The integration weights are then obtained in a single sweep
+    over the tetrahedra.
+
+    checkpoint = if given, a checkpoint.Checkpoint in which the sampled
+    values and the result at each n are saved as they are completed. A
+    call interrupted while using a checkpoint directory resumes from the
+    saved state when repeated with the same directory.
     '''
     # Calculate the expectation value for a particular n.
     def doSum(this_n):
-        G_order, G_neg, submesh, Eks, ws = _sum_setup(this_n, Efn, R, num_electrons)
+        plan, Eks, ws = _sum_setup(this_n, Efn, R, num_electrons, E_Fermi, checkpoint,
+                "SumEnergy")
         # Calculate sum.
-        result = _SumByWeights(ws, Eks)
-        return result, ws
+        with _phase("contract"):
+            result = _SumByWeights(ws, Eks)
+        return result, ToCanonicalOrder(ws, plan)
     # Refine n until tolerance is met.
-    global clock_start
-    clock_start = time.time()
-    return _sum_until_tol(doSum, n, tolerance)
+    return _sum_until_tol(doSum, n, R, tolerance, checkpoint, "SumEnergy")
+
+async def SumFnAsync(n, Efn, Xfn, R, num_electrons, tolerance=None, E_Fermi=None,
+        max_in_flight=8, retries=2, retry_delay=0.1):
+    '''As SumFn, but for coroutine functions Efn and Xfn (e.g. ones waiting
+    on an out-of-process band solver), which are sampled by MakeEksAsync and
+    MakeXksAsync with the given max_in_flight, retries and retry_delay.
+    '''
+    async def doSum(this_n):
+        plan, Eks, ws = await _sum_setup_async(this_n, Efn, R, num_electrons, E_Fermi,
+                max_in_flight, retries, retry_delay)
+        with _phase("sample"):
+            Xks = await MakeXksAsync(Xfn, plan.submesh, plan.G_order, plan.G_neg,
+                    max_in_flight=max_in_flight, retries=retries, retry_delay=retry_delay)
+        with _phase("contract"):
+            result = _SumByWeights(ws, Xks)
+        return result, ToCanonicalOrder(ws, plan)
+    return await _sum_until_tol_async(doSum, n, R, tolerance)
+
+async def SumEnergyAsync(n, Efn, R, num_electrons, tolerance=None, E_Fermi=None,
+        max_in_flight=8, retries=2, retry_delay=0.1):
+    '''As SumEnergy, but for a coroutine function Efn, which is sampled by
+    MakeEksAsync with the given max_in_flight, retries and retry_delay.
+    '''
+    async def doSum(this_n):
+        plan, Eks, ws = await _sum_setup_async(this_n, Efn, R, num_electrons, E_Fermi,
+                max_in_flight, retries, retry_delay)
+        with _phase("contract"):
+            result = _SumByWeights(ws, Eks)
+        return result, ToCanonicalOrder(ws, plan)
+    return await _sum_until_tol_async(doSum, n, R, tolerance)
 
 def SumMesh(weights, n, Xfn, R):
     '''Calculate the expectation value <X> over the Brillouin zone
     using the tetrahedron method, given precalculated (k,n) integration
     weights.
 
-    weights = a list of integration weights w_{nj}.
+    weights = a list of integration weights w_{nj}, with k-points in the
+    order of MakeSubmesh (as returned by SumFn and SumEnergy).
 
-    n = Brillouin zone submesh density (the total number of k-points sampled
-    is (n+1)**3).
+    n = Brillouin zone submesh density; either an integer (the total number
+    of k-points sampled is (n+1)**3) or a tuple (n1, n2, n3) giving the
+    density along each reciprocal lattice vector.
 
     Xfn = a function X(k) which returns a list of the values of the matrix
     elements of the operator X at k; the returned values are ordered in the
@@ -176,12 +275,13 @@ def SumMesh(weights, n, Xfn, R):
         <X> = \sum_{j, n} X_n(k_j) w_{nj}
     (BJA94 Eq. 4).
     '''
-    # Get optimal reciprocal lattice orientation.
-    G_order, G_neg = OptimizeGs(R)
-    # Generate submesh.
-    submesh = MakeSubmesh(n)
+    # Get submesh in the optimal reciprocal lattice orientation.
+    with _phase("mesh"):
+        plan = GetMeshPlan(n, R)
     # Sample X.
-    Xks = MakeXks(Xfn, submesh, G_order, G_neg)
+    with _phase("sample"):
+        Xks = MakeXks(Xfn, plan.submesh, plan.G_order, plan.G_neg)
     # Calculate sum.
-    result = _SumByWeights(ws, Xks)
+    with _phase("contract"):
+        result = _SumByWeights(FromCanonicalOrder(weights, plan), Xks)
     return result
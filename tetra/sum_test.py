@@ -1,6 +1,9 @@
+import io
 import unittest
+from contextlib import redirect_stdout
 import numpy as np
 from tetra.sum import SumEnergy
+from tetra.instrument import PhaseRecorder, _phase
 
 def _cubicR(a):
     Da = (a, 0.0, 0.0)
@@ -40,6 +43,64 @@ class TestSumEnergy(unittest.TestCase):
         expected = E0
         _assert_within(self, result, expected, tolerance*1.1)
 
+    def test_energy_known_fermi(self):
+        R = _cubicR(1.0)
+        def Efn(k):
+            return _simplebands_Efn(k, 2, 1.0, 6.0, 14.0)
+        with PhaseRecorder() as rec:
+            result, n, ws = SumEnergy(8, Efn, R, None, E_Fermi=13.0)
+        _assert_within(self, result, 6.0, 1e-9)
+        phases = rec.ByLevel()[8]
+        self.assertTrue("fermi" not in phases)
+        self.assertEqual(phases["weights"]["calls"], 1)
+
+class TestSumInstrumentation(unittest.TestCase):
+    def test_phases_by_level(self):
+        R = _cubicR(1.0)
+        def Efn(k):
+            return _simplebands_Efn(k, 2, 1.0, 6.0, 14.0)
+        seen = []
+        out = io.StringIO()
+        with redirect_stdout(out), PhaseRecorder(callback=seen.append, track_memory=True) as rec:
+            result, n, ws = SumEnergy(4, Efn, R, 1, 1e-6)
+        self.assertEqual(out.getvalue(), "")
+        self.assertEqual(seen, rec.records)
+        levels = rec.ByLevel()
+        self.assertEqual(list(levels.keys()), [4, 8])
+        for level, phases in levels.items():
+            for phase in ("mesh", "sample", "fermi", "numstates", "weights", "contract"):
+                self.assertTrue(phase in phases)
+                self.assertTrue(phases[phase]["wall_time"] >= 0.0)
+                self.assertTrue(phases[phase]["peak_bytes"] >= 0)
+            self.assertEqual(phases["fermi"]["calls"], 1)
+            self.assertTrue(phases["numstates"]["calls"] > 1)
+
+    def test_peak_memory(self):
+        size = 2**22
+        with PhaseRecorder(track_memory=True) as rec:
+            with _phase("outer"):
+                with _phase("inner"):
+                    # Allocated and freed within the phase: no net change,
+                    # but the peak includes it.
+                    buf = bytearray(size)
+                    del buf
+                with _phase("inner"):
+                    pass
+        inner, second_inner, outer = rec.records
+        self.assertTrue(inner.peak_bytes >= size)
+        self.assertTrue(second_inner.peak_bytes < size)
+        # The outer phase's peak includes that of the first inner phase.
+        self.assertTrue(size <= outer.peak_bytes < 2*size)
+
+    def test_silent_without_recorder(self):
+        R = _cubicR(1.0)
+        def Efn(k):
+            return _simplebands_Efn(k, 2, 1.0, 6.0, 14.0)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            SumEnergy(4, Efn, R, 1)
+        self.assertEqual(out.getvalue(), "")
+
 def _assert_within(testcase, result, expected, eps):
     err = abs(result - expected)
     testcase.assertTrue(err < eps)
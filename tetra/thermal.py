@@ -0,0 +1,301 @@
+'''Finite-temperature occupations from a single set of tetrahedron sweeps.
+
+A ThermalGrid holds n(E) on an energy grid which is refined until n(E) is
+well approximated by linear interpolation between grid points. Any
+quantity q(E) sampled on the grid (n(E) itself, or the zero-temperature
+integration weights w[n][j](E) of FusedSweep) gives its finite-temperature
+counterpart
+
+    q(mu, kT) = int dE (-df/dE) q(E),    f(E) = 1/(exp((E - mu)/kT) + 1),
+
+which for piecewise-linear q(E) is a linear combination of the grid values
+with coefficients known in closed form. Since -df/dE is negligible more than
+a few tens of kT from mu, and smooth on the scale of kT, the thermal weights
+need the zero-temperature weights only at grid energies near mu spaced by a
+fraction of kT. These are computed when first needed, in a single pass over
+the tetrahedra for all of the missing grid energies, and kept for later
+temperatures.
+'''
+from collections import OrderedDict
+import numpy as np
+from tetra.bands import _band_major
+from tetra.fused import FusedSweep, _sweep_block, _sweep_block_2d, _local_weights, _kahan_add
+from tetra.fermi import _minimum_E, _maximum_E
+
+# Number of tetrahedra processed at once by Weights; each expands to one row
+# per grid energy within its range of corner energies.
+_BLOCK_SIZE = 2**12
+
+class ThermalGrid:
+    '''The integrated density of states n(E) on an adaptive energy grid,
+    for finite-temperature calculations with the given tetrahedra and band
+    energies.
+
+    tetras = a list of tuples of the form (kN1, kN2, kN3, kN4) denoting the
+    vertices of tetrahedra to include in the summation, where the kN's are
+    indices of submesh (i.e. submesh[kN1] = k1, etc.). The tetrahedra must be
+    constructed as described in BJA94 Section III.
+
+    Eks = the eigenstate energies E_n(k) as a BandArray (see ksample.MakeEks),
+    or a list in which each element is a sorted list of eigenstate energies
+    E_n(k), with k being the k-point at the corresponding element of submesh
+    (i.e. Eks[kN][band_index] = E_n(k)).
+
+    tol = maximum estimated error, in number of states, of the linear
+    interpolation of n(E) on each grid interval.
+
+    num_initial = number of equally spaced energies in the initial grid,
+    which spans the range of the band energies.
+
+    max_points = maximum number of grid energies; each costs one sweep over
+    the tetrahedra.
+
+    max_cache_bytes = memory limit for the zero-temperature weights kept
+    for reuse by Weights at later temperatures.
+    '''
+    def __init__(self, tetras, Eks, tol=1e-5, num_initial=64, max_points=4096,
+            max_cache_bytes=2**28):
+        self.tetras = tetras
+        self.Eks = Eks
+        self.tol = tol
+        self.max_cache_bytes = max_cache_bytes
+        Emin, Emax = _minimum_E(Eks), _maximum_E(Eks)
+        if Emax == Emin:
+            Emax = Emin + 1.0
+        Es = list(np.linspace(Emin, Emax, max(num_initial, 2)))
+        sweeps = [FusedSweep(E, tetras, Eks, weights=False) for E in Es]
+        ns = [s.num_states for s in sweeps]
+        Ds = [s.dos for s in sweeps]
+        while len(Es) < max_points:
+            # Linear interpolation error of n(E) on [a, b] is estimated as
+            # (b - a) |D(b) - D(a)| / 8.
+            refine = [i for i in range(len(Es) - 1)
+                    if (Es[i+1] - Es[i])*abs(Ds[i+1] - Ds[i])/8 > tol]
+            if len(refine) == 0:
+                break
+            refine = refine[:max_points - len(Es)]
+            for i in reversed(refine):
+                E = (Es[i] + Es[i+1])/2
+                s = FusedSweep(E, tetras, Eks, weights=False)
+                Es.insert(i+1, E)
+                ns.insert(i+1, s.num_states)
+                Ds.insert(i+1, s.dos)
+        self.energies = np.array(Es)
+        self.num_states = np.array(ns)
+        self.dos = np.array(Ds)
+        self._weights = OrderedDict()
+
+    def NumStates(self, mu, kT):
+        '''Return the thermal number of states sum_{n,k} f(E_n(k)) at
+        chemical potential mu and temperature kT (in energy units).
+        '''
+        return float(np.dot(_thermal_coefficients(self.energies, mu, kT), self.num_states))
+
+    def FindChemicalPotential(self, num_electrons, kT):
+        '''Return the chemical potential mu at which NumStates(mu, kT) =
+        num_electrons.
+        '''
+        # Import scipy here rather than at module level, as in FindFermi.
+        from scipy.optimize import bisect
+        if not 0.0 < num_electrons < self.num_states[-1]:
+            raise ValueError("num_electrons must be between 0 and the number of states.")
+        def statecount_error(mu):
+            return self.NumStates(mu, kT) - num_electrons
+        lo = self.energies[0] - 40*kT
+        hi = self.energies[-1] + 40*kT
+        return bisect(statecount_error, lo, hi, xtol=1e-12*max(1.0, hi - lo))
+
+    def Weights(self, mu, kT, resolution=0.05, window=30.0):
+        '''Return the thermal integration weights w[n][j] at chemical
+        potential mu and temperature kT, as a numpy array with shape
+        (num_bands, num_ks); sum_{n,j} w[n][j] X_n(k_j) is the thermal
+        expectation value of X.
+
+        The zero-temperature weights are interpolated linearly between grid
+        energies spaced by up to resolution*kT, within window*kT of mu;
+        -df/dE is below exp(-window) outside this range. Grid energies are
+        skipped only where the interpolation error estimate of the grid
+        (see tol) still holds without them, so the weights sum to
+        NumStates(mu, kT) to within about tol.
+
+        The zero-temperature weights at these grid energies are kept (up to
+        max_cache_bytes) and reused by later calls, which then only contract
+        them with the thermal coefficients; weights at grid energies not yet
+        kept are computed together in one pass over the tetrahedra. If the
+        weights at all of the grid energies used do not fit in
+        max_cache_bytes, they are instead combined in a pass over the
+        tetrahedra made for this call alone. A pass costs one evaluation of
+        the weight formulas per (tetrahedron, band, grid energy) with the
+        grid energy inside the range of the tetrahedron's corner energies.
+        '''
+        nodes = self._weight_nodes(mu, kT, resolution, window)
+        coeffs = _thermal_coefficients(self.energies[nodes], mu, kT)
+        num_bands, num_ks = _band_major(self.Eks).shape
+        if len(nodes)*num_bands*num_ks*8 > self.max_cache_bytes:
+            return _thermal_weights(self.tetras, self.Eks, self.energies[nodes], coeffs)
+        ws = np.zeros((num_bands, num_ks), dtype=np.float64)
+        for c, w in zip(coeffs, self._zero_T_weights(nodes)):
+            if c != 0.0:
+                ws += c*w
+        return ws
+
+    def _weight_nodes(self, mu, kT, resolution, window):
+        '''Return the indices of a subset of the grid energies covering
+        [mu - window*kT, mu + window*kT], with consecutive energies at most
+        resolution*kT apart where the grid allows and each interval between
+        them meeting the interpolation error estimate used to build the grid.
+        '''
+        Es, Ds = self.energies, self.dos
+        lo = max(np.searchsorted(Es, mu - window*kT, side='right') - 1, 0)
+        hi = min(np.searchsorted(Es, mu + window*kT, side='left'), len(Es) - 1)
+        nodes = [lo]
+        for i in range(lo + 1, hi + 1):
+            # Keep grid energy i if it is the last, or if skipping it would
+            # leave a gap wider than resolution*kT or one on which n(E) is not
+            # linear to within tol.
+            if i == hi:
+                nodes.append(i)
+                continue
+            a = nodes[-1]
+            if (Es[i+1] - Es[a] > resolution*kT
+                    or (Es[i+1] - Es[a])*abs(Ds[i+1] - Ds[a])/8 > self.tol):
+                nodes.append(i)
+        return np.array(nodes)
+
+    def Occupations(self, num_electrons, kTs):
+        '''Return a list of (mu, weights) for each temperature in kTs, with
+        mu found from num_electrons (see FindChemicalPotential and Weights).
+        '''
+        results = []
+        for kT in kTs:
+            mu = self.FindChemicalPotential(num_electrons, kT)
+            results.append((mu, self.Weights(mu, kT)))
+        return results
+
+    def _zero_T_weights(self, nodes):
+        '''Return the list of zero-temperature weights at the grid energies
+        with the given indices, computing those not kept from earlier calls.
+        '''
+        missing = [i for i in nodes if i not in self._weights]
+        if len(missing) > 0:
+            computed = _node_weights(self.tetras, self.Eks, self.energies[missing])
+            for i, ws in zip(missing, computed):
+                self._weights[i] = ws
+        result = []
+        for i in nodes:
+            self._weights.move_to_end(i)
+            result.append(self._weights[i])
+        # Evict the least recently used weights; those just returned are the
+        # most recent.
+        node_bytes = result[0].nbytes
+        while len(self._weights)*node_bytes > self.max_cache_bytes:
+            self._weights.popitem(last=False)
+        return result
+
+def _thermal_weights(tetras, Eks, Es, coeffs):
+    '''Return sum_i coeffs[i] w(Es[i]), where w(E) are the zero-temperature
+    integration weights of FusedSweep with Fermi energy E and the energies
+    Es are in ascending order.
+    '''
+    tetras = np.asarray(tetras, dtype=np.intp)
+    Es_by_band = _band_major(Eks)
+    num_bands, num_ks = Es_by_band.shape
+    num_tetra, num_corners = tetras.shape
+    V = 1.0 / num_tetra
+    # coeffs_above[i] = sum(coeffs[i:]); above its highest corner energy, a
+    # tetrahedron has weight V/num_corners at each corner.
+    coeffs_above = np.append(np.cumsum(coeffs[::-1])[::-1], 0.0)
+    ws = np.zeros((num_bands, num_ks), dtype=np.float64)
+    ws_comp = np.zeros((num_bands, num_ks), dtype=np.float64)
+    for band_index, tet_block, hi, entry, node, w_entry in _node_entries(tetras,
+            Es_by_band, Es):
+        w_T = np.repeat((V/num_corners)*coeffs_above[hi][:, np.newaxis], num_corners, axis=1)
+        if len(entry) > 0:
+            w_entry *= coeffs[node][:, np.newaxis]
+            for j in range(num_corners):
+                w_T[:, j] += np.bincount(entry, weights=w_entry[:, j],
+                        minlength=len(tet_block))
+        k_lo, ws_local = _local_weights(tet_block, w_T)
+        k_range = slice(k_lo, k_lo + len(ws_local))
+        _kahan_add(ws[band_index, k_range], ws_comp[band_index, k_range], ws_local)
+    ws -= ws_comp
+    return ws
+
+def _node_weights(tetras, Eks, Es):
+    '''Return the zero-temperature integration weights of FusedSweep with
+    Fermi energy E for each of the energies Es, which are in ascending
+    order, as an array with shape (len(Es), num_bands, num_ks).
+    '''
+    tetras = np.asarray(tetras, dtype=np.intp)
+    Es_by_band = _band_major(Eks)
+    num_bands, num_ks = Es_by_band.shape
+    num_tetra, num_corners = tetras.shape
+    V = 1.0 / num_tetra
+    ws = np.zeros((len(Es), num_bands, num_ks), dtype=np.float64)
+    # Above its highest corner energy, a tetrahedron has weight
+    # V/num_corners at each corner; these are added to ws[hi] here and
+    # carried to the higher energies by a cumulative sum.
+    ws_above = np.zeros((len(Es) + 1, num_bands, num_ks), dtype=np.float64)
+    for band_index, tet_block, hi, entry, node, w_entry in _node_entries(tetras,
+            Es_by_band, Es):
+        for j in range(num_corners):
+            np.add.at(ws_above, (hi, band_index, tet_block[:, j]), V/num_corners)
+            if len(entry) > 0:
+                np.add.at(ws, (node, band_index, tet_block[entry, j]), w_entry[:, j])
+    ws += np.cumsum(ws_above[:-1], axis=0)
+    return ws
+
+def _node_entries(tetras, Es_by_band, Es):
+    '''Yield (band_index, tet_block, hi, entry, node, w_entry) for each band
+    and block of tetrahedra: Es[hi] is the lowest energy above the highest
+    corner energy of each tetrahedron, and w_entry[i] are the weights of
+    tetrahedron entry[i] at the energy Es[node[i]], for each energy within
+    (E1, E4] of a tetrahedron.
+    '''
+    num_tetra, num_corners = tetras.shape
+    sweep_block = _sweep_block if num_corners == 4 else _sweep_block_2d
+    for band_index in range(Es_by_band.shape[0]):
+        for start in range(0, num_tetra, _BLOCK_SIZE):
+            tet_block = tetras[start:start+_BLOCK_SIZE]
+            corner_Es = Es_by_band[band_index][tet_block].astype(np.float64, copy=False)
+            # Energies Es[lo:hi] are within (E1, E4] of each tetrahedron.
+            lo = np.searchsorted(Es, corner_Es.min(axis=1), side='right')
+            hi = np.searchsorted(Es, corner_Es.max(axis=1), side='right')
+            counts = hi - lo
+            entry = np.repeat(np.arange(len(tet_block)), counts)
+            w_entry = None
+            node = None
+            if len(entry) > 0:
+                first = np.repeat(np.cumsum(counts) - counts, counts)
+                node = lo[entry] + np.arange(len(entry)) - first
+                w_entry = sweep_block(Es[node], corner_Es[entry], num_tetra, True)[2]
+            yield band_index, tet_block, hi, entry, node, w_entry
+
+def _thermal_coefficients(Es, mu, kT):
+    '''Return c such that int dE (-df/dE) q(E) = sum_i c[i] q(Es[i]) for
+    q(E) linear between the energies Es, 0 below Es[0] and q(Es[-1]) above
+    Es[-1].
+    '''
+    if kT <= 0.0:
+        raise ValueError("kT must be positive.")
+    if len(Es) == 1:
+        return np.array([np.exp(-np.logaddexp(0.0, (Es[0] - mu)/kT))])
+    x = (Es - mu)/kT
+    # f and g = 1 - f, with antiderivatives F and G, each evaluated without
+    # cancellation in its tail.
+    f = np.exp(-np.logaddexp(0.0, x))
+    g = np.exp(-np.logaddexp(0.0, -x))
+    F = -kT*np.logaddexp(0.0, -x)
+    G = kT*np.logaddexp(0.0, x)
+    h = np.diff(Es)
+    # On each interval [a, b], A = f(a) - f(b) and
+    # B = int_a^b (f(E) - f(b)) dE / (b - a); below mu these are written in
+    # terms of g, which is small there.
+    occupied = (Es[:-1] + Es[1:])/2 < mu
+    A = np.where(occupied, g[1:] - g[:-1], f[:-1] - f[1:])
+    B = np.where(occupied, g[1:] - (G[1:] - G[:-1])/h, (F[1:] - F[:-1])/h - f[1:])
+    c = np.zeros(len(Es))
+    c[:-1] += A - B
+    c[1:] += B
+    c[-1] += f[-1]
+    return c
@@ -0,0 +1,96 @@
+import unittest
+import numpy as np
+from tetra import thermal
+from tetra.thermal import ThermalGrid, _thermal_coefficients
+from tetra.benchmark import CubicSBand, HexagonalMultiBand
+from tetra.plan import GetMeshPlan
+from tetra.ksample import MakeEks
+from tetra.fermi import FindFermi
+from tetra.fused import FusedSweep
+
+def _setup(model, n):
+    plan = GetMeshPlan(n, model.R)
+    return plan, MakeEks(model.Efn, plan.submesh, plan.G_order, plan.G_neg)
+
+class TestThermalGrid(unittest.TestCase):
+    def test_particle_hole(self):
+        model = CubicSBand()
+        plan, Eks = _setup(model, 8)
+        grid = ThermalGrid(plan.tetras, Eks)
+        for kT in (0.01, 0.1, 1.0):
+            self.assertAlmostEqual(grid.FindChemicalPotential(model.num_electrons, kT), 0.0,
+                    places=6)
+
+    def test_low_temperature(self):
+        model = HexagonalMultiBand()
+        plan, Eks = _setup(model, 6)
+        grid = ThermalGrid(plan.tetras, Eks)
+        E_Fermi = FindFermi(model.num_electrons, plan.tetras, Eks)
+        mu = grid.FindChemicalPotential(model.num_electrons, 1e-5)
+        self.assertAlmostEqual(mu, E_Fermi, places=4)
+        ws = grid.Weights(mu, 1e-5)
+        ws_0 = FusedSweep(E_Fermi, plan.tetras, Eks).weights
+        self.assertTrue(np.allclose(ws, ws_0, rtol=0.0, atol=1e-2*np.max(ws_0)))
+
+    def test_weights(self):
+        model = HexagonalMultiBand()
+        plan, Eks = _setup(model, 6)
+        grid = ThermalGrid(plan.tetras, Eks)
+        kT = 0.05
+        mu = grid.FindChemicalPotential(model.num_electrons, kT)
+        ws = grid.Weights(mu, kT)
+        self.assertAlmostEqual(float(np.sum(ws)), model.num_electrons, places=5)
+        # Thermal n(mu) from a dense quadrature of D(E) against f(E).
+        Es = np.linspace(grid.energies[0] - 1.0, grid.energies[-1] + 1.0, 1201)
+        dos = np.array([FusedSweep(E, plan.tetras, Eks, weights=False).dos for E in Es])
+        f = 1.0/(np.exp((Es - mu)/kT) + 1.0)
+        num_states = np.sum((dos*f)[1:] + (dos*f)[:-1])*(Es[1] - Es[0])/2
+        self.assertAlmostEqual(num_states, model.num_electrons, places=3)
+        # The single pass matches the sum of zero-temperature weights.
+        nodes = grid._weight_nodes(mu, kT, 0.05, 30.0)
+        coeffs = _thermal_coefficients(grid.energies[nodes], mu, kT)
+        expected = sum(c*FusedSweep(grid.energies[i], plan.tetras, Eks).weights
+                for i, c in zip(nodes, coeffs))
+        self.assertTrue(np.allclose(ws, expected, rtol=1e-12, atol=1e-16))
+        self.assertLess(len(nodes), 4*30.0/0.05)
+
+    def test_weights_num_states(self):
+        model = HexagonalMultiBand()
+        plan, Eks = _setup(model, 5)
+        grid = ThermalGrid(plan.tetras, Eks)
+        for kT in (0.01, 0.05, 0.3, 1.0, 3.0):
+            mu = grid.FindChemicalPotential(model.num_electrons, kT)
+            self.assertAlmostEqual(float(np.sum(grid.Weights(mu, kT))), model.num_electrons,
+                    places=6)
+
+    def test_reuse_weights(self):
+        model = HexagonalMultiBand()
+        plan, Eks = _setup(model, 5)
+        grid = ThermalGrid(plan.tetras, Eks)
+        kTs = (0.05, 0.1, 0.3)
+        results = grid.Occupations(model.num_electrons, kTs)
+        for i in list(grid._weights)[::50]:
+            expected = FusedSweep(grid.energies[i], plan.tetras, Eks).weights
+            self.assertTrue(np.allclose(grid._weights[i], expected, rtol=1e-12, atol=1e-18))
+        # Later temperatures reuse the kept zero-temperature weights without
+        # another pass over the tetrahedra.
+        node_weights = thermal._node_weights
+        def fail(*args):
+            raise AssertionError("unexpected pass over the tetrahedra")
+        thermal._node_weights = fail
+        try:
+            again = grid.Occupations(model.num_electrons, kTs)
+        finally:
+            thermal._node_weights = node_weights
+        # Without room to keep the weights, each call makes its own pass.
+        uncached = ThermalGrid(plan.tetras, Eks, max_cache_bytes=0)
+        for (mu, ws), (mu_again, ws_again), (mu_uncached, ws_uncached) in zip(results,
+                again, uncached.Occupations(model.num_electrons, kTs)):
+            self.assertEqual(mu, mu_again)
+            self.assertTrue((ws == ws_again).all())
+            self.assertEqual(mu, mu_uncached)
+            self.assertTrue(np.allclose(ws, ws_uncached, rtol=1e-12, atol=1e-18))
+        self.assertEqual(len(uncached._weights), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+'''Two-dimensional counterparts of the tetrahedron contributions (the
+triangle method), for layered systems whose bands do not depend on k3.
+
+The Brillouin zone of the plane is divided into triangles (see
+submesh.MakeTriangles) and E_n(k) is interpolated linearly within each
+triangle. With the corner energies sorted as E1 <= E2 <= E3 and V the
+fraction of the zone covered by the triangle, the occupied part of a
+triangle with E1 < E <= E2 is a similar triangle at the corner E1 with
+area fraction V*a*b, where a = (E - E1)/(E2 - E1) and b = (E - E1)/(E3 - E1);
+for E2 < E <= E3 the unoccupied part is a similar triangle at the corner E3.
+The integration weights are the integrals of the linear interpolation
+functions over the occupied part. There is no curvature correction.
+
+These functions are used by NumStatesContrib, DosContrib and WeightContrib
+when the simplex passed to them has three corners.
+'''
+
+def NumStatesContrib2D(E, triangle, num_triangle, Eks, band_index):
+    '''Return the contribution to n(E) from the specified triangle and band
+    index.
+
+    triangle = a tuple of the form (kN1, kN2, kN3) denoting the vertices of a
+    triangle, where the kN's are indices of submesh (see
+    submesh.MakeTriangles).
+
+    num_triangle = total number of triangles in the full Brillouin zone.
+
+    Eks = a list in which each element is a sorted list of eigenstate energies
+    E_n(k), with k being the k-point at the corresponding element of submesh
+    (i.e. Eks[kN][band_index] = E_n(k)).
+
+    band_index = the band index n to consider, corresponding to n in E_n(k).
+    '''
+    E1, E2, E3 = sorted(Eks[kN][band_index] for kN in triangle)
+    V = 1.0/num_triangle
+    if E <= E1:
+        return 0.0
+    elif E <= E2:
+        return V * (E - E1)**2 / ((E2 - E1)*(E3 - E1))
+    elif E <= E3:
+        return V * (1.0 - (E3 - E)**2 / ((E3 - E1)*(E3 - E2)))
+    else:
+        return V
+
+def DosContrib2D(E, triangle, num_triangle, Eks, band_index):
+    '''Return the contribution to D(E) from the specified triangle and band
+    index. The arguments are as for NumStatesContrib2D.
+    '''
+    E1, E2, E3 = sorted(Eks[kN][band_index] for kN in triangle)
+    V = 1.0/num_triangle
+    if E <= E1:
+        return 0.0
+    elif E <= E2:
+        return V * 2*(E - E1) / ((E2 - E1)*(E3 - E1))
+    elif E <= E3:
+        return V * 2*(E3 - E) / ((E3 - E1)*(E3 - E2))
+    else:
+        return 0.0
+
+def WeightContrib2D(E_Fermi, triangle, num_triangle, Eks, band_index):
+    '''Return the specified triangle's contribution to the integration
+    weights at the k-points of its vertices, as a list in the order of the
+    vertices in triangle. The arguments are as for NumStatesContrib2D.
+    '''
+    Es = [Eks[kN][band_index] for kN in triangle]
+    order = sorted(range(3), key=lambda i: Es[i])
+    E1, E2, E3 = [Es[i] for i in order]
+    V = 1.0/num_triangle
+    if E_Fermi <= E1:
+        sorted_ws = [0.0, 0.0, 0.0]
+    elif E_Fermi <= E2:
+        a = (E_Fermi - E1)/(E2 - E1)
+        b = (E_Fermi - E1)/(E3 - E1)
+        C = V*a*b/3
+        sorted_ws = [C*(3 - a - b), C*a, C*b]
+    elif E_Fermi <= E3:
+        c = (E3 - E_Fermi)/(E3 - E1)
+        d = (E3 - E_Fermi)/(E3 - E2)
+        C = V*c*d/3
+        sorted_ws = [V/3 - C*c, V/3 - C*d, V/3 - C*(3 - c - d)]
+    else:
+        sorted_ws = [V/3, V/3, V/3]
+    ws = [0.0]*3
+    for sorted_index, i in enumerate(order):
+        ws[i] = sorted_ws[sorted_index]
+    return ws
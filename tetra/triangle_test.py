@@ -0,0 +1,72 @@
+import unittest
+from math import cos, fsum, pi
+import numpy as np
+from scipy.special import ellipk
+from tetra.fermi import FindFermiToTol
+from tetra.dos import DosValues
+from tetra.sum import SumEnergy
+from tetra.numstates import NumStatesContrib
+from tetra.dos import DosContrib
+from tetra.weights import WeightContrib
+from tetra.fused import FusedSweep
+from tetra.plan import GetMeshPlan
+from tetra.ksample import MakeEks
+from tetra.submesh import MakeSubmesh2D, MakeTriangles, NumKs
+
+def _square_Efn(k):
+    # Nearest-neighbor square lattice, t = 1; independent of k[2].
+    return [-2.0*(cos(2*pi*k[0]) + cos(2*pi*k[1]))]
+
+def _two_band_Efn(k):
+    E = -2.0*(cos(2*pi*k[0]) + cos(2*pi*k[1]) - 0.3*cos(2*pi*(k[0] + k[1])))
+    return sorted([E, 1.5 - 0.5*E])
+
+class TestTriangle(unittest.TestCase):
+    def test_mesh(self):
+        self.assertEqual(len(MakeSubmesh2D((3, 2))), NumKs((3, 2)))
+        triangles = MakeTriangles((3, 2))
+        self.assertEqual(len(triangles), 2*3*2)
+        plan = GetMeshPlan((3, 2))
+        self.assertEqual(plan.tetras.tolist(), triangles)
+        self.assertTrue(np.allclose(plan.submesh, MakeSubmesh2D((3, 2))))
+
+    def test_matches_contrib_sums(self):
+        R = np.array([[1.0, 0.0, 0.0], [-0.5, 0.9, 0.0], [0.0, 0.0, 1.0]])
+        plan = GetMeshPlan((5, 4), R)
+        Eks = MakeEks(_two_band_Efn, plan.submesh, plan.G_order, plan.G_neg)
+        tris = [tuple(int(kN) for kN in tri) for tri in plan.tetras]
+        Eks_list = [list(Eks[kN]) for kN in range(len(plan.submesh))]
+        num_tri = len(tris)
+        for E in (-6.0, -2.0, Eks[0][0], 0.4, 1.8, 6.0):
+            result = FusedSweep(E, plan.tetras, Eks)
+            n = fsum(NumStatesContrib(E, tri, num_tri, Eks_list, b)
+                    for tri in tris for b in range(2))
+            D = fsum(DosContrib(E, tri, num_tri, Eks_list, b)
+                    for tri in tris for b in range(2))
+            ws = np.zeros((2, len(plan.submesh)))
+            for tri in tris:
+                for b in range(2):
+                    for kN, w in zip(tri, WeightContrib(E, tri, num_tri, Eks_list, b)):
+                        ws[b, kN] += w
+            self.assertAlmostEqual(result.num_states, n, places=12)
+            self.assertAlmostEqual(result.dos, D, places=12)
+            self.assertTrue(np.allclose(result.weights, ws, rtol=0.0, atol=1e-15))
+            # Without a curvature correction, the weights sum to n(E).
+            self.assertAlmostEqual(np.sum(result.weights), n, places=12)
+
+    def test_square_lattice(self):
+        # Particle-hole symmetry puts E_F at 0 for half filling, on any even
+        # submesh.
+        E_F = FindFermiToTol((8, 8), _square_Efn, None, 0.5)
+        self.assertAlmostEqual(E_F, 0.0, places=8)
+        # D(E) = K(1 - (E/4t)**2) / (2 pi**2 t), with K the complete
+        # elliptic integral of the first kind (parameter m = k**2).
+        dos_vals, E_vals = DosValues(-3.0, -1.0, 3, (64, 64), _square_Efn, None)[:2]
+        for D, E in zip(dos_vals, E_vals):
+            self.assertAlmostEqual(D, ellipk(1 - (E/4)**2)/(2*pi**2), places=3)
+        # Band energy of the half-filled band is -8 t/pi**2.
+        energy = SumEnergy((16, 16), _square_Efn, None, 0.5, 1e-4)[0]
+        self.assertAlmostEqual(energy, -8/pi**2, places=3)
+
+if __name__ == "__main__":
+    unittest.main()
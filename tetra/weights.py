@@ -1,9 +1,11 @@
 from tetra.dos import DosContrib
+from tetra.fused import FusedSweep
+from tetra.triangle import WeightContrib2D
 
 def Weights(E_Fermi, tetras, Eks):
-    '''Return a list in which each element is a list of integration weights.
-    The first index for the returned list specifies a band index, and the
-    second list specifies a k-point index; i.e. the returned list
+    '''Return a numpy array of integration weights with shape
+    (num_bands, num_ks). The first index specifies a band index, and the
+    second index specifies a k-point index; i.e. the returned array
     w[n][j] = w_{nj}.
     The calculation of w_{nj} is implemented as described in BJA94 Appendix B
     and Section V.
@@ -15,35 +17,15 @@ def Weights(E_Fermi, tetras, Eks):
     indices of submesh (i.e. submesh[kN1] = k1, etc.). The tetrahedra must be
     constructed as described in BJA94 Section III.
 
-    Eks = a list in which each element is a sorted list of eigenstate energies
+    Eks = the eigenstate energies E_n(k) as a BandArray (see ksample.MakeEks),
+    or a list in which each element is a sorted list of eigenstate energies
     E_n(k), with k being the k-point at the corresponding element of submesh
     (i.e. Eks[kN][band_index] = E_n(k)).
+
+    The weights are accumulated band by band over contiguous rows of Eks;
+    see fused.FusedSweep.
     '''
-    num_bands = len(Eks[0])
-    num_ks = len(Eks)
-    num_tetra = len(tetras)
-    # Initialize weights to 0.
-    # Initialize cs for Kahan.
-    ws, cs = [], []
-    for band_index in range(num_bands):
-        ws.append([])
-        cs.append([])
-        for k_index in range(num_ks):
-            ws[band_index].append(0.0)
-            cs[band_index].append(0.0)
-    # Calculate weights.
-    for tet in tetras:
-        for band_index in range(num_bands):
-            # Get contributions to ws from this tetrahedron and band.
-            tb_ws = WeightContrib(E_Fermi, tet, num_tetra, Eks, band_index)
-            # Add this tetrahedron's contributions to the associated k-points.
-            for i, k_index in enumerate(tet):
-                y = tb_ws[i] - cs[band_index][k_index]
-                t = ws[band_index][k_index] + y
-                cs[band_index][k_index] = (t - ws[band_index][k_index]) - y
-                ws[band_index][k_index] = t
-
-    return ws
+    return FusedSweep(E_Fermi, tetras, Eks).weights
 
 def WeightContrib(E_Fermi, tetra, num_tetra, Eks, band_index):
     '''Return the specified tetrahedron's contribution to the integration
@@ -68,7 +50,12 @@ def WeightContrib(E_Fermi, tetra, num_tetra, Eks, band_index):
     (i.e. Eks[kN][band_index] = E_n(k)).
 
     band_index = the band index n to consider, corresponding to n in E_n(k).
+
+    If tetra has three vertices, it is taken to be a triangle of a
+    two-dimensional submesh (see triangle.WeightContrib2D).
     '''
+    if len(tetra) == 3:
+        return WeightContrib2D(E_Fermi, tetra, num_tetra, Eks, band_index)
     (E1, E2, E3, E4), i_vals = _tetra_Es_ks(tetra, band_index, Eks)
     ws = [None]*4
     if E_Fermi <= E1: